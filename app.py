@@ -48,22 +48,26 @@ app.config["SESSION_COOKIE_SAMESITE"] = "Strict"
 app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(hours=8)
 app.config["SESSION_REFRESH_EACH_REQUEST"] = True
 
-# Configure the database
+# Configure the database (per-backend pool and connection settings, see engine_profile.py)
+from engine_profile import engine_options, install_engine_events
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///team_collaboration.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
 
 # Initialize the app with the extension
 db.init_app(app)
+with app.app_context():
+    install_engine_events(db.engine)
 
 # Initialize SocketIO with session handling
 if os.environ.get("FLASK_ENV") == "production":
     cors_origins = os.environ.get("CORS_ALLOWED_ORIGINS", "https://yourdomain.com").split(",")
 else:
     cors_origins = "*"
-socketio = SocketIO(app, cors_allowed_origins=cors_origins, manage_session=False)
+# Multi-worker deployments share broadcasts through a message queue
+# (redis://..., amqp://... or unix:///run/wispr/socketio, see pubsub.py)
+from pubsub import socketio_queue_options
+socketio = SocketIO(app, cors_allowed_origins=cors_origins, manage_session=False,
+                    **socketio_queue_options(os.environ.get("SOCKETIO_MESSAGE_QUEUE")))
 
 # Enable CSRF protection
 csrf = CSRFProtect(app)
@@ -77,17 +81,25 @@ if os.environ.get("FLASK_ENV") == "production":
     # For Redis: set SESSION_TYPE='redis' and configure SESSION_REDIS
     Session(app)
 
-# Rate limiting
+# Rate limiting (use a shared storage such as redis:// when running several workers)
 limiter = Limiter(
     get_remote_address,
     app=app,
-    default_limits=["200 per day", "50 per hour"]
+    default_limits=["200 per day", "50 per hour"],
+    storage_uri=os.environ.get("RATELIMIT_STORAGE_URI", "memory://")
 )
 
 with app.app_context():
     # Import models to ensure tables are created
     import models
     db.create_all()
+    from migrations import run_migrations
+    run_migrations()
+    import query_plans  # flask check-query-plans
+    from search import ensure_search_index
+    ensure_search_index()
+    from reactions import backfill_reaction_counts
+    backfill_reaction_counts()
     
     # Create default admin user if it doesn't exist
     from werkzeug.security import generate_password_hash
@@ -105,6 +117,8 @@ with app.app_context():
 
 # Import routes
 import routes
+# Per-request statement counts, N+1 detection and the slow-query log
+import sql_profiler
 
 @app.context_processor
 def inject_csrf_token():
@@ -0,0 +1,274 @@
+"""Content-addressed storage for chat attachments.
+
+Uploads are streamed in chunks to a temporary file while their SHA-256 is
+computed, fsynced and atomically renamed to
+``uploads/blobs/<first two hex digits>/<sha256>``, so a file posted in five
+rooms is stored once. AttachmentBlob rows count the MessageAttachment rows
+that point at each blob. Blobs nobody references are removed by
+``flask attachments-gc`` once ATTACHMENT_GC_GRACE seconds have passed since
+they were last uploaded or released, and ``flask attachments-verify``
+re-hashes the store to detect corrupted files.
+
+The client gets a signed upload token rather than the bare hash, so a message
+can only attach blobs that its author uploaded.
+"""
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+import click
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import app, db
+from models import AttachmentBlob, AttachmentPreview, MessageAttachment
+
+# Bytes read from the request and hashed per step
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Seconds an unreferenced blob (or an unused upload token) is kept
+ATTACHMENT_GC_GRACE = int(os.environ.get('ATTACHMENT_GC_GRACE', 24 * 3600))
+BLOB_DIR = 'blobs'
+THUMB_DIR = 'thumbs'
+TMP_DIR = 'tmp'
+# Thumbnail formats written for every previewable blob, by file extension
+THUMB_FORMATS = {'webp': 'image/webp', 'jpg': 'image/jpeg'}
+
+ALLOWED_UPLOAD_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.pdf', '.txt', '.docx'}
+ALLOWED_UPLOAD_MIME_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'application/pdf', 'text/plain', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'}
+
+StoredBlob = namedtuple('StoredBlob', ['sha256', 'size'])
+
+_tokens = URLSafeTimedSerializer(app.secret_key, salt='wispr-attachment')
+
+
+def upload_dir():
+    return os.path.join(app.root_path, 'uploads')
+
+
+def is_allowed_upload(filename, content_type):
+    extension = os.path.splitext(filename)[1].lower()
+    return extension in ALLOWED_UPLOAD_EXTENSIONS and (not content_type or content_type in ALLOWED_UPLOAD_MIME_TYPES)
+
+
+def blob_relpath(sha256):
+    """Blob location relative to the uploads directory, as stored in MessageAttachment.filename"""
+    return os.path.join(BLOB_DIR, sha256[:2], sha256)
+
+
+def blob_path(sha256):
+    return os.path.join(upload_dir(), blob_relpath(sha256))
+
+
+def thumb_relpath(sha256, extension):
+    """Thumbnail location relative to the uploads directory (extension: a THUMB_FORMATS key)"""
+    return os.path.join(THUMB_DIR, sha256[:2], f'{sha256}.{extension}')
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _insert(dialect):
+    return postgresql.insert if dialect == 'postgresql' else sqlite.insert
+
+
+def store_stream(stream):
+    """Stream a file into the blob store, deduplicating by content; returns a StoredBlob"""
+    tmp_dir = os.path.join(upload_dir(), TMP_DIR)
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        digest = hashlib.sha256()
+        size = 0
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+        blob = StoredBlob(digest.hexdigest(), size)
+        _publish(tmp_path, blob)
+        return blob
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def _publish(tmp_path, blob):
+    """Record the blob and move its file into place unless an identical one is there"""
+    now = datetime.utcnow()
+    # Upsert before touching the file: the row lock keeps a concurrent
+    # collect_garbage from deleting this blob between the check and the commit
+    stmt = _insert(db.engine.dialect.name)(AttachmentBlob).values(
+        sha256=blob.sha256, size=blob.size, ref_count=0, created_at=now, touched_at=now)
+    db.session.execute(stmt.on_conflict_do_update(index_elements=['sha256'], set_={'touched_at': now}))
+    path = blob_path(blob.sha256)
+    try:
+        if os.path.exists(path) and os.path.getsize(path) == blob.size:
+            logging.info(f"Deduplicated upload of blob {blob.sha256}")
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+            _fsync_dir(os.path.dirname(path))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def issue_token(blob, original_filename, file_type, user_id):
+    """Signed reference to an upload that its uploader can attach to a message"""
+    return _tokens.dumps({
+        'sha256': blob.sha256,
+        'size': blob.size,
+        'name': original_filename,
+        'type': file_type,
+        'user_id': user_id
+    })
+
+
+def attach(message, tokens, user_id):
+    """Add the uploads behind ``tokens`` to a new message and take blob references.
+
+    Call before the message is saved so the attachment rows and reference
+    counts are committed with it. Raises ValueError for tokens that are
+    invalid, expired or belong to another user.
+    """
+    uploads = []
+    for token in tokens:
+        try:
+            upload = _tokens.loads(token, max_age=ATTACHMENT_GC_GRACE)
+        except BadSignature:
+            raise ValueError('Invalid or expired attachment, please upload it again')
+        if upload['user_id'] != user_id:
+            raise ValueError('Invalid attachment')
+        uploads.append(upload)
+
+    for sha256, count in Counter(upload['sha256'] for upload in uploads).items():
+        updated = db.session.execute(db.update(AttachmentBlob).where(AttachmentBlob.sha256 == sha256).values(
+            ref_count=AttachmentBlob.ref_count + count)).rowcount
+        if not updated:
+            db.session.rollback()
+            raise ValueError('Attachment expired, please upload it again')
+
+    for upload in uploads:
+        message.attachments.append(MessageAttachment(
+            filename=blob_relpath(upload['sha256']),
+            original_filename=upload['name'],
+            file_size=upload['size'],
+            file_type=upload['type'],
+            blob_sha256=upload['sha256']
+        ))
+
+
+def release_attachments(message_ids):
+    """Delete the attachments of some messages and drop their blob references.
+
+    ``message_ids`` is a list or a select of ChatMessage ids. Call before the
+    messages themselves are deleted; the caller commits.
+    """
+    counts = db.session.query(MessageAttachment.blob_sha256, func.count(MessageAttachment.id)).filter(
+        MessageAttachment.message_id.in_(message_ids), MessageAttachment.blob_sha256.isnot(None)
+    ).group_by(MessageAttachment.blob_sha256).all()
+    now = datetime.utcnow()
+    for sha256, count in counts:
+        db.session.execute(db.update(AttachmentBlob).where(AttachmentBlob.sha256 == sha256).values(
+            ref_count=AttachmentBlob.ref_count - count, touched_at=now))
+    db.session.execute(
+        db.delete(MessageAttachment).where(MessageAttachment.message_id.in_(message_ids)),
+        execution_options={'synchronize_session': False})
+
+
+def collect_garbage(grace=ATTACHMENT_GC_GRACE):
+    """Delete blobs unreferenced for ``grace`` seconds and stale temp files; returns blobs removed"""
+    referenced = db.select(func.count(MessageAttachment.id)).where(
+        MessageAttachment.blob_sha256 == AttachmentBlob.sha256).scalar_subquery()
+    # Messages removed by ORM cascades (e.g. replies) bypass release_attachments,
+    # so repair the counts from the attachment rows before trusting them
+    db.session.execute(db.update(AttachmentBlob).where(AttachmentBlob.ref_count != referenced).values(
+        ref_count=referenced, touched_at=datetime.utcnow()))
+    db.session.commit()
+
+    cutoff = datetime.utcnow() - timedelta(seconds=grace)
+    candidates = db.session.query(AttachmentBlob.sha256).filter(
+        AttachmentBlob.ref_count <= 0, AttachmentBlob.touched_at < cutoff).all()
+    removed = 0
+    for (sha256,) in candidates:
+        db.session.execute(db.delete(AttachmentPreview).where(AttachmentPreview.blob_sha256 == sha256))
+        deleted = db.session.execute(db.delete(AttachmentBlob).where(
+            AttachmentBlob.sha256 == sha256, AttachmentBlob.ref_count <= 0,
+            AttachmentBlob.touched_at < cutoff, referenced == 0)).rowcount
+        if not deleted:
+            # Uploaded or attached again since the candidates were listed
+            db.session.rollback()
+            continue
+        # Unlink while the delete is uncommitted so a concurrent upload of
+        # the same content waits for us and then writes the file again
+        for path in [blob_path(sha256)] + [os.path.join(upload_dir(), thumb_relpath(sha256, extension))
+                                           for extension in THUMB_FORMATS]:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        db.session.commit()
+        removed += 1
+
+    tmp_dir = os.path.join(upload_dir(), TMP_DIR)
+    if os.path.isdir(tmp_dir):
+        for name in os.listdir(tmp_dir):
+            path = os.path.join(tmp_dir, name)
+            # Left behind by uploads interrupted by a crash
+            if os.path.getmtime(path) < time.time() - grace:
+                os.unlink(path)
+    return removed
+
+
+def verify_blobs():
+    """Re-hash every stored blob; returns the hashes whose file is missing or corrupted"""
+    damaged = []
+    for sha256, size in db.session.query(AttachmentBlob.sha256, AttachmentBlob.size).yield_per(500):
+        digest = hashlib.sha256()
+        try:
+            with open(blob_path(sha256), 'rb') as f:
+                for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+        except FileNotFoundError:
+            damaged.append(sha256)
+            continue
+        if digest.hexdigest() != sha256:
+            damaged.append(sha256)
+    return damaged
+
+
+@app.cli.command('attachments-gc')
+@click.option('--grace', default=ATTACHMENT_GC_GRACE, show_default=True,
+              help='Seconds an unreferenced blob is kept.')
+def attachments_gc_command(grace):
+    """Delete expired uploads and attachment blobs that no message references."""
+    from resumable_uploads import expire_uploads
+    click.echo(f"Removed {expire_uploads()} expired uploads")
+    click.echo(f"Removed {collect_garbage(grace)} unreferenced blobs")
+
+
+@app.cli.command('attachments-verify')
+def attachments_verify_command():
+    """Check every attachment blob against its SHA-256."""
+    damaged = verify_blobs()
+    for sha256 in damaged:
+        click.echo(f"Missing or corrupted: {sha256}")
+    if damaged:
+        raise SystemExit(1)
+    click.echo("All blobs verified")
@@ -0,0 +1,177 @@
+"""Profile pictures, rendered off the request path in several sizes.
+
+An uploaded picture is saved as-is and handed to the media.py renderer pool,
+which crops it square and writes every AVATAR_SIZES size as WebP and JPEG to
+``static/profile_pics/user_<id>_<version>_<size>.<ext>``. The version is a
+hash of the upload, so a new picture gets new URLs and responses can be
+cached as immutable. Once the variants exist the user's ``profile_pic``
+becomes ``user_<id>_<version>``, the previous variants are deleted and
+clients are sent ``user_avatar_updated``.
+
+Profile pictures stored before variants existed (``user_<id>.jpg``) are
+served as they are until ``flask avatars-rebuild`` converts them.
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+
+import click
+from PIL import Image, UnidentifiedImageError
+
+from app import app, db, socketio
+from identity import identity_cache
+from media import media_pipeline
+from metrics import upload_bytes
+from models import User
+
+# Square sizes rendered for every avatar, in pixels
+AVATAR_SIZES = (32, 64, 256)
+# Largest accepted upload
+MAX_AVATAR_UPLOAD_SIZE = 1 * 1024 * 1024  # 1MB
+# Versioned avatar URLs never change content
+AVATAR_CACHE_MAX_AGE = 365 * 24 * 3600
+AVATAR_FOLDER = os.path.join('static', 'profile_pics')
+AVATAR_UPLOAD_FORMATS = {'PNG', 'JPEG'}
+# Variant formats, by file extension
+AVATAR_FORMATS = {'webp': 'image/webp', 'jpg': 'image/jpeg'}
+DEFAULT_AVATAR_URL = '/static/default_avatar.png'
+
+VARIANT_NAME = re.compile(r'(user_\d+_[0-9a-f]{12})_(\d+)')
+
+
+def avatar_dir():
+    return os.path.join(app.root_path, AVATAR_FOLDER)
+
+
+def is_versioned(profile_pic):
+    """True for ``user_<id>_<version>`` names, False for single pre-rendered files"""
+    return bool(profile_pic) and '.' not in profile_pic
+
+
+def avatar_url(profile_pic, size=64):
+    """URL of a user's avatar at (at least) ``size`` pixels"""
+    if not profile_pic:
+        return DEFAULT_AVATAR_URL
+    if not is_versioned(profile_pic):
+        return f'/static/profile_pics/{profile_pic}'
+    size = next((s for s in AVATAR_SIZES if s >= size), AVATAR_SIZES[-1])
+    return f'/avatars/{profile_pic}_{size}'
+
+
+def parse_variant(name):
+    """Split an avatar URL name into (profile_pic, size), or None if it is not one"""
+    match = VARIANT_NAME.fullmatch(name)
+    if match is None or int(match.group(2)) not in AVATAR_SIZES:
+        return None
+    return match.group(1), int(match.group(2))
+
+
+def variant_filename(profile_pic, size, extension):
+    return f'{profile_pic}_{size}.{extension}'
+
+
+def save_avatar_upload(user_id, stream):
+    """Store an uploaded picture and queue its variants; returns the new profile_pic name.
+
+    Raises ValueError for files that are too large or not a PNG or JPEG. The
+    user keeps the current avatar until the variants have been rendered.
+    """
+    directory = avatar_dir()
+    os.makedirs(directory, exist_ok=True)
+    fd, source = tempfile.mkstemp(dir=directory, prefix='.upload_')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            data = stream.read(MAX_AVATAR_UPLOAD_SIZE + 1)
+            out.write(data)
+        if len(data) > MAX_AVATAR_UPLOAD_SIZE:
+            raise ValueError('File too large (max 1MB).')
+        try:
+            # Only reads the header; decoding happens in the renderer
+            with Image.open(source) as image:
+                upload_format = image.format
+        except (UnidentifiedImageError, OSError):
+            upload_format = None
+        if upload_format not in AVATAR_UPLOAD_FORMATS:
+            raise ValueError('Invalid file type. Only PNG and JPG allowed.')
+    except Exception:
+        os.unlink(source)
+        raise
+    upload_bytes.inc(len(data), kind='avatar')
+    profile_pic = f'user_{user_id}_{hashlib.sha256(data).hexdigest()[:12]}'
+    media_pipeline.submit(
+        {'kind': 'avatar', 'source': source, 'output_prefix': os.path.join(directory, profile_pic),
+         'sizes': list(AVATAR_SIZES)},
+        lambda result: _avatar_rendered(user_id, profile_pic, source, result))
+    return profile_pic
+
+
+def _avatar_rendered(user_id, profile_pic, source, result):
+    try:
+        os.unlink(source)
+    except FileNotFoundError:
+        pass
+    if result['status'] != 'ready':
+        logging.warning(f"Avatar for user {user_id} failed: {result.get('error')}")
+        remove_avatar_files(profile_pic)
+        return
+    previous = set_profile_pic(user_id, profile_pic)
+    if previous is None:
+        # User deleted while the avatar was rendering
+        remove_avatar_files(profile_pic)
+        return
+    user = identity_cache.get(user_id)
+    socketio.emit('user_avatar_updated', {
+        'user_id': user_id,
+        'username': user.username if user else None,
+        'avatar_url': avatar_url(profile_pic)
+    })
+
+
+def set_profile_pic(user_id, profile_pic):
+    """Point the user at new avatar files and delete the old ones; returns the old name ('' if none)"""
+    previous = db.session.query(User.profile_pic).filter(User.id == user_id).first()
+    if previous is None:
+        return None
+    User.query.filter_by(id=user_id).update({'profile_pic': profile_pic})
+    db.session.commit()
+    identity_cache.invalidate(user_id)
+    if previous.profile_pic and previous.profile_pic != profile_pic:
+        remove_avatar_files(previous.profile_pic)
+    return previous.profile_pic or ''
+
+
+def remove_avatar_files(profile_pic):
+    if is_versioned(profile_pic):
+        paths = [variant_filename(profile_pic, size, extension)
+                 for size in AVATAR_SIZES for extension in AVATAR_FORMATS]
+    else:
+        paths = [profile_pic]
+    for filename in paths:
+        try:
+            os.unlink(os.path.join(avatar_dir(), filename))
+        except FileNotFoundError:
+            pass
+
+
+@app.cli.command('avatars-rebuild')
+def avatars_rebuild_command():
+    """Render size variants for profile pictures stored as a single file."""
+    from media_worker import render_avatar
+    users = db.session.query(User.id, User.profile_pic).filter(
+        User.profile_pic.isnot(None), User.profile_pic.contains('.')).all()
+    rebuilt = 0
+    for user_id, filename in users:
+        source = os.path.join(avatar_dir(), filename)
+        try:
+            with open(source, 'rb') as f:
+                profile_pic = f'user_{user_id}_{hashlib.sha256(f.read()).hexdigest()[:12]}'
+            render_avatar({'kind': 'avatar', 'source': source,
+                           'output_prefix': os.path.join(avatar_dir(), profile_pic), 'sizes': list(AVATAR_SIZES)})
+        except Exception as e:
+            click.echo(f"Skipped user {user_id}: {type(e).__name__}: {e}")
+            continue
+        set_profile_pic(user_id, profile_pic)
+        rebuilt += 1
+    click.echo(f"Rebuilt {rebuilt} avatars")
@@ -14,9 +14,15 @@ mkdir -p "$(dirname $LOG_FILE)"
 APP_TAR="$BACKUP_DIR/wispr_app_$DATE.tar.gz"
 tar -czf "$APP_TAR" --exclude='wispr_env' --exclude='__pycache__' --exclude='*.pyc' /var/www/wispr
 
-# SQLite backup
+# SQLite backup (WAL mode: recent writes may still be in the -wal file, so use the
+# online backup API instead of copying the database file)
 if [ -f "/var/www/wispr/team_collaboration.db" ]; then
-    cp /var/www/wispr/team_collaboration.db "$BACKUP_DIR/wispr_db_$DATE.db"
+    if command -v sqlite3 >/dev/null; then
+        sqlite3 /var/www/wispr/team_collaboration.db ".backup '$BACKUP_DIR/wispr_db_$DATE.db'"
+    else
+        python3 -c "import sqlite3, sys; sqlite3.connect(sys.argv[1]).backup(sqlite3.connect(sys.argv[2]))" \
+            /var/www/wispr/team_collaboration.db "$BACKUP_DIR/wispr_db_$DATE.db"
+    fi
 fi
 
 # PostgreSQL backup (if DATABASE_URL is set and is PostgreSQL)
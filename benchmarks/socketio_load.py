@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Socket.IO load test for one Wispr worker.
+
+Starts the app the way deploy.sh does (one gunicorn eventlet worker, but with
+development settings so sessions are signed cookies the clients can be given)
+on a temporary SQLite database seeded with --clients users and --rooms rooms, then
+connects the simulated clients from --processes load generator processes.
+Each client joins a room and, until --duration runs out, sends messages,
+typing indicators and reactions at the given per-client rates (Poisson
+arrivals). Messages carry their send time, so every receive_message a client
+gets yields one end-to-end delivery latency. Rates and latencies cover only
+messages sent in the --duration window after the --ramp, when all clients
+are connected; the counts include the ramp.
+
+Results are printed as JSON on stdout (and written to --output), with a short
+summary on stderr:
+
+  python3 benchmarks/socketio_load.py --clients 500 --duration 60 --output before.json
+
+To load a server that is already running, pass --url and its SESSION_SECRET
+(--secret); clients then log in as the users with ids --first-user-id
+onwards and use room ids --room-ids. Only use a staging copy: the messages
+are stored like any other. Sessions are signed cookies made with the secret,
+so the target must use the default cookie sessions (not FLASK_ENV=production).
+"""
+import sys
+
+if __name__ == '__main__' and '--worker' in sys.argv:
+    # Load generators run thousands of clients as green threads
+    import eventlet
+    eventlet.monkey_patch()
+
+import argparse
+import json
+import os
+import random
+import secrets
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REACTION_EMOJIS = ['👍', '😂', '🎉']
+
+SEED_SCRIPT = """
+import json, sys
+from app import app, db
+from models import ChatRoom, User
+clients, rooms = int(sys.argv[1]), int(sys.argv[2])
+with app.app_context():
+    admin = User.query.filter_by(username='admin').first()
+    users = [User(username=f'load{i}', email=f'load{i}@example.com', password_hash='!', role='member')
+             for i in range(clients)]
+    chat_rooms = [ChatRoom(name=f'load-{i}', created_by=admin.id) for i in range(rooms)]
+    db.session.add_all(users + chat_rooms)
+    db.session.commit()
+    print(json.dumps({'users': [u.id for u in users], 'rooms': [r.id for r in chat_rooms]}))
+"""
+
+
+# --- Load generator (runs in --worker processes) ---
+
+class Recorder:
+    def __init__(self):
+        self.latencies = []
+        self.connect_times = []
+        self.counts = dict.fromkeys([
+            'connected', 'connect_errors', 'disconnects', 'messages_sent', 'messages_received',
+            'message_errors', 'typing_sent', 'typing_updates_received', 'reactions_sent',
+            'reaction_updates_received', 'emit_errors', 'measured_messages_sent', 'measured_deliveries'], 0)
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+
+_serializers = {}
+
+
+def session_cookie(secret, user_id, username):
+    """A Flask session cookie for the user, as /login would set it"""
+    if secret not in _serializers:
+        from flask import Flask
+        from flask.sessions import SecureCookieSessionInterface
+        app = Flask('load')
+        app.secret_key = secret
+        _serializers[secret] = SecureCookieSessionInterface().get_signing_serializer(app)
+    return 'session=' + _serializers[secret].dumps({'user_id': user_id, 'username': username, 'role': 'member'})
+
+
+def poisson_sleep(rate, deadline):
+    """Sleep for an exponential interval at ``rate`` per second, but not past deadline"""
+    delay = random.expovariate(rate) if rate > 0 else deadline - time.time()
+    time.sleep(max(0, min(delay, deadline - time.time())))
+
+
+def run_client(args, recorder, user_id, room_id, start_at, measure_from, stop_at):
+    import socketio
+
+    client = socketio.Client(reconnection=False)
+    recent_ids = []
+    sequence = 0
+
+    @client.on('receive_message')
+    def on_message(data):
+        recorder.count('messages_received')
+        parts = (data.get('content') or '').split()
+        if len(parts) == 4 and parts[0] == 'load' and float(parts[3]) >= measure_from:
+            recorder.count('measured_deliveries')
+            recorder.latencies.append((time.time() - float(parts[3])) * 1000)
+        if data.get('id'):
+            recent_ids.append(data['id'])
+            del recent_ids[:-20]
+
+    @client.on('message_error')
+    def on_message_error(data):
+        recorder.count('message_errors')
+
+    @client.on('typing_update')
+    def on_typing(data):
+        recorder.count('typing_updates_received')
+
+    @client.on('reaction_delta')
+    def on_reaction(data):
+        recorder.count('reaction_updates_received')
+
+    @client.on('disconnect')
+    def on_disconnect():
+        if time.time() < stop_at:
+            recorder.count('disconnects')
+
+    time.sleep(max(0, start_at - time.time()))
+    started = time.time()
+    try:
+        client.connect(args.url, headers={'Cookie': session_cookie(args.secret, user_id, f'load{user_id}')},
+                       transports=['websocket'], wait_timeout=30)
+    except Exception:
+        recorder.count('connect_errors')
+        return
+    recorder.connect_times.append((time.time() - started) * 1000)
+    recorder.count('connected')
+
+    actions = [(rate, name) for rate, name in ((args.message_rate, 'message'), (args.typing_rate, 'typing'),
+                                                (args.reaction_rate, 'reaction')) if rate > 0]
+    total_rate = sum(rate for rate, _ in actions)
+    try:
+        client.emit('join_room', {'room': room_id})
+        while time.time() < stop_at:
+            poisson_sleep(total_rate, stop_at)
+            if time.time() >= stop_at or not actions:
+                break
+            action = random.choices([name for _, name in actions], [rate for rate, _ in actions])[0]
+            if action == 'message':
+                sequence += 1
+                sent_at = time.time()
+                client.emit('send_message', {'room': room_id, 'message': f'load {user_id} {sequence} {sent_at:.6f}'})
+                recorder.count('messages_sent')
+                if sent_at >= measure_from:
+                    recorder.count('measured_messages_sent')
+            elif action == 'typing':
+                client.emit('start_typing', {'room': room_id})
+                recorder.count('typing_sent')
+            elif recent_ids:
+                client.emit('add_reaction', {'message_id': random.choice(recent_ids),
+                                             'emoji': random.choice(REACTION_EMOJIS)})
+                recorder.count('reactions_sent')
+        # Let messages still in flight arrive
+        time.sleep(args.drain)
+    except Exception:
+        recorder.count('emit_errors')
+    finally:
+        client.disconnect()
+
+
+def worker_main(args):
+    import eventlet
+
+    recorder = Recorder()
+    assignments = json.loads(args.assignments)
+    now = time.time()
+    measure_from = now + args.ramp
+    stop_at = measure_from + args.duration
+    pool = eventlet.GreenPool(len(assignments) + 1)
+    for index, (user_id, room_id) in enumerate(assignments):
+        start_at = now + args.ramp * index / max(1, len(assignments))
+        pool.spawn(run_client, args, recorder, user_id, room_id, start_at, measure_from, stop_at)
+    pool.waitall()
+    json.dump({'latencies': recorder.latencies, 'connect_times': recorder.connect_times,
+               'counts': recorder.counts}, sys.stdout)
+
+
+# --- Controller ---
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, work_dir):
+    """Seed a temporary database and start one gunicorn worker; returns (process, users, rooms)"""
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(work_dir, 'load.db')}",
+               SESSION_SECRET=args.secret, FLASK_ENV='development')
+    env.pop('SOCKETIO_MESSAGE_QUEUE', None)
+    seed = subprocess.run([sys.executable, '-c', SEED_SCRIPT, str(args.clients), str(args.rooms)],
+                          cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    ids = json.loads(seed.stdout.strip().splitlines()[-1])
+    port = free_port()
+    log = open(os.path.join(work_dir, 'server.log'), 'w')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--worker-class', 'eventlet', '-w', '1',
+         '--bind', f'127.0.0.1:{port}', '--timeout', '120', 'main:app'],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    args.url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 60
+    while True:
+        try:
+            urllib.request.urlopen(args.url + '/login', timeout=2)
+            break
+        except OSError:
+            if server.poll() is not None or time.time() > deadline:
+                raise SystemExit(f"Server did not start, see {os.path.join(work_dir, 'server.log')}")
+            time.sleep(0.2)
+    return server, ids['users'], ids['rooms']
+
+
+def percentiles(values):
+    if not values:
+        return {'p50': None, 'p95': None, 'p99': None, 'max': None}
+    values = sorted(values)
+    pick = lambda fraction: round(values[min(len(values) - 1, int(fraction * len(values)))], 2)
+    return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99), 'max': round(values[-1], 2)}
+
+
+def run_load(args, users, rooms):
+    assignments = [(user_id, rooms[i % len(rooms)]) for i, user_id in enumerate(users)]
+    shares = [assignments[i::args.processes] for i in range(args.processes)]
+    common = ['--url', args.url, '--secret', args.secret, '--duration', str(args.duration),
+              '--ramp', str(args.ramp), '--drain', str(args.drain), '--message-rate', str(args.message_rate),
+              '--typing-rate', str(args.typing_rate), '--reaction-rate', str(args.reaction_rate)]
+    workers = [subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker', '--assignments',
+                                 json.dumps(share)] + common, stdout=subprocess.PIPE, text=True)
+               for share in shares if share]
+    latencies, connect_times, counts = [], [], {}
+    for worker in workers:
+        output, _ = worker.communicate()
+        result = json.loads(output)
+        latencies += result['latencies']
+        connect_times += result['connect_times']
+        for name, value in result['counts'].items():
+            counts[name] = counts.get(name, 0) + value
+    return latencies, connect_times, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test Socket.IO chat on one Wispr worker.')
+    parser.add_argument('--clients', type=int, default=200, help='Simulated users (default 200)')
+    parser.add_argument('--rooms', type=int, default=10, help='Rooms the clients are spread over (default 10)')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of load after the ramp (default 30)')
+    parser.add_argument('--ramp', type=float, default=10, help='Seconds over which clients connect (default 10)')
+    parser.add_argument('--drain', type=float, default=3, help='Seconds to wait for in-flight messages (default 3)')
+    parser.add_argument('--message-rate', type=float, default=0.2, help='Messages per client per second')
+    parser.add_argument('--typing-rate', type=float, default=0.3, help='Typing events per client per second')
+    parser.add_argument('--reaction-rate', type=float, default=0.05, help='Reactions per client per second')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='Load generator processes')
+    parser.add_argument('--output', help='Also write the JSON result to this file')
+    parser.add_argument('--url', help='Load an already running server instead of starting one')
+    parser.add_argument('--secret', help="The server's SESSION_SECRET (with --url)")
+    parser.add_argument('--first-user-id', type=int, default=1, help='First user id to log in as (with --url)')
+    parser.add_argument('--room-ids', help='Comma-separated room ids to use (with --url)')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--assignments', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker_main(args)
+        return
+
+    server = work_dir = None
+    try:
+        if args.url:
+            if not args.secret or not args.room_ids:
+                parser.error('--url needs --secret and --room-ids')
+            users = list(range(args.first_user_id, args.first_user_id + args.clients))
+            rooms = [int(room_id) for room_id in args.room_ids.split(',')]
+        else:
+            args.secret = secrets.token_hex(16)
+            work_dir = tempfile.mkdtemp(prefix='wispr-load-')
+            server, users, rooms = start_server(args, work_dir)
+        started = time.time()
+        latencies, connect_times, counts = run_load(args, users, rooms)
+        elapsed = time.time() - started
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    # Only messages sent after the ramp count, so the rates do not depend on --ramp
+    load_seconds = args.duration
+    result = {
+        'config': {name: getattr(args, name) for name in (
+            'clients', 'rooms', 'duration', 'ramp', 'message_rate', 'typing_rate', 'reaction_rate', 'processes')},
+        'elapsed_seconds': round(elapsed, 1),
+        'counts': counts,
+        'messages_sent_per_second': round(counts.get('measured_messages_sent', 0) / load_seconds, 1),
+        'deliveries_per_second': round(counts.get('measured_deliveries', 0) / load_seconds, 1),
+        'delivery_latency_ms': percentiles(latencies),
+        'connect_latency_ms': percentiles(connect_times),
+        'errors': sum(counts.get(name, 0) for name in (
+            'connect_errors', 'disconnects', 'message_errors', 'emit_errors')),
+    }
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    latency = result['delivery_latency_ms']
+    print(f"{counts.get('connected', 0)}/{args.clients} connected, "
+          f"{result['messages_sent_per_second']} msg/s sent, {result['deliveries_per_second']} deliveries/s, "
+          f"latency p50 {latency['p50']} ms p95 {latency['p95']} ms p99 {latency['p99']} ms, "
+          f"{result['errors']} errors", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Kanban board queries.
+
+A board is scoped to one project (or all projects) and optionally one
+assignee. Each column is fetched separately with a page-size cap and its
+assignee, creator and project rows joined in, so the number of queries and
+rows per page does not grow with the total number of tasks.
+"""
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+
+from app import db
+from models import Task
+
+BOARD_COLUMN_PAGE_SIZE = 25
+BOARD_COLUMN_MAX_PAGE_SIZE = 100
+BOARD_STATUSES = ('todo', 'in_progress', 'done')
+
+
+def _board_filter(query, project_id=None, assignee_id=None):
+    if project_id is not None:
+        query = query.filter(Task.project_id == project_id)
+    if assignee_id is not None:
+        query = query.filter(Task.assigned_to == assignee_id)
+    return query
+
+
+def _column_order(status):
+    if status == 'done':
+        return (Task.updated_at.desc(), Task.id.desc())
+    return (Task.due_date.asc().nullslast(), Task.created_at.desc(), Task.id.desc())
+
+
+def column_totals_query(project_id=None, assignee_id=None):
+    """(status, count) rows for the board's column totals"""
+    query = _board_filter(db.session.query(Task.status, func.count(Task.id)), project_id, assignee_id)
+    return query.group_by(Task.status)
+
+
+def column_totals(project_id=None, assignee_id=None):
+    """Task count per status for the board, in one aggregate query"""
+    totals = dict.fromkeys(BOARD_STATUSES, 0)
+    for status, count in column_totals_query(project_id, assignee_id):
+        totals[status or 'todo'] += count
+    return totals
+
+
+def column_query(status, project_id=None, assignee_id=None):
+    """A column's tasks in board order, with related rows loaded"""
+    query = Task.query.options(
+        joinedload(Task.assignee), joinedload(Task.creator), joinedload(Task.project)
+    ).filter(Task.status == status)
+    return _board_filter(query, project_id, assignee_id).order_by(*_column_order(status))
+
+
+def load_column(status, project_id=None, assignee_id=None, offset=0, limit=BOARD_COLUMN_PAGE_SIZE):
+    """One page of a column, with related rows loaded; returns (tasks, has_more)"""
+    tasks = column_query(status, project_id, assignee_id).offset(offset).limit(limit + 1).all()
+    return tasks[:limit], len(tasks) > limit
+
+
+def load_board(project_id=None, assignee_id=None, limit=BOARD_COLUMN_PAGE_SIZE):
+    """First page of every column: {status: {'tasks', 'total', 'has_more'}}"""
+    totals = column_totals(project_id, assignee_id)
+    board = {}
+    for status in BOARD_STATUSES:
+        if totals[status]:
+            tasks, has_more = load_column(status, project_id, assignee_id, limit=limit)
+        else:
+            tasks, has_more = [], False
+        board[status] = {'tasks': tasks, 'total': totals[status], 'has_more': has_more}
+    return board
+
+
+def serialize_task(task):
+    return {
+        'id': task.id,
+        'title': task.title,
+        'description': task.description,
+        'status': task.status,
+        'priority': task.priority,
+        'due_date': task.due_date.strftime('%Y-%m-%d') if task.due_date else None,
+        'project': {'id': task.project.id, 'name': task.project.name} if task.project else None,
+        'creator': task.creator.username if task.creator else None,
+        'assignee': task.assignee.username if task.assignee else None,
+        'assignee_id': task.assigned_to,
+        'created_at': task.created_at.isoformat(),
+        'updated_at': task.updated_at.isoformat()
+    }
@@ -0,0 +1,66 @@
+"""Cached task statistics for the dashboard.
+
+Status counts come from a single GROUP BY and the recent-task list is kept
+as plain snapshots, so a cached dashboard render does no task queries.
+Task create/move/assign/delete handlers call ``invalidate``; changes made
+by other workers show up after DASHBOARD_CACHE_TTL seconds.
+"""
+from collections import namedtuple
+import os
+import time
+
+from sqlalchemy import func
+
+from app import db
+from models import Task, User
+
+# Seconds cached statistics are trusted before they are recomputed
+DASHBOARD_CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', 30))
+RECENT_TASK_COUNT = 5
+TASK_STATUSES = ('todo', 'in_progress', 'done')
+
+RecentTask = namedtuple('RecentTask', ['id', 'title', 'status', 'updated_at', 'creator_username'])
+
+
+class DashboardStats:
+    """Task counts per status and the most recently updated tasks"""
+
+    def __init__(self, ttl=DASHBOARD_CACHE_TTL):
+        self.ttl = ttl
+        self._counts = None
+        self._recent_tasks = None
+        self._loaded_at = 0
+
+    def invalidate(self):
+        self._counts = None
+        self._recent_tasks = None
+
+    def _load(self):
+        counts = dict.fromkeys(TASK_STATUSES, 0)
+        for status, count in db.session.query(Task.status, func.count(Task.id)).group_by(Task.status):
+            counts[status or 'todo'] = counts.get(status or 'todo', 0) + count
+        counts['total'] = sum(counts.values())
+
+        rows = db.session.query(Task.id, Task.title, Task.status, Task.updated_at, User.username).join(
+            User, Task.user_id == User.id
+        ).order_by(Task.updated_at.desc()).limit(RECENT_TASK_COUNT)
+
+        self._counts = counts
+        self._recent_tasks = [RecentTask(*row) for row in rows]
+        self._loaded_at = time.monotonic()
+
+    def _fresh(self):
+        if self._counts is None or time.monotonic() - self._loaded_at > self.ttl:
+            self._load()
+
+    def task_counts(self):
+        """Dict of task counts keyed by status, plus 'total'"""
+        self._fresh()
+        return self._counts
+
+    def recent_tasks(self):
+        self._fresh()
+        return self._recent_tasks
+
+
+dashboard_stats = DashboardStats()
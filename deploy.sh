@@ -14,6 +14,7 @@ source wispr_env/bin/activate
 LOG_DIR=${LOG_DIR:-/var/log/wispr}
 mkdir -p "$LOG_DIR"
 LOG_FILE=${LOG_FILE:-$LOG_DIR/wispr.log}
+export SLOW_QUERY_LOG=${SLOW_QUERY_LOG:-$LOG_DIR/slow_queries.log}
 
 # Set default session secret if not set (should be overridden in production!)
 if [ -z "$SESSION_SECRET" ]; then
@@ -21,5 +22,34 @@ if [ -z "$SESSION_SECRET" ]; then
     exit 1
 fi
 
+# Worker processes. Each runs one eventlet worker on its own port (BASE_PORT,
+# BASE_PORT+1, ...) behind the sticky nginx upstream in nginx-wispr.conf.
+WISPR_WORKERS=${WISPR_WORKERS:-1}
+BASE_PORT=${BASE_PORT:-5000}
+
+if [ "$WISPR_WORKERS" -gt 1 ] && [ -z "$SOCKETIO_MESSAGE_QUEUE" ]; then
+    echo "❌ WISPR_WORKERS=$WISPR_WORKERS requires SOCKETIO_MESSAGE_QUEUE (e.g. redis://localhost:6379/0 or unix:///run/wispr/socketio)."
+    exit 1
+fi
+
+# Refuse to start if a hot query lost its index (see query_plans.py)
+flask --app main check-query-plans
+
 # Run Gunicorn with eventlet worker for SocketIO
-exec gunicorn --worker-class eventlet -w 1 --bind 0.0.0.0:5000 --timeout 120 --log-file "$LOG_FILE" --log-level info main:app 
\ No newline at end of file
+if [ "$WISPR_WORKERS" -eq 1 ]; then
+    exec gunicorn --worker-class eventlet -w 1 --bind 0.0.0.0:$BASE_PORT --timeout 120 --log-file "$LOG_FILE" --log-level info main:app
+fi
+
+# Socket.IO sessions are stateful, so workers are separate gunicorn processes
+# that nginx pins clients to, rather than one gunicorn with -w N.
+pids=()
+for i in $(seq 0 $((WISPR_WORKERS - 1))); do
+    gunicorn --worker-class eventlet -w 1 --bind 127.0.0.1:$((BASE_PORT + i)) --timeout 120 --log-file "$LOG_FILE" --log-level info main:app &
+    pids+=($!)
+done
+trap 'kill "${pids[@]}" 2>/dev/null' TERM INT
+
+# Exit as soon as any worker dies so systemd restarts the whole set
+wait -n
+kill "${pids[@]}" 2>/dev/null || true
+exit 1
@@ -0,0 +1,71 @@
+"""Serving uploaded files and profile pictures.
+
+With WISPR_DOWNLOAD_MODE=accel the Flask route only authorizes the request
+and answers with an ``X-Accel-Redirect`` to one of the internal locations in
+nginx-wispr.conf. nginx then sends the file itself (sendfile, Range and
+conditional requests included), so large downloads never occupy the eventlet
+worker that also serves the websockets. The default mode, ``direct``, sends
+the file from Flask with the same headers, for running without nginx.
+"""
+from urllib.parse import quote
+import mimetypes
+import os
+import unicodedata
+
+from flask import Response, abort, send_from_directory
+from werkzeug.security import safe_join
+
+# 'accel' behind nginx, 'direct' to stream files from Flask
+DOWNLOAD_MODE = os.environ.get('WISPR_DOWNLOAD_MODE', 'direct')
+
+# Internal nginx location for each served directory (see nginx-wispr.conf)
+ACCEL_LOCATIONS = {
+    'uploads': '/_protected/uploads/',
+    'profile_pics': '/_protected/profile_pics/',
+}
+
+
+def content_disposition(download_name, as_attachment=True):
+    """Content-Disposition header value, with an RFC 5987 name for non-ASCII filenames"""
+    kind = 'attachment' if as_attachment else 'inline'
+    try:
+        download_name.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        quoted = quote(download_name, safe="!#$&+-.^_`|~")
+        return f'{kind}; filename="{_quote_header(simple)}"; filename*=UTF-8\'\'{quoted}'
+    return f'{kind}; filename="{_quote_header(download_name)}"'
+
+
+def _quote_header(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def serve_file(area, directory, filename, download_name=None, mimetype=None,
+               as_attachment=False, max_age=None, private=False, etag=True):
+    """Respond with a file from ``directory``, which nginx serves as ``ACCEL_LOCATIONS[area]``.
+
+    ``etag`` may be a string (e.g. a content hash) to use instead of the
+    mtime-based tag in direct mode; nginx generates its own in accel mode.
+    ``private`` keeps shared caches from storing files that need a login.
+    """
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    if DOWNLOAD_MODE == 'accel':
+        mimetype = mimetype or mimetypes.guess_type(download_name or filename)[0] or 'application/octet-stream'
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = ACCEL_LOCATIONS[area] + quote(filename.replace(os.sep, '/'))
+        if download_name or as_attachment:
+            response.headers['Content-Disposition'] = content_disposition(
+                download_name or os.path.basename(filename), as_attachment)
+        if max_age is not None:
+            response.cache_control.max_age = max_age
+    else:
+        response = send_from_directory(directory, filename, mimetype=mimetype, as_attachment=as_attachment,
+                                       download_name=download_name, max_age=max_age, etag=etag)
+    if private:
+        response.cache_control.public = False
+        response.cache_control.private = True
+    return response
@@ -0,0 +1,96 @@
+"""Database engine settings for each backend.
+
+SQLite runs in WAL mode so chat writes no longer block readers, with
+``synchronous=NORMAL`` (durable at checkpoints, never corrupting), a busy
+timeout for writers from other processes such as the cron CLI commands, a
+memory-mapped file and a larger page cache (foreign key enforcement is
+opt-in with SQLITE_FOREIGN_KEYS=1, for databases without orphaned rows). The pragmas are applied to every
+new connection by a connect event, and connections are not pinged on
+checkout since the database is a local file.
+
+PostgreSQL gets a sized connection pool with pre-ping and recycling, and
+server-side statement and idle-in-transaction timeouts so one runaway query
+or forgotten transaction cannot hold locks indefinitely.
+
+``benchmarks/sqlite_concurrency.py`` compares these settings with the
+previous defaults under concurrent readers and writers.
+"""
+import os
+
+from sqlalchemy import event
+
+# Milliseconds a SQLite writer waits for another process's write lock
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+# Bytes of the database file memory-mapped by each connection
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+# Page cache per connection, in KiB
+SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64 * 1024))
+# Enforce foreign keys. Off by default for compatibility with existing
+# databases, which may already hold rows that reference deleted ones
+SQLITE_FOREIGN_KEYS = os.environ.get('SQLITE_FOREIGN_KEYS', '0') == '1'
+
+# Connections kept open per worker, and extra ones allowed under load
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+# Seconds to wait for a free connection before failing the request
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+# Milliseconds before PostgreSQL cancels a statement (0 disables)
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 30000))
+# Milliseconds a session may sit idle inside a transaction
+DB_IDLE_IN_TRANSACTION_TIMEOUT = int(os.environ.get('DB_IDLE_IN_TRANSACTION_TIMEOUT', 60000))
+
+
+def sqlite_pragmas():
+    """PRAGMA name -> value applied to every SQLite connection, in order"""
+    return {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': SQLITE_BUSY_TIMEOUT,
+        'mmap_size': SQLITE_MMAP_SIZE,
+        'cache_size': -SQLITE_CACHE_SIZE_KB,
+        'foreign_keys': 'ON' if SQLITE_FOREIGN_KEYS else 'OFF',
+        'temp_store': 'MEMORY',
+    }
+
+
+def engine_options(database_url):
+    """SQLALCHEMY_ENGINE_OPTIONS for a database URL"""
+    if database_url.startswith('sqlite'):
+        return {
+            'pool_pre_ping': False,
+            # The pragma sets the same timeout; this keeps pysqlite from overriding it
+            'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT / 1000},
+        }
+    if database_url.startswith('postgres'):
+        return {
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'pool_timeout': DB_POOL_TIMEOUT,
+            'pool_recycle': 1800,
+            'pool_pre_ping': True,
+            'connect_args': {
+                'application_name': 'wispr',
+                'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT} '
+                           f'-c idle_in_transaction_session_timeout={DB_IDLE_IN_TRANSACTION_TIMEOUT}',
+            },
+        }
+    return {
+        'pool_recycle': 300,
+        'pool_pre_ping': True,
+    }
+
+
+def install_engine_events(engine):
+    """Apply per-connection settings (the SQLite pragmas) to an engine's new connections"""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas()
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
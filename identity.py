@@ -0,0 +1,63 @@
+"""Cached identity of the logged-in user for decorators, templates and socket events.
+
+Most requests only need a handful of user columns, so a lightweight snapshot
+is cached per process instead of loading the User row on every request and
+socket event. Handlers that change those columns call ``invalidate``; changes
+made by other workers are picked up after IDENTITY_CACHE_TTL seconds.
+"""
+from collections import namedtuple
+import os
+import time
+
+from flask import g, session
+
+from app import db
+from models import User
+
+# Seconds a snapshot is trusted before it is reloaded from the database
+IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 30))
+
+UserSnapshot = namedtuple('UserSnapshot', ['id', 'username', 'role', 'status', 'profile_pic'])
+
+
+class IdentityCache:
+    """Process-wide user_id -> UserSnapshot cache with expiry"""
+
+    def __init__(self, ttl=IDENTITY_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}  # user_id -> (snapshot, loaded_at)
+
+    def get(self, user_id):
+        """Snapshot of the user, or None if the user does not exist"""
+        entry = self._entries.get(user_id)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+        row = db.session.query(User.id, User.username, User.role, User.status, User.profile_pic).filter(
+            User.id == user_id).first()
+        if row is None:
+            self._entries.pop(user_id, None)
+            return None
+        snapshot = UserSnapshot(*row)
+        self._entries[user_id] = (snapshot, time.monotonic())
+        return snapshot
+
+    def invalidate(self, user_id):
+        self._entries.pop(user_id, None)
+        current = g.get('current_identity')
+        if current is not None and current.id == user_id:
+            g.pop('current_identity')
+
+    def clear(self):
+        self._entries.clear()
+
+
+identity_cache = IdentityCache()
+
+
+def current_identity():
+    """Snapshot of the session's user, memoized for the current request or event"""
+    if 'user_id' not in session:
+        return None
+    if 'current_identity' not in g:
+        g.current_identity = identity_cache.get(session['user_id'])
+    return g.current_identity
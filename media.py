@@ -0,0 +1,222 @@
+"""Background thumbnails for image and PDF attachments.
+
+Uploads queue a preview for their blob. Background tasks hand the jobs to a
+pool of MEDIA_WORKERS ``media_worker.py`` subprocesses, so decoding and
+resizing never block the eventlet loop, and record the original and
+thumbnail dimensions in AttachmentPreview so clients can reserve layout
+space. Thumbnails are keyed by blob hash like the blobs themselves, so a
+photo posted twice is rendered once. When a preview is ready, clients
+showing a recent message with that file are sent ``attachment_preview``.
+The same pool renders avatar variants for avatars.py through ``submit``.
+
+``flask attachments-previews`` renders missing previews for existing
+attachments, for example after a deploy or a crash with jobs still queued.
+"""
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import sys
+import threading
+
+try:
+    from eventlet.green import subprocess
+except ImportError:  # Threading async mode
+    import subprocess
+
+import click
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import app, db, socketio
+from attachments import blob_path, thumb_relpath, upload_dir
+from models import AttachmentPreview, ChatMessage, MessageAttachment
+
+# Renderer subprocesses per web worker (0 disables previews and renders avatars inline)
+MEDIA_WORKERS = int(os.environ.get('MEDIA_WORKERS', 2))
+# Seconds a renderer may spend on one job before it is killed and replaced
+MEDIA_JOB_TIMEOUT = float(os.environ.get('MEDIA_JOB_TIMEOUT', 120))
+# Longest side of a thumbnail, in pixels
+THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', 480))
+# Messages newer than this get a live attachment_preview event
+PREVIEW_NOTIFY_WINDOW = timedelta(minutes=10)
+
+IMAGE_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp'}
+PDF_TYPES = {'application/pdf'}
+
+
+def preview_kind(file_type):
+    """'image', 'pdf' or None for files that get no preview"""
+    if file_type in IMAGE_TYPES:
+        return 'image'
+    if file_type in PDF_TYPES:
+        return 'pdf'
+    return None
+
+
+def preview_job(sha256, kind):
+    return {
+        'kind': kind,
+        'source': blob_path(sha256),
+        'webp_path': os.path.join(upload_dir(), thumb_relpath(sha256, 'webp')),
+        'jpeg_path': os.path.join(upload_dir(), thumb_relpath(sha256, 'jpg')),
+        'max_size': THUMBNAIL_SIZE
+    }
+
+
+def serialize_preview(preview):
+    """Client-facing preview fields, or None until a thumbnail exists"""
+    if preview is None or preview.status != 'ready':
+        return None
+    return {
+        'width': preview.width,
+        'height': preview.height,
+        'thumb_width': preview.thumb_width,
+        'thumb_height': preview.thumb_height
+    }
+
+
+def record_preview(sha256, result):
+    db.session.execute(db.update(AttachmentPreview).where(AttachmentPreview.blob_sha256 == sha256).values(
+        status=result['status'],
+        width=result.get('width'),
+        height=result.get('height'),
+        thumb_width=result.get('thumb_width'),
+        thumb_height=result.get('thumb_height')
+    ))
+    db.session.commit()
+    if result['status'] != 'ready':
+        logging.warning(f"No preview for blob {sha256}: {result.get('error')}")
+
+
+def render_inline(job):
+    """Run a media_worker job in this process; returns its result"""
+    from media_worker import UnsupportedPreview, render
+    try:
+        return {'status': 'ready', **render(job)}
+    except UnsupportedPreview as e:
+        return {'status': 'unsupported', 'error': str(e)}
+    except Exception as e:
+        return {'status': 'failed', 'error': f'{type(e).__name__}: {e}'}
+
+
+class MediaPipeline:
+    """Queue of render jobs consumed by background tasks, one renderer subprocess each"""
+
+    def __init__(self, workers=MEDIA_WORKERS):
+        self.workers = workers
+        self._queue = None
+
+    def _start(self):
+        if self._queue is None:
+            self._queue = socketio.server.eio.create_queue()
+            for _ in range(self.workers):
+                socketio.start_background_task(self._worker_loop)
+
+    def enqueue(self, sha256, file_type):
+        """Queue a preview for a blob unless it has one; other file types are ignored"""
+        kind = preview_kind(file_type)
+        if kind is None or self.workers <= 0:
+            return
+        insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+        created = db.session.execute(insert(AttachmentPreview).values(
+            blob_sha256=sha256, status='pending', created_at=datetime.utcnow()
+        ).on_conflict_do_nothing()).rowcount
+        db.session.commit()
+        if created:
+            self.submit(preview_job(sha256, kind), lambda result: self._preview_done(sha256, result))
+
+    def submit(self, job, on_done):
+        """Queue a media_worker job; ``on_done(result)`` runs afterwards in an app context"""
+        if self.workers <= 0:
+            on_done(render_inline(job))
+            return
+        self._start()
+        self._queue.put((job, on_done))
+
+    def _spawn(self):
+        return subprocess.Popen(
+            [sys.executable, os.path.join(app.root_path, 'media_worker.py')],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+
+    def _worker_loop(self):
+        process = None
+        while True:
+            job, on_done = self._queue.get()
+            if process is None or process.poll() is not None:
+                process = self._spawn()
+            # A file that hangs the decoder must not stall this worker's queue:
+            # killing the renderer ends the read, and the next job gets a new one
+            deadline = threading.Timer(MEDIA_JOB_TIMEOUT, process.kill)
+            deadline.start()
+            try:
+                process.stdin.write(json.dumps(job) + '\n')
+                process.stdin.flush()
+                line = process.stdout.readline()
+                if line:
+                    result = json.loads(line)
+                else:
+                    timed_out = not deadline.is_alive()
+                    result = {'status': 'failed',
+                              'error': f'Timed out after {MEDIA_JOB_TIMEOUT:g}s' if timed_out else 'Renderer exited'}
+                    process.wait()
+                    process = None
+            except (OSError, ValueError) as e:
+                result = {'status': 'failed', 'error': str(e)}
+                process.kill()
+                process = None
+            finally:
+                deadline.cancel()
+            try:
+                with app.app_context():
+                    on_done(result)
+            except Exception:
+                logging.exception(f"Finishing {job['kind']} job for {job['source']} failed")
+
+    def _preview_done(self, sha256, result):
+        record_preview(sha256, result)
+        if result['status'] == 'ready':
+            self._notify(sha256, result)
+
+    def _notify(self, sha256, result):
+        """Tell clients showing recent messages with this file that its thumbnail is ready"""
+        rows = db.session.query(
+            MessageAttachment.id, ChatMessage.room_id, ChatMessage.user_id, ChatMessage.recipient_id,
+            ChatMessage.is_direct_message
+        ).join(ChatMessage, MessageAttachment.message_id == ChatMessage.id).filter(
+            MessageAttachment.blob_sha256 == sha256,
+            ChatMessage.timestamp >= datetime.utcnow() - PREVIEW_NOTIFY_WINDOW)
+        preview = {key: result[key] for key in ('width', 'height', 'thumb_width', 'thumb_height')}
+        for attachment_id, room_id, user_id, recipient_id, is_direct_message in rows:
+            payload = {'attachment_id': attachment_id, 'preview': preview}
+            if is_direct_message:
+                socketio.emit('attachment_preview', payload, room=f"user_{user_id}")
+                socketio.emit('attachment_preview', payload, room=f"user_{recipient_id}")
+            else:
+                socketio.emit('attachment_preview', payload, room=f"room_{room_id}")
+
+
+media_pipeline = MediaPipeline()
+
+
+@app.cli.command('attachments-previews')
+def attachments_previews_command():
+    """Render missing thumbnails for existing image and PDF attachments."""
+    rows = db.session.query(MessageAttachment.blob_sha256, MessageAttachment.file_type).outerjoin(
+        AttachmentPreview, AttachmentPreview.blob_sha256 == MessageAttachment.blob_sha256
+    ).filter(
+        MessageAttachment.blob_sha256.isnot(None),
+        db.or_(AttachmentPreview.blob_sha256.is_(None), AttachmentPreview.status == 'pending')
+    ).distinct().all()
+    rendered = 0
+    for sha256, file_type in rows:
+        kind = preview_kind(file_type)
+        if kind is None:
+            continue
+        if db.session.get(AttachmentPreview, sha256) is None:
+            db.session.add(AttachmentPreview(blob_sha256=sha256, status='pending'))
+            db.session.commit()
+        result = render_inline(preview_job(sha256, kind))
+        if result['status'] == 'ready':
+            rendered += 1
+        record_preview(sha256, result)
+    click.echo(f"Rendered {rendered} previews")
@@ -0,0 +1,123 @@
+"""Thumbnail and avatar renderer run in worker subprocesses by media.py.
+
+Reads one JSON job per line on stdin and answers each with one JSON line on
+stdout, so image decoding and resizing never run in the eventlet process
+that serves requests and websockets. Deliberately imports nothing from the
+app. PDF previews use PyMuPDF when installed, otherwise ``pdftoppm`` from
+poppler-utils, and are reported as unsupported when neither is available.
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from PIL import Image, ImageOps
+
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+
+
+class UnsupportedPreview(Exception):
+    pass
+
+
+def _open_pdf_page(source, max_size):
+    try:
+        import fitz
+    except ImportError:
+        fitz = None
+    if fitz is not None:
+        with fitz.open(source) as doc:
+            page = doc[0]
+            scale = max_size / max(page.rect.width, page.rect.height)
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+            return Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+    if shutil.which('pdftoppm') is None:
+        raise UnsupportedPreview('No PDF renderer installed')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        prefix = os.path.join(tmp_dir, 'page')
+        subprocess.run(['pdftoppm', '-f', '1', '-l', '1', '-singlefile', '-png',
+                        '-scale-to', str(max_size), source, prefix], check=True, timeout=60)
+        with Image.open(prefix + '.png') as page:
+            return page.convert('RGB')
+
+
+def _save_atomic(image, path, **options):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    image.save(tmp_path, **options)
+    os.replace(tmp_path, path)
+
+
+def render_preview(job):
+    """Write WebP and JPEG thumbnails for one file; returns the original and thumbnail sizes"""
+    max_size = job['max_size']
+    if job['kind'] == 'pdf':
+        image = _open_pdf_page(job['source'], max_size)
+    else:
+        image = Image.open(job['source'])
+        # First frame of animations, rotated as the camera intended
+        image.seek(0)
+        image = ImageOps.exif_transpose(image)
+    width, height = image.size
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    webp = image.convert('RGBA' if has_alpha else 'RGB')
+    _save_atomic(webp, job['webp_path'], format='WEBP', quality=WEBP_QUALITY, method=4)
+    if has_alpha:
+        # JPEG has no alpha channel; flatten onto white
+        jpeg = Image.new('RGB', webp.size, (255, 255, 255))
+        jpeg.paste(webp, mask=webp.getchannel('A'))
+    else:
+        jpeg = webp
+    _save_atomic(jpeg, job['jpeg_path'], format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return {'width': width, 'height': height, 'thumb_width': image.width, 'thumb_height': image.height}
+
+
+def render_avatar(job):
+    """Write square WebP and JPEG avatars of each size in ``sizes`` to ``<output_prefix>_<size>.<ext>``"""
+    with Image.open(job['source']) as source:
+        source.seek(0)
+        image = ImageOps.exif_transpose(source).convert('RGB')
+    side = min(image.size)
+    left = (image.width - side) // 2
+    top = (image.height - side) // 2
+    image = image.crop((left, top, left + side, top + side))
+    # Largest first, so each size is downscaled from the previous one
+    for size in sorted(job['sizes'], reverse=True):
+        image = image.resize((size, size), Image.LANCZOS)
+        prefix = f"{job['output_prefix']}_{size}"
+        _save_atomic(image, prefix + '.webp', format='WEBP', quality=WEBP_QUALITY, method=4)
+        _save_atomic(image, prefix + '.jpg', format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return {'width': side, 'height': side}
+
+
+def render(job):
+    if job['kind'] == 'avatar':
+        return render_avatar(job)
+    return render_preview(job)
+
+
+def main():
+    # Rendering is background work; let request handling win the CPU
+    try:
+        os.nice(5)
+    except (AttributeError, OSError):
+        pass
+    for line in sys.stdin:
+        job = json.loads(line)
+        try:
+            result = {'status': 'ready', **render(job)}
+        except UnsupportedPreview as e:
+            result = {'status': 'unsupported', 'error': str(e)}
+        except Exception as e:
+            result = {'status': 'failed', 'error': f'{type(e).__name__}: {e}'}
+        sys.stdout.write(json.dumps(result) + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""Write-behind (group commit) persistence for chat messages.
+
+By default every message is committed synchronously before it is broadcast.
+With WISPR_WRITE_BEHIND=1 a message gets its id and timestamp up front, is
+broadcast immediately and queued; a background task then inserts queued
+messages in batches of up to WRITE_BEHIND_BATCH_SIZE every
+WRITE_BEHIND_FLUSH_INTERVAL seconds, so one transaction (and one fsync)
+covers a whole burst of messages.
+
+Ordering: the queue is flushed strictly in FIFO order and a failed batch is
+retried before anything queued after it, so a message is never persisted
+before one sent earlier on the same worker. Batches are written on their own
+connection, never through the caller's session, so a flush neither commits
+nor rolls back a request's own changes. A message that can no longer be
+stored (its room or parent was deleted after it was sent) is withdrawn from
+clients with ``message_deleted``. Messages still queued when the process
+dies are lost; the flusher runs at exit to keep that window small.
+
+Requests that need queued messages stored first (edits, deletes, reactions,
+messages with attachments) flush with a WRITE_BEHIND_SYNC_TIMEOUT deadline
+and get WriteBehindUnavailable if the database keeps failing; only the
+background flusher retries indefinitely.
+
+Ids come from the PostgreSQL sequence, or on SQLite from an in-process
+counter seeded with max(id). The SQLite counter is only safe while a single
+process writes messages, so write-behind stays off there when
+SOCKETIO_MESSAGE_QUEUE indicates several workers.
+"""
+import atexit
+from collections import deque
+from datetime import datetime
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import func, text
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db, socketio
+from models import ChatMessage
+
+WRITE_BEHIND = os.environ.get('WISPR_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')
+# Seconds between flushes of queued messages
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.environ.get('WRITE_BEHIND_FLUSH_INTERVAL', 0.005))
+# Most messages inserted in one transaction
+WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', 200))
+# Longest wait between retries of a failing batch
+WRITE_BEHIND_MAX_BACKOFF = 5.0
+# Seconds a request waits for queued messages to be stored before giving up
+WRITE_BEHIND_SYNC_TIMEOUT = float(os.environ.get('WRITE_BEHIND_SYNC_TIMEOUT', 5))
+
+MESSAGE_COLUMNS = ('id', 'content', 'timestamp', 'user_id', 'room_id',
+                   'recipient_id', 'is_direct_message', 'parent_id')
+
+
+class WriteBehindUnavailable(Exception):
+    """Queued messages could not be stored within a request's deadline"""
+    status = 503
+
+
+class MessageWriter:
+    """Saves chat messages synchronously or through a write-behind queue"""
+
+    def __init__(self, enabled=WRITE_BEHIND):
+        self.enabled = enabled
+        self._queue = deque()
+        self._pending = {}  # id -> queued ChatMessage, for lookups before the flush
+        self._flush_lock = threading.Lock()
+        self._id_lock = threading.Lock()
+        self._next_id = None
+        self._started = False
+
+    def _use_sequence(self):
+        return db.engine.dialect.name == 'postgresql'
+
+    def _allocate_id(self):
+        if self._use_sequence():
+            return db.session.execute(
+                text("SELECT nextval(pg_get_serial_sequence('chat_message', 'id'))")).scalar()
+        with self._id_lock:
+            if self._next_id is None:
+                self._next_id = (db.session.query(func.max(ChatMessage.id)).scalar() or 0) + 1
+            message_id = self._next_id
+            self._next_id += 1
+            return message_id
+
+    def _start(self):
+        if not self._started:
+            self._started = True
+            socketio.start_background_task(self._flush_loop)
+            atexit.register(self._flush_at_exit)
+
+    def save(self, message, sync=False):
+        """Persist a new message and return it with its id assigned.
+
+        ``sync=True`` commits before returning even in write-behind mode
+        (after everything queued before it), for callers that add rows
+        referencing the message in the same request. Such callers flush
+        before making their own changes: on SQLite the batches could not be
+        written while the request's session holds the write lock.
+        """
+        if not self.enabled:
+            db.session.add(message)
+            db.session.commit()
+            return message
+        self._start()
+        message.id = self._allocate_id()
+        for column in ('user_id', 'room_id', 'recipient_id', 'parent_id'):
+            # Ids from socket payloads may be strings; the row is never reloaded to coerce them
+            value = getattr(message, column)
+            if value is not None:
+                setattr(message, column, int(value))
+        if message.timestamp is None:
+            message.timestamp = datetime.utcnow()
+        if message.is_direct_message is None:
+            message.is_direct_message = False
+        if sync:
+            self.flush()
+            db.session.add(message)
+            db.session.commit()
+            return message
+        self._pending[message.id] = message
+        self._queue.append(message)
+        return message
+
+    def get(self, message_id):
+        """A message by id, including ones that are still queued"""
+        try:
+            message_id = int(message_id)
+        except (TypeError, ValueError):
+            return None
+        message = self._pending.get(message_id)
+        if message is not None:
+            return message
+        return db.session.get(ChatMessage, message_id)
+
+    def pending_count(self):
+        return len(self._queue)
+
+    def flush(self, timeout=WRITE_BEHIND_SYNC_TIMEOUT):
+        """Write every queued message, retrying failed batches.
+
+        Raises WriteBehindUnavailable if the queue has not drained after
+        ``timeout`` seconds; ``timeout=None`` (the flusher and exit) retries
+        until it has.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._flush_lock.acquire(timeout=-1 if timeout is None else timeout):
+            raise WriteBehindUnavailable('Messages are not being saved right now, please try again')
+        try:
+            backoff = WRITE_BEHIND_FLUSH_INTERVAL
+            while self._queue:
+                batch = [self._queue[i] for i in range(min(len(self._queue), WRITE_BEHIND_BATCH_SIZE))]
+                try:
+                    self._insert(batch)
+                except Exception:
+                    if deadline is not None and time.monotonic() + backoff > deadline:
+                        logging.exception(f"Write-behind flush of {len(batch)} messages failed, giving up on this request")
+                        raise WriteBehindUnavailable('Messages are not being saved right now, please try again')
+                    logging.exception(f"Write-behind flush of {len(batch)} messages failed, retrying in {backoff:.2f}s")
+                    socketio.sleep(backoff)
+                    backoff = min(backoff * 2, WRITE_BEHIND_MAX_BACKOFF)
+                    continue
+                backoff = WRITE_BEHIND_FLUSH_INTERVAL
+                for message in batch:
+                    self._queue.popleft()
+                    self._pending.pop(message.id, None)
+        finally:
+            self._flush_lock.release()
+
+    def _insert(self, batch):
+        rows = [{column: getattr(message, column) for column in MESSAGE_COLUMNS} for message in batch]
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(ChatMessage.__table__.insert(), rows)
+        except IntegrityError:
+            # A row references something deleted since it was sent; write the
+            # rest of the batch one at a time and withdraw the rows that cannot be stored
+            if len(rows) == 1:
+                self._withdraw(rows[0])
+                return
+            for row in rows:
+                try:
+                    with db.engine.begin() as conn:
+                        conn.execute(ChatMessage.__table__.insert(), [row])
+                except IntegrityError:
+                    self._withdraw(row)
+
+    def _withdraw(self, row):
+        """Remove a broadcast message that cannot be stored from every client that received it"""
+        logging.error(f"Dropping message {row['id']} that cannot be stored")
+        data = {'message_id': row['id'], 'room_id': row['room_id']}
+        if row['is_direct_message']:
+            socketio.emit('message_deleted', data, room=f"user_{row['user_id']}")
+            socketio.emit('message_deleted', data, room=f"user_{row['recipient_id']}")
+        else:
+            socketio.emit('message_deleted', data, room=f"room_{row['room_id']}")
+
+    def _flush_loop(self):
+        while True:
+            socketio.sleep(WRITE_BEHIND_FLUSH_INTERVAL)
+            if not self._queue:
+                continue
+            try:
+                with app.app_context():
+                    self.flush(timeout=None)
+            except Exception:
+                logging.exception("Write-behind flusher failed")
+
+    def _flush_at_exit(self):
+        if self._queue:
+            with app.app_context():
+                self.flush(timeout=None)
+
+
+def _write_behind_enabled():
+    if not WRITE_BEHIND:
+        return False
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite') and os.environ.get('SOCKETIO_MESSAGE_QUEUE'):
+        logging.warning("WISPR_WRITE_BEHIND needs PostgreSQL when running several workers; writing synchronously")
+        return False
+    return True
+
+
+message_writer = MessageWriter(enabled=_write_behind_enabled())
@@ -0,0 +1,272 @@
+"""Prometheus metrics, served at /metrics in the text exposition format.
+
+Recorded per worker process, in memory:
+- latency and count of every Flask endpoint, by method and status
+- latency and count of every Socket.IO event handler, and its errors
+- database queries and query time per HTTP request or Socket.IO event
+- active Socket.IO connections, online users and members per chat room,
+  read when scraped
+- uploaded bytes by kind (attachment, resumable chunk, avatar)
+
+Histograms have fixed buckets and label values are endpoint and event names,
+so recording is a dict lookup and a few additions under a lock. No client
+library is needed. Each worker keeps its own numbers: scrape every worker
+port from deploy.sh (127.0.0.1:BASE_PORT+n), not the nginx front end.
+
+Database statements are timed once, here; sql_profiler.py reads the same
+timings through ``request_query_stats()`` and ``statement_listeners``.
+"""
+from bisect import bisect_left
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from app import app, db, socketio
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Upper bounds of the queries-per-request histogram buckets
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+METRICS = []
+
+# Called with (statement, seconds) after every database statement
+statement_listeners = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}' for key, value in values]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [per-bucket counts (last is +Inf), sum]
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {cumulative}')
+        return lines
+
+
+class Gauge(Metric):
+    """Value read from ``collect()`` (returning {label values: value}) at scrape time"""
+    type = 'gauge'
+
+    def __init__(self, name, help, collect, labels=()):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def samples(self):
+        values = self.collect()
+        if not self.labels:
+            values = {(): values}
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+                for key, value in sorted(values.items())]
+
+
+def _socket_rooms():
+    """{room name: sids} of this worker's connections on the default namespace"""
+    return dict(socketio.server.manager.rooms.get('/', {}))
+
+
+def _connection_count():
+    # Every connection is in the None room of its namespace
+    return len(_socket_rooms().get(None, ()))
+
+
+def _room_members():
+    return {(name[len('room_'):],): len(sids) for name, sids in _socket_rooms().items()
+            if isinstance(name, str) and name.startswith('room_')}
+
+
+def _online_users():
+    from presence import presence
+    return presence.online_count()
+
+
+http_requests = Counter('wispr_http_requests_total', 'HTTP requests by endpoint, method and status.',
+                        ('endpoint', 'method', 'status'))
+http_request_duration = Histogram('wispr_http_request_duration_seconds', 'HTTP request latency by endpoint.',
+                                  ('endpoint', 'method'))
+socketio_event_duration = Histogram('wispr_socketio_event_duration_seconds',
+                                    'Socket.IO event handler latency by event.', ('event',))
+socketio_event_errors = Counter('wispr_socketio_event_errors_total',
+                                'Socket.IO event handlers that raised, by event.', ('event',))
+db_queries = Histogram('wispr_db_queries', 'Database queries per HTTP request or Socket.IO event.',
+                       ('kind', 'endpoint'), buckets=QUERY_COUNT_BUCKETS)
+db_query_time = Histogram('wispr_db_query_seconds', 'Database time per HTTP request or Socket.IO event.',
+                          ('kind', 'endpoint'))
+db_query_duration = Histogram('wispr_db_query_duration_seconds', 'Latency of single database queries.')
+upload_bytes = Counter('wispr_upload_bytes_total', 'Bytes uploaded by kind.', ('kind',))
+Gauge('wispr_socketio_connections', 'Socket.IO connections held by this worker.', _connection_count)
+Gauge('wispr_socketio_room_members', "Connections in each chat room on this worker.", _room_members, ('room',))
+Gauge('wispr_online_users', 'Users with at least one live connection.', _online_users)
+
+
+def render():
+    """All metrics in the Prometheus text format"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def request_query_stats():
+    """{'count', 'time'} of the database statements of the current request or Socket.IO event"""
+    # Kept on the request, like Flask-SocketIO's request.sid and request.event,
+    # since each Socket.IO event gets a new request object but may share g
+    stats = getattr(request, 'db_stats', None)
+    if stats is None:
+        stats = request.db_stats = {'count': 0, 'time': 0.0}
+    return stats
+
+
+def _endpoint():
+    return request.url_rule.endpoint if request.url_rule else 'unmatched'
+
+
+@app.before_request
+def _start_request_timer():
+    g.metrics_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        endpoint = _endpoint()
+        http_request_duration.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+        http_requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    return response
+
+
+@app.teardown_request
+def _record_request_queries(exc):
+    # Also runs when Flask-SocketIO pops the request context of an event
+    stats = request_query_stats()
+    count, elapsed = stats['count'], stats['time']
+    socket_event = getattr(request, 'event', None)
+    if socket_event:
+        db_queries.observe(count, kind='socketio', endpoint=socket_event['message'])
+        db_query_time.observe(elapsed, kind='socketio', endpoint=socket_event['message'])
+    else:
+        db_queries.observe(count, kind='http', endpoint=_endpoint())
+        db_query_time.observe(elapsed, kind='http', endpoint=_endpoint())
+
+
+def _instrument_socketio_events():
+    """Time every event handler by wrapping Flask-SocketIO's single dispatch point"""
+    dispatch = socketio._handle_event
+
+    def timed_handle_event(handler, message, namespace, sid, *args):
+        started = time.perf_counter()
+        try:
+            return dispatch(handler, message, namespace, sid, *args)
+        except Exception:
+            socketio_event_errors.inc(event=message)
+            raise
+        finally:
+            socketio_event_duration.observe(time.perf_counter() - started, event=message)
+
+    socketio._handle_event = timed_handle_event
+
+
+def _instrument_queries(engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def record_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_started'].pop()
+        db_query_duration.observe(elapsed)
+        if has_request_context():
+            stats = request_query_stats()
+            stats['count'] += 1
+            stats['time'] += elapsed
+        for listener in statement_listeners:
+            listener(statement, elapsed)
+
+    @event.listens_for(engine, 'handle_error')
+    def forget_failed_query(context):
+        if context.connection is not None and context.connection.info.get('metrics_started'):
+            context.connection.info['metrics_started'].pop()
+
+
+_instrument_socketio_events()
+with app.app_context():
+    _instrument_queries(db.engine)
@@ -0,0 +1,116 @@
+"""Versioned schema migrations for existing databases.
+
+``db.create_all()`` creates missing tables (with their indexes) but never
+changes a table that already exists, so schema changes to live databases are
+written here as numbered migrations. Each one runs once per database, in its
+own transaction, and is recorded in ``schema_migrations``. Migrations must
+be idempotent (``CREATE INDEX IF NOT EXISTS``), since a fresh database
+already has everything create_all() made and several workers may start at
+once.
+
+``run_migrations()`` applies pending migrations at startup; ``flask db-migrate``
+does the same and lists what has been applied. On a large PostgreSQL database
+run it before deploying, as index builds lock their table against writes.
+"""
+from collections import namedtuple
+from datetime import datetime
+import logging
+
+import click
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+
+from app import app, db
+
+Migration = namedtuple('Migration', ['version', 'description', 'apply'])
+
+MIGRATIONS = []
+
+schema_migrations = db.Table(
+    'schema_migrations',
+    db.Column('version', db.Integer, primary_key=True),
+    db.Column('description', db.String(255), nullable=False),
+    db.Column('applied_at', db.DateTime, nullable=False),
+)
+
+
+def migration(version, description):
+    """Register ``apply(conn)`` as migration ``version``"""
+    def register(apply):
+        MIGRATIONS.append(Migration(version, description, apply))
+        return apply
+    return register
+
+
+def create_index(conn, name, table, *columns):
+    quote = conn.dialect.identifier_preparer.quote
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {quote(name)} ON {quote(table)} "
+                      f"({', '.join(quote(column) for column in columns)})"))
+
+
+def has_column(conn, table, column):
+    return column in {c['name'] for c in inspect(conn).get_columns(table)}
+
+
+@migration(1, 'Indexes for direct messages, board columns, attachments and task history')
+def hot_path_indexes(conn):
+    create_index(conn, 'ix_chat_message_dm', 'chat_message', 'user_id', 'recipient_id', 'timestamp')
+    create_index(conn, 'ix_message_attachment_message_id', 'message_attachment', 'message_id')
+    create_index(conn, 'ix_task_project_status', 'task', 'project_id', 'status')
+    create_index(conn, 'ix_task_assigned_to_status', 'task', 'assigned_to', 'status')
+    create_index(conn, 'ix_task_status', 'task', 'status')
+    create_index(conn, 'ix_task_comment_task_id', 'task_comment', 'task_id', 'created_at')
+    create_index(conn, 'ix_task_activity_log_task_id', 'task_activity_log', 'task_id', 'created_at')
+
+
+@migration(2, 'Index for room history pages')
+def room_history_index(conn):
+    create_index(conn, 'ix_chat_message_room_timestamp_id', 'chat_message', 'room_id', 'timestamp', 'id')
+
+
+@migration(3, 'Blob reference on message attachments')
+def attachment_blob_column(conn):
+    # Databases created before content-addressed attachment storage
+    if not has_column(conn, 'message_attachment', 'blob_sha256'):
+        conn.execute(text("ALTER TABLE message_attachment ADD COLUMN blob_sha256 VARCHAR(64) "
+                          "REFERENCES attachment_blob (sha256)"))
+    create_index(conn, 'ix_message_attachment_blob_sha256', 'message_attachment', 'blob_sha256')
+
+
+def applied_migrations():
+    """{version: applied_at} for this database"""
+    with db.engine.connect() as conn:
+        return dict(conn.execute(db.select(schema_migrations.c.version, schema_migrations.c.applied_at)).all())
+
+
+def run_migrations():
+    """Apply pending migrations in order; returns how many were applied"""
+    schema_migrations.create(db.engine, checkfirst=True)
+    applied = applied_migrations()
+    count = 0
+    for step in sorted(MIGRATIONS):
+        if step.version in applied:
+            continue
+        try:
+            with db.engine.begin() as conn:
+                step.apply(conn)
+                conn.execute(schema_migrations.insert().values(
+                    version=step.version, description=step.description, applied_at=datetime.utcnow()))
+        except DBAPIError:
+            # Another worker applied it concurrently
+            if step.version not in applied_migrations():
+                raise
+            continue
+        logging.info(f"Applied migration {step.version}: {step.description}")
+        count += 1
+    return count
+
+
+@app.cli.command('db-migrate')
+def db_migrate_command():
+    """Apply pending schema migrations and list them."""
+    count = run_migrations()
+    applied = applied_migrations()
+    for step in sorted(MIGRATIONS):
+        click.echo(f"{step.version:4}  {applied[step.version]:%Y-%m-%d %H:%M}  {step.description}")
+    click.echo(f"Applied {count} new migrations")
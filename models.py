@@ -58,20 +58,86 @@ class ChatMessage(db.Model):
     # Relationships
     attachments = db.relationship('MessageAttachment', backref='message', lazy='dynamic', cascade='all, delete-orphan')
     reactions = db.relationship('MessageReaction', backref='message', lazy='dynamic', cascade='all, delete-orphan')
+    reaction_counts = db.relationship('MessageReactionCount', lazy='dynamic', cascade='all, delete-orphan')
     replies = db.relationship('ChatMessage', backref=db.backref('parent', remote_side=[id]), lazy='dynamic', cascade='all, delete-orphan')
 
+    __table_args__ = (
+        # Keyset pagination of room history walks (room_id, timestamp, id)
+        db.Index('ix_chat_message_room_timestamp_id', 'room_id', 'timestamp', 'id'),
+        # Conversations between two users, in either direction
+        db.Index('ix_chat_message_dm', 'user_id', 'recipient_id', 'timestamp'),
+    )
+
+    @classmethod
+    def visible_to(cls, user_id):
+        """Filter for messages a user may read: public rooms, rooms they created and their own DMs"""
+        visible_rooms = db.select(ChatRoom.id).where(
+            db.or_(ChatRoom.is_private == False, ChatRoom.created_by == user_id))
+        return db.or_(
+            db.and_(cls.is_direct_message == True,
+                    db.or_(cls.user_id == user_id, cls.recipient_id == user_id)),
+            db.and_(cls.is_direct_message == False, cls.room_id.in_(visible_rooms))
+        )
+
     def __repr__(self):
         return f'<ChatMessage {self.content[:50]}...>'
 
 
+class AttachmentBlob(db.Model):
+    """Uploaded file contents stored once under their SHA-256, shared by attachments"""
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Last upload or release; unreferenced blobs are collected a grace period after this
+    touched_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<AttachmentBlob {self.sha256[:12]} refs={self.ref_count}>'
+
+
+class AttachmentPreview(db.Model):
+    """Thumbnail of an image or PDF blob, rendered in the background by media.py"""
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('attachment_blob.sha256'), primary_key=True)
+    status = db.Column(db.String(16), nullable=False, default='pending')  # pending, ready, failed, unsupported
+    width = db.Column(db.Integer, nullable=True)  # Size of the original image or PDF page
+    height = db.Column(db.Integer, nullable=True)
+    thumb_width = db.Column(db.Integer, nullable=True)
+    thumb_height = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<AttachmentPreview {self.blob_sha256[:12]} {self.status}>'
+
+
+class UploadSession(db.Model):
+    """Resumable upload in progress; its chunks are stored under uploads/partial/<id>/"""
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    file_type = db.Column(db.String(100), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=True)  # Expected hash, if the client sent one
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<UploadSession {self.id} {self.filename}>'
+
+
 class MessageAttachment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     message_id = db.Column(db.Integer, db.ForeignKey('chat_message.id'), nullable=False)
-    filename = db.Column(db.String(255), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)  # Path relative to the uploads directory
     original_filename = db.Column(db.String(255), nullable=False)
     file_size = db.Column(db.Integer, nullable=False)
     file_type = db.Column(db.String(100), nullable=False)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # NULL for files uploaded before content-addressed storage
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('attachment_blob.sha256'), nullable=True, index=True)
+
+    __table_args__ = (db.Index('ix_message_attachment_message_id', 'message_id'),)
 
     def __repr__(self):
         return f'<MessageAttachment {self.original_filename}>'
@@ -110,6 +176,13 @@ class Task(db.Model):
     comments = db.relationship('TaskComment', backref='task', lazy='dynamic', cascade='all, delete-orphan')
     activity_logs = db.relationship('TaskActivityLog', backref='task', lazy='dynamic', cascade='all, delete-orphan')
 
+    # Board columns filter by status within a project, an assignee or everything
+    __table_args__ = (
+        db.Index('ix_task_project_status', 'project_id', 'status'),
+        db.Index('ix_task_assigned_to_status', 'assigned_to', 'status'),
+        db.Index('ix_task_status', 'status'),
+    )
+
     def __repr__(self):
         return f'<Task {self.title}>'
 
@@ -123,6 +196,8 @@ class TaskComment(db.Model):
     
     # Relationships
     author = db.relationship('User', backref='task_comments')
+
+    __table_args__ = (db.Index('ix_task_comment_task_id', 'task_id', 'created_at'),)
     
     def __repr__(self):
         return f'<TaskComment {self.content[:50]}...>'
@@ -138,6 +213,8 @@ class TaskActivityLog(db.Model):
     
     # Relationships
     user = db.relationship('User', backref='task_activities')
+
+    __table_args__ = (db.Index('ix_task_activity_log_task_id', 'task_id', 'created_at'),)
     
     def __repr__(self):
         return f'<TaskActivityLog {self.action}>'
@@ -157,3 +234,13 @@ class MessageReaction(db.Model):
 
     def __repr__(self):
         return f'<MessageReaction {self.emoji} by {self.user_id} on {self.message_id}>'
+
+
+class MessageReactionCount(db.Model):
+    """Denormalized reaction totals, kept in step with MessageReaction by reactions.py"""
+    message_id = db.Column(db.Integer, db.ForeignKey('chat_message.id'), primary_key=True)
+    emoji = db.Column(db.String(16), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<MessageReactionCount {self.emoji} x{self.count} on {self.message_id}>'
@@ -0,0 +1,182 @@
+"""Online presence tracking.
+
+Every Socket.IO connection is counted per user, so a user stays online until
+their last tab disconnects. Connections that stop sending heartbeats are
+expired after PRESENCE_TTL seconds, which also cleans up after workers that
+died without running their disconnect handlers. Online/offline transitions
+are queued and broadcast as one batched diff per PRESENCE_FLUSH_INTERVAL
+instead of one broadcast per connect.
+
+Presence lives in process memory by default. Set PRESENCE_STORE_URL to a
+redis:// URL to share it between workers.
+"""
+import os
+import threading
+import time
+
+# Seconds without a heartbeat before a connection is considered gone
+PRESENCE_TTL = int(os.environ.get('PRESENCE_TTL', 90))
+# Seconds between batched presence broadcasts
+PRESENCE_FLUSH_INTERVAL = float(os.environ.get('PRESENCE_FLUSH_INTERVAL', 1.0))
+
+
+class MemoryPresenceStore:
+    """Connection registry held in this process (single worker)"""
+
+    def __init__(self):
+        self._connections = {}  # user_id -> {sid: last_seen}
+        self._lock = threading.Lock()
+
+    def add(self, user_id, sid, now):
+        """Register a connection; True if it is the user's first one"""
+        with self._lock:
+            connections = self._connections.setdefault(user_id, {})
+            connections[sid] = now
+            return len(connections) == 1
+
+    def touch(self, user_id, sid, now):
+        with self._lock:
+            connections = self._connections.get(user_id)
+            if connections and sid in connections:
+                connections[sid] = now
+
+    def remove(self, user_id, sid):
+        """Drop a connection; True if it was the user's last one"""
+        with self._lock:
+            connections = self._connections.get(user_id)
+            if not connections or connections.pop(sid, None) is None:
+                return False
+            if connections:
+                return False
+            del self._connections[user_id]
+            return True
+
+    def expire(self, cutoff):
+        """Drop connections last seen before cutoff; returns users that went offline"""
+        offline = []
+        with self._lock:
+            for user_id, connections in list(self._connections.items()):
+                for sid, last_seen in list(connections.items()):
+                    if last_seen < cutoff:
+                        del connections[sid]
+                if not connections:
+                    del self._connections[user_id]
+                    offline.append(user_id)
+        return offline
+
+    def online_user_ids(self):
+        with self._lock:
+            return set(self._connections)
+
+
+class RedisPresenceStore:
+    """Connection registry shared by all workers (requires the redis package)"""
+
+    # Both scripts keep the per-user connection hash and the online set consistent
+    _ADD_SCRIPT = """
+        redis.call('HSET', KEYS[1], ARGV[1], ARGV[3])
+        redis.call('SADD', KEYS[2], ARGV[2])
+        return redis.call('HLEN', KEYS[1])
+    """
+    _REMOVE_SCRIPT = """
+        if redis.call('HDEL', KEYS[1], ARGV[1]) == 0 then return 0 end
+        if redis.call('HLEN', KEYS[1]) == 0 then
+            redis.call('SREM', KEYS[2], ARGV[2])
+            return 1
+        end
+        return 0
+    """
+
+    def __init__(self, url, prefix='wispr:presence'):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.online_key = f'{prefix}:online'
+        self._add = self.redis.register_script(self._ADD_SCRIPT)
+        self._remove = self.redis.register_script(self._REMOVE_SCRIPT)
+
+    def _user_key(self, user_id):
+        return f'{self.prefix}:user:{user_id}'
+
+    def add(self, user_id, sid, now):
+        return self._add(keys=[self._user_key(user_id), self.online_key], args=[sid, user_id, now]) == 1
+
+    def touch(self, user_id, sid, now):
+        key = self._user_key(user_id)
+        if self.redis.hexists(key, sid):
+            self.redis.hset(key, sid, now)
+
+    def remove(self, user_id, sid):
+        return self._remove(keys=[self._user_key(user_id), self.online_key], args=[sid, user_id]) == 1
+
+    def expire(self, cutoff):
+        offline = []
+        for user_id in self.online_user_ids():
+            for sid, last_seen in self.redis.hgetall(self._user_key(user_id)).items():
+                if float(last_seen) < cutoff and self.remove(user_id, sid.decode()):
+                    offline.append(user_id)
+        return offline
+
+    def online_user_ids(self):
+        return {int(user_id) for user_id in self.redis.smembers(self.online_key)}
+
+
+class PresenceRegistry:
+    """Connection refcounting on top of a store, with queued transitions"""
+
+    def __init__(self, store):
+        self.store = store
+        self._pending = {}  # user_id -> (online, username) since the last flush
+        self._lock = threading.Lock()
+
+    def _queue(self, user_id, username, online):
+        with self._lock:
+            previous = self._pending.get(user_id)
+            if previous is not None and previous[0] != online:
+                # Came and went (or went and came back) within one interval
+                del self._pending[user_id]
+            else:
+                self._pending[user_id] = (online, username)
+
+    def connect(self, user_id, username, sid):
+        if self.store.add(user_id, sid, time.time()):
+            self._queue(user_id, username, True)
+
+    def disconnect(self, user_id, username, sid):
+        if self.store.remove(user_id, sid):
+            self._queue(user_id, username, False)
+
+    def heartbeat(self, user_id, sid):
+        self.store.touch(user_id, sid, time.time())
+
+    def online_user_ids(self):
+        return self.store.online_user_ids()
+
+    def online_count(self):
+        return len(self.store.online_user_ids())
+
+    def take_changes(self, lookup_username):
+        """Expire stale connections and return the queued transitions.
+
+        Returns ``(online, offline)`` lists of ``{'id', 'username'}`` dicts.
+        ``lookup_username`` resolves names for users whose connections
+        expired, since no handler saw them leave.
+        """
+        for user_id in self.store.expire(time.time() - PRESENCE_TTL):
+            self._queue(user_id, None, False)
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        online, offline = [], []
+        for user_id, (is_online, username) in pending.items():
+            entry = {'id': user_id, 'username': username or lookup_username(user_id)}
+            (online if is_online else offline).append(entry)
+        return online, offline
+
+
+def create_store(url):
+    if url and url.startswith(('redis://', 'rediss://')):
+        return RedisPresenceStore(url)
+    return MemoryPresenceStore()
+
+
+presence = PresenceRegistry(create_store(os.environ.get('PRESENCE_STORE_URL')))
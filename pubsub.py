@@ -0,0 +1,97 @@
+"""Socket.IO pub/sub backends for running Wispr as several worker processes.
+
+Set SOCKETIO_MESSAGE_QUEUE to share room broadcasts between workers:
+
+- ``redis://host:6379/0`` (or any Kombu URL) uses python-socketio's built-in
+  managers and works across hosts.
+- ``unix:///run/wispr/socketio`` uses UnixSocketManager below, a broker-less
+  backend for workers on a single host and for local multi-process testing.
+
+Without a message queue the default in-process manager is used, which is only
+correct with a single worker.
+"""
+import atexit
+import glob
+import logging
+import os
+import time
+
+import socketio
+
+try:
+    from eventlet.green import socket
+except ImportError:  # Threading async mode
+    import socket
+
+# Largest message accepted by a worker's socket
+MAX_DATAGRAM_SIZE = 4 * 1024 * 1024
+# How often to rescan the socket directory for workers that started or stopped
+PEER_REFRESH_INTERVAL = 1.0
+
+
+class UnixSocketManager(socketio.PubSubManager):
+    """Broker-less pub/sub over UNIX datagram sockets.
+
+    Every worker binds ``<directory>/<channel>.<host_id>.sock`` and publishing
+    sends the message to every socket in the directory. The base class
+    ignores messages that a worker receives from itself.
+    """
+    name = 'unix'
+
+    def __init__(self, url='unix:///tmp/wispr-socketio', channel='socketio',
+                 write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.directory = url[len('unix://'):]
+        os.makedirs(self.directory, exist_ok=True)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, MAX_DATAGRAM_SIZE)
+        self.path = None
+        if not write_only:
+            self.path = os.path.join(self.directory, f'{channel}.{self.host_id}.sock')
+            self.sock.bind(self.path)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, MAX_DATAGRAM_SIZE)
+            atexit.register(self._cleanup)
+        self._peers = []
+        self._peers_refreshed_at = 0
+
+    def _cleanup(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def _peer_paths(self):
+        now = time.monotonic()
+        if now - self._peers_refreshed_at > PEER_REFRESH_INTERVAL:
+            self._peers = glob.glob(os.path.join(self.directory, f'{self.channel}.*.sock'))
+            self._peers_refreshed_at = now
+        return self._peers
+
+    def _publish(self, data):
+        payload = self.json.dumps(data).encode('utf-8')
+        for path in self._peer_paths():
+            try:
+                self.sock.sendto(payload, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Socket left behind by a worker that has exited
+                if path != self.path:
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                self._peers_refreshed_at = 0
+            except OSError as e:
+                logging.error(f"Socket.IO pub/sub: could not publish to {path}: {e}")
+
+    def _listen(self):
+        while True:
+            yield self.sock.recv(MAX_DATAGRAM_SIZE)
+
+
+def socketio_queue_options(url, channel='wispr'):
+    """SocketIO keyword arguments for the configured message queue URL"""
+    if not url:
+        return {}
+    if url.startswith('unix://'):
+        return {'client_manager': UnixSocketManager(url, channel=channel)}
+    return {'message_queue': url, 'channel': channel}
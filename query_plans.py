@@ -0,0 +1,88 @@
+"""Query-plan regression checks for the hot queries.
+
+Each entry in HOT_QUERIES builds a query the way the app does. ``flask
+check-query-plans`` runs EXPLAIN QUERY PLAN (SQLite) or EXPLAIN (PostgreSQL,
+with sequential scans discouraged so small tables still show whether an
+index is usable) on each and exits non-zero if one reads a table with a full
+scan. deploy.sh runs it before starting the workers; run it in CI against a
+freshly created database too.
+"""
+import re
+
+import click
+from sqlalchemy import desc, text
+
+from app import app, db
+from board import BOARD_COLUMN_PAGE_SIZE, column_query, column_totals_query
+from models import ChatMessage, MessageAttachment, MessageReaction, MessageReactionCount, TaskActivityLog, TaskComment
+
+# Plan lines that mean a whole table is read
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (\w+)\b')
+POSTGRES_FULL_SCAN = re.compile(r'Seq Scan on "?(\w+)')
+
+HOT_QUERIES = {
+    'room history page': lambda: ChatMessage.query.filter_by(room_id=1, is_direct_message=False).order_by(
+        ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(51),
+    'direct messages': lambda: ChatMessage.query.filter(
+        ChatMessage.is_direct_message == True,
+        db.or_(
+            db.and_(ChatMessage.user_id == 1, ChatMessage.recipient_id == 2),
+            db.and_(ChatMessage.user_id == 2, ChatMessage.recipient_id == 1)
+        )).order_by(ChatMessage.timestamp.asc()),
+    'message attachments': lambda: db.session.query(MessageAttachment).filter(
+        MessageAttachment.message_id.in_([1, 2, 3])),
+    'reaction counts': lambda: db.session.query(MessageReactionCount).filter(
+        MessageReactionCount.message_id.in_([1, 2, 3]), MessageReactionCount.count > 0),
+    'own reactions': lambda: db.session.query(MessageReaction.message_id, MessageReaction.emoji).filter(
+        MessageReaction.message_id.in_([1, 2, 3]), MessageReaction.user_id == 1),
+    'board column': lambda: column_query('todo').limit(BOARD_COLUMN_PAGE_SIZE + 1),
+    'board column of a project': lambda: column_query('done', project_id=1).limit(BOARD_COLUMN_PAGE_SIZE + 1),
+    'board column of an assignee': lambda: column_query('todo', assignee_id=1).limit(BOARD_COLUMN_PAGE_SIZE + 1),
+    'board totals of a project': lambda: column_totals_query(project_id=1),
+    'task comments': lambda: TaskComment.query.filter(TaskComment.task_id == 1).order_by(TaskComment.created_at),
+    'task activity': lambda: TaskActivityLog.query.filter(TaskActivityLog.task_id == 1).order_by(
+        desc(TaskActivityLog.created_at)),
+}
+
+
+def explain(query):
+    """Plan lines for a query on the current database"""
+    dialect = db.engine.dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    with db.engine.begin() as conn:
+        if dialect.name == 'postgresql':
+            conn.execute(text('SET LOCAL enable_seqscan = off'))
+            return [row[0] for row in conn.execute(text('EXPLAIN ' + sql))]
+        return [row[3] for row in conn.execute(text('EXPLAIN QUERY PLAN ' + sql))]
+
+
+def full_scans(plan):
+    """Tables a plan reads in full"""
+    pattern = POSTGRES_FULL_SCAN if db.engine.dialect.name == 'postgresql' else SQLITE_FULL_SCAN
+    return [match.group(1) for match in (pattern.search(line.strip()) for line in plan) if match]
+
+
+def check_query_plans():
+    """{query name: (plan, tables scanned)} for every hot query"""
+    results = {}
+    for name, build in HOT_QUERIES.items():
+        plan = explain(build())
+        results[name] = (plan, full_scans(plan))
+    return results
+
+
+@app.cli.command('check-query-plans')
+@click.option('--verbose', is_flag=True, help='Print every plan, not only failing ones.')
+def check_query_plans_command(verbose):
+    """Fail if a hot query's plan scans a whole table."""
+    failed = 0
+    for name, (plan, scanned) in check_query_plans().items():
+        if scanned:
+            failed += 1
+        if scanned or verbose:
+            click.echo(f"{'FULL SCAN of ' + ', '.join(scanned) if scanned else 'ok'}: {name}")
+            for line in plan:
+                click.echo(f"    {line}")
+    if failed:
+        raise SystemExit(f"{failed} of {len(HOT_QUERIES)} hot queries scan whole tables")
+    click.echo(f"All {len(HOT_QUERIES)} hot query plans use indexes")
@@ -0,0 +1,119 @@
+"""Emoji reactions with denormalized per-message counts.
+
+Every add/remove changes the MessageReaction row and the matching
+MessageReactionCount total in one transaction, so clients can be sent a
+single +1/-1 delta and history pages can include reaction summaries from
+one query instead of loading every reaction row.
+"""
+import logging
+
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import MessageReaction, MessageReactionCount
+
+ALLOWED_EMOJIS = {'👍', '😂', '😢', '❤️', '🎉'}
+
+
+def _upsert(dialect):
+    return postgresql.insert if dialect == 'postgresql' else sqlite.insert
+
+
+def _bump_count(message_id, emoji, delta):
+    """Apply delta to the stored total and return the new count"""
+    if delta > 0:
+        stmt = _upsert(db.engine.dialect.name)(MessageReactionCount).values(
+            message_id=message_id, emoji=emoji, count=delta)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['message_id', 'emoji'],
+            set_={'count': MessageReactionCount.count + delta}
+        ).returning(MessageReactionCount.count)
+        return db.session.execute(stmt).scalar()
+    count = db.session.execute(
+        db.update(MessageReactionCount).where(
+            MessageReactionCount.message_id == message_id, MessageReactionCount.emoji == emoji
+        ).values(count=MessageReactionCount.count + delta).returning(MessageReactionCount.count)
+    ).scalar() or 0
+    if count <= 0:
+        db.session.execute(db.delete(MessageReactionCount).where(
+            MessageReactionCount.message_id == message_id, MessageReactionCount.emoji == emoji))
+        count = 0
+    return count
+
+
+def add_reaction(message_id, user_id, emoji):
+    """Record a reaction; returns the new count, or None if it already existed"""
+    db.session.add(MessageReaction(message_id=message_id, user_id=user_id, emoji=emoji))
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return None
+    count = _bump_count(message_id, emoji, 1)
+    db.session.commit()
+    return count
+
+
+def remove_reaction(message_id, user_id, emoji):
+    """Delete a reaction; returns the new count, or None if there was none"""
+    deleted = db.session.execute(db.delete(MessageReaction).where(
+        MessageReaction.message_id == message_id,
+        MessageReaction.user_id == user_id,
+        MessageReaction.emoji == emoji)).rowcount
+    if not deleted:
+        db.session.rollback()
+        return None
+    count = _bump_count(message_id, emoji, -1)
+    db.session.commit()
+    return count
+
+
+def remove_user_reactions(user_id):
+    """Delete every reaction of a user and take them off the counts (caller commits)"""
+    # At most one reaction per user, message and emoji, so each pair loses one
+    own_reaction = db.select(MessageReaction.id).where(
+        MessageReaction.user_id == user_id,
+        MessageReaction.message_id == MessageReactionCount.message_id,
+        MessageReaction.emoji == MessageReactionCount.emoji).exists()
+    db.session.execute(db.update(MessageReactionCount).where(own_reaction).values(
+        count=MessageReactionCount.count - 1))
+    db.session.execute(db.delete(MessageReactionCount).where(MessageReactionCount.count <= 0))
+    db.session.execute(db.delete(MessageReaction).where(MessageReaction.user_id == user_id))
+
+
+def reaction_summaries(message_ids, viewer_id=None):
+    """{message_id: {emoji: {'count', 'me'}}} for a page of messages, in two queries"""
+    if not message_ids:
+        return {}
+    summaries = {}
+    rows = db.session.query(MessageReactionCount).filter(
+        MessageReactionCount.message_id.in_(message_ids), MessageReactionCount.count > 0)
+    for row in rows:
+        summaries.setdefault(row.message_id, {})[row.emoji] = {'count': row.count, 'me': False}
+    if viewer_id is not None and summaries:
+        own = db.session.query(MessageReaction.message_id, MessageReaction.emoji).filter(
+            MessageReaction.message_id.in_(list(summaries)), MessageReaction.user_id == viewer_id)
+        for message_id, emoji in own:
+            if emoji in summaries[message_id]:
+                summaries[message_id][emoji]['me'] = True
+    return summaries
+
+
+def backfill_reaction_counts():
+    """Populate the counts table from existing reactions (once, after it is created)"""
+    if db.session.query(MessageReactionCount.message_id).first() is not None:
+        return
+    if db.session.query(MessageReaction.id).first() is None:
+        return
+    totals = db.session.query(MessageReaction.message_id, MessageReaction.emoji, func.count(MessageReaction.id)).group_by(
+        MessageReaction.message_id, MessageReaction.emoji)
+    db.session.execute(db.insert(MessageReactionCount), [
+        {'message_id': message_id, 'emoji': emoji, 'count': count} for message_id, emoji, count in totals])
+    try:
+        db.session.commit()
+        logging.info("Backfilled message reaction counts")
+    except IntegrityError:
+        # Another worker backfilled concurrently
+        db.session.rollback()
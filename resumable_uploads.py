@@ -0,0 +1,185 @@
+"""Resumable chunked uploads.
+
+A client starts an upload with its size and type, PUTs numbered chunks of
+RESUMABLE_CHUNK_SIZE bytes in any order (retrying any that fail), asks which
+chunks the server has after a reconnect, and finalizes. Each chunk is written
+to ``uploads/partial/<upload id>/<index>`` through a temp file and rename, so
+an interrupted PUT never counts as received, and finalizing streams the
+chunk files in order into the content-addressed store. Uploads not finalized
+within UPLOAD_SESSION_TTL seconds are removed by ``flask attachments-gc``.
+"""
+from datetime import datetime, timedelta
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from app import db
+from attachments import upload_dir, store_stream
+from models import UploadSession
+
+# Bytes per chunk; the last chunk may be shorter
+RESUMABLE_CHUNK_SIZE = 4 * 1024 * 1024
+# Largest file accepted through resumable uploads
+RESUMABLE_MAX_SIZE = int(os.environ.get('RESUMABLE_MAX_SIZE', 200 * 1024 * 1024))
+# Seconds an unfinished upload is kept
+UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', 24 * 3600))
+PARTIAL_DIR = 'partial'
+# Bytes copied from the request per step
+COPY_BUFFER_SIZE = 256 * 1024
+
+
+class UploadError(Exception):
+    """Invalid request against an upload session; ``status`` is the HTTP status to return"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _chunk_dir(upload_id):
+    return os.path.join(upload_dir(), PARTIAL_DIR, upload_id)
+
+
+def chunk_count(upload):
+    return max(1, -(-upload.total_size // upload.chunk_size))
+
+
+def expected_chunk_size(upload, index):
+    if index < chunk_count(upload) - 1:
+        return upload.chunk_size
+    return upload.total_size - upload.chunk_size * (chunk_count(upload) - 1)
+
+
+def start_upload(user_id, filename, file_type, total_size, sha256=None):
+    """Create an upload session; returns it"""
+    if total_size < 0 or total_size > RESUMABLE_MAX_SIZE:
+        raise UploadError(f'Files may be at most {RESUMABLE_MAX_SIZE // (1024 * 1024)} MB')
+    upload = UploadSession(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        filename=filename,
+        file_type=file_type,
+        total_size=total_size,
+        chunk_size=RESUMABLE_CHUNK_SIZE,
+        sha256=sha256.lower() if sha256 else None,
+        expires_at=datetime.utcnow() + timedelta(seconds=UPLOAD_SESSION_TTL)
+    )
+    db.session.add(upload)
+    db.session.commit()
+    os.makedirs(_chunk_dir(upload.id), exist_ok=True)
+    return upload
+
+
+def get_upload(upload_id, user_id):
+    """The user's unexpired upload session, or UploadError(404)"""
+    upload = db.session.get(UploadSession, upload_id)
+    if upload is None or upload.user_id != user_id or upload.expires_at < datetime.utcnow():
+        raise UploadError('Upload not found or expired', 404)
+    return upload
+
+
+def received_chunks(upload):
+    """Sorted indexes of the chunks stored so far"""
+    try:
+        names = os.listdir(_chunk_dir(upload.id))
+    except FileNotFoundError:
+        return []
+    return sorted(int(name) for name in names if name.isdigit())
+
+
+def write_chunk(upload, index, stream):
+    """Copy one chunk from ``stream`` to disk, checking its length; returns the bytes written"""
+    if not 0 <= index < chunk_count(upload):
+        raise UploadError('Chunk index out of range')
+    expected = expected_chunk_size(upload, index)
+    directory = _chunk_dir(upload.id)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.')
+    try:
+        written = 0
+        with os.fdopen(fd, 'wb') as out:
+            while written <= expected:
+                data = stream.read(min(COPY_BUFFER_SIZE, expected + 1 - written))
+                if not data:
+                    break
+                out.write(data)
+                written += len(data)
+        if written != expected:
+            raise UploadError(f'Chunk {index} must be {expected} bytes, got {written}')
+        os.replace(tmp_path, os.path.join(directory, str(index)))
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return written
+
+
+class _ChunkReader:
+    """Read the chunk files of an upload in order, as one stream"""
+
+    def __init__(self, paths):
+        self._paths = iter(paths)
+        self._current = None
+
+    def read(self, size):
+        while True:
+            if self._current is None:
+                path = next(self._paths, None)
+                if path is None:
+                    return b''
+                self._current = open(path, 'rb')
+            data = self._current.read(size)
+            if data:
+                return data
+            self.close()
+
+    def close(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+
+
+def finish_upload(upload):
+    """Assemble the chunks into a blob and end the session; returns a StoredBlob"""
+    missing = sorted(set(range(chunk_count(upload))) - set(received_chunks(upload)))
+    if missing:
+        raise UploadError(f'{len(missing)} chunks are missing', 409)
+    directory = _chunk_dir(upload.id)
+    reader = _ChunkReader(os.path.join(directory, str(index)) for index in range(chunk_count(upload)))
+    try:
+        blob = store_stream(reader)
+    finally:
+        reader.close()
+    expected_size, expected_sha256 = upload.total_size, upload.sha256
+    discard_upload(upload)
+    if blob.size != expected_size or (expected_sha256 and blob.sha256 != expected_sha256):
+        # The unreferenced blob is collected by attachments-gc
+        raise UploadError('Upload is corrupted, please try again', 422)
+    return blob
+
+
+def discard_upload(upload):
+    db.session.delete(upload)
+    db.session.commit()
+    shutil.rmtree(_chunk_dir(upload.id), ignore_errors=True)
+
+
+def expire_uploads():
+    """Remove expired sessions and orphaned chunk directories; returns how many were removed"""
+    now = datetime.utcnow()
+    expired = db.session.query(UploadSession).filter(UploadSession.expires_at < now).all()
+    for upload in expired:
+        discard_upload(upload)
+    partial_root = os.path.join(upload_dir(), PARTIAL_DIR)
+    if os.path.isdir(partial_root):
+        live = {upload_id for (upload_id,) in db.session.query(UploadSession.id)}
+        for name in os.listdir(partial_root):
+            path = os.path.join(partial_root, name)
+            # Directories whose session row is gone, e.g. after a crash mid-finalize
+            if name not in live and os.path.getmtime(path) < time.time() - UPLOAD_SESSION_TTL:
+                shutil.rmtree(path, ignore_errors=True)
+    if expired:
+        logging.info(f"Removed {len(expired)} expired uploads")
+    return len(expired)
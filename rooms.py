@@ -0,0 +1,92 @@
+"""Cached chat room lookups for the hot socket paths."""
+from collections import namedtuple
+import logging
+import threading
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import ChatRoom
+
+GENERAL_ROOM_NAME = 'General Chat'
+# Seconds before the cache is reloaded to pick up rooms changed by other workers
+ROOM_CACHE_TTL = 60
+# Minimum seconds between reloads caused by lookups of unknown room ids
+ROOM_MISS_RELOAD_INTERVAL = 1
+
+RoomInfo = namedtuple('RoomInfo', ['id', 'name', 'description', 'is_private', 'created_by'])
+
+
+class RoomRegistry:
+    """Maps room aliases ('general') and ids to room metadata.
+
+    Rooms are few and rarely change, so the whole table is cached and
+    reloaded when invalidated (create/delete/clear), after ROOM_CACHE_TTL,
+    or when an unknown id is looked up (a room created by another worker).
+    """
+
+    def __init__(self):
+        self._by_id = None
+        self._general = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._by_id = None
+
+    def _load(self):
+        rows = db.session.query(ChatRoom.id, ChatRoom.name, ChatRoom.description,
+                                ChatRoom.is_private, ChatRoom.created_by).all()
+        by_id = {row.id: RoomInfo(*row) for row in rows}
+        with self._lock:
+            self._general = next((room for room in by_id.values() if room.name == GENERAL_ROOM_NAME), None)
+            self._by_id = by_id
+            self._loaded_at = time.monotonic()
+
+    def _rooms(self):
+        if self._by_id is None or time.monotonic() - self._loaded_at > ROOM_CACHE_TTL:
+            self._load()
+        return self._by_id
+
+    def all(self):
+        return list(self._rooms().values())
+
+    def get(self, room_id):
+        room = self._rooms().get(room_id)
+        if room is None and time.monotonic() - self._loaded_at > ROOM_MISS_RELOAD_INTERVAL:
+            self._load()
+            room = self._by_id.get(room_id)
+        return room
+
+    def general(self, created_by=None):
+        """The General Chat room, created on first use if created_by is given"""
+        self._rooms()
+        if self._general is None and created_by is not None:
+            general_room = ChatRoom(
+                name=GENERAL_ROOM_NAME,
+                description='Default chat room for all team members',
+                created_by=created_by
+            )
+            db.session.add(general_room)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Created concurrently by another request
+                db.session.rollback()
+                logging.info("General Chat room was created concurrently")
+            self._load()
+        return self._general
+
+    def resolve(self, room_ref, created_by=None):
+        """Resolve a client room reference ('general', 12 or '12') to a RoomInfo or None"""
+        if room_ref == 'general':
+            return self.general(created_by=created_by)
+        try:
+            room_id = int(room_ref)
+        except (TypeError, ValueError):
+            return None
+        return self.get(room_id)
+
+
+room_registry = RoomRegistry()
@@ -1,23 +1,52 @@
-from flask import render_template, request, redirect, url_for, session, flash, jsonify, Response, send_from_directory
+from flask import render_template, request, redirect, url_for, session, flash, jsonify, Response, abort
 from flask_socketio import emit, join_room, leave_room
 from app import app, db, socketio, limiter
-from models import User, ChatMessage, Task, ChatRoom, MessageAttachment, TaskActivityLog, MessageReaction, Project
+from models import User, ChatMessage, Task, ChatRoom, MessageAttachment, AttachmentPreview, TaskActivityLog, MessageReaction, MessageReactionCount, Project
+from serializers import serialize_messages, serialize_message
+from presence import presence, PRESENCE_FLUSH_INTERVAL
+from typing_state import typing_manager, TYPING_FLUSH_INTERVAL
+from rooms import room_registry, GENERAL_ROOM_NAME
+from identity import identity_cache, current_identity
+from message_writer import message_writer, WriteBehindUnavailable
+from search import search_messages, parse_cursor
+from dashboard_stats import dashboard_stats
+from reactions import ALLOWED_EMOJIS, add_reaction, remove_reaction, remove_user_reactions
+from attachments import (store_stream, issue_token, attach, release_attachments, upload_dir, is_allowed_upload,
+                         thumb_relpath, THUMB_FORMATS)
+from media import media_pipeline
+from downloads import serve_file
+import metrics
+from avatars import (save_avatar_upload, avatar_url, parse_variant, variant_filename, remove_avatar_files,
+                     AVATAR_FOLDER, AVATAR_FORMATS, AVATAR_CACHE_MAX_AGE)
+from resumable_uploads import (UploadError, start_upload, get_upload, received_chunks, write_chunk, finish_upload,
+                               discard_upload, chunk_count)
+from board import load_board, load_column, serialize_task, BOARD_STATUSES, BOARD_COLUMN_PAGE_SIZE, BOARD_COLUMN_MAX_PAGE_SIZE
 from werkzeug.security import generate_password_hash
-from datetime import datetime
-from sqlalchemy import desc
+from datetime import datetime, timezone
+from sqlalchemy import desc, func
+from sqlalchemy.orm import joinedload
+import json
 import logging
 import re
-from werkzeug.utils import secure_filename
-from PIL import Image
 import os
 
-# Store online users
-online_users = set()
-
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
-PROFILE_PIC_FOLDER = os.path.join('static', 'profile_pics')
-MAX_PROFILE_PIC_SIZE = 1 * 1024 * 1024  # 1MB
-PROFILE_PIC_DIM = 256
+
+# Room history page sizes
+ROOM_MESSAGES_PAGE_SIZE = 50
+ROOM_MESSAGES_MAX_PAGE_SIZE = 200
+
+# Incremental sync page sizes
+SYNC_PAGE_SIZE = 100
+SYNC_MAX_PAGE_SIZE = 500
+# Search result page sizes
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
+# Uploads that can be attached to one message
+MAX_ATTACHMENTS_PER_MESSAGE = 10
+# Browser cache lifetime of attachment downloads and thumbnails (blobs never change)
+ATTACHMENT_CACHE_MAX_AGE = 24 * 3600
+THUMBNAIL_CACHE_MAX_AGE = 30 * 24 * 3600
 
 
 def login_required(f):
@@ -41,7 +70,7 @@ def moderator_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login'))
-        user = User.query.get(session['user_id'])
+        user = current_identity()
         if not user or user.role not in ('admin', 'moderator'):
             flash('Moderator or admin access required', 'error')
             return redirect(url_for('dashboard'))
@@ -58,7 +87,7 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login'))
-        user = User.query.get(session['user_id'])
+        user = current_identity()
         if not user or user.role != 'admin':
             flash('Admin access required', 'error')
             return redirect(url_for('dashboard'))
@@ -111,128 +140,215 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    # Get recent messages and tasks for dashboard overview
-    recent_messages = ChatMessage.query.order_by(
-        ChatMessage.timestamp.desc()).limit(5).all()
-    recent_tasks = Task.query.order_by(Task.updated_at.desc()).limit(5).all()
+    # Recent room messages the user can see (DMs are encrypted client-side)
+    recent_messages = ChatMessage.query.options(joinedload(ChatMessage.author)).filter(
+        ChatMessage.is_direct_message == False,
+        ChatMessage.visible_to(session['user_id'])
+    ).order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(5).all()
 
-    # Task statistics
-    total_tasks = Task.query.count()
-    todo_tasks = Task.query.filter_by(status='todo').count()
-    in_progress_tasks = Task.query.filter_by(status='in_progress').count()
-    done_tasks = Task.query.filter_by(status='done').count()
+    # Task statistics and recent tasks are cached between task changes
+    task_counts = dashboard_stats.task_counts()
 
     return render_template('dashboard.html',
                            recent_messages=recent_messages,
-                           recent_tasks=recent_tasks,
-                           total_tasks=total_tasks,
-                           todo_tasks=todo_tasks,
-                           in_progress_tasks=in_progress_tasks,
-                           done_tasks=done_tasks)
+                           recent_tasks=dashboard_stats.recent_tasks(),
+                           total_tasks=task_counts['total'],
+                           todo_tasks=task_counts['todo'],
+                           in_progress_tasks=task_counts['in_progress'],
+                           done_tasks=task_counts['done'])
 
 
 @app.route('/chat', methods=['GET', 'POST'])
 @login_required
 def chat():
     # Create default general room if it doesn't exist
-    general_room = ChatRoom.query.filter_by(name='General Chat').first()
-    if not general_room:
-        general_room = ChatRoom(
-            name='General Chat',
-            description='Default chat room for all team members',
-            created_by=session['user_id']
-        )
-        db.session.add(general_room)
-        db.session.commit()
+    general_room = room_registry.general(created_by=session['user_id'])
     
-    # Get all chat rooms (including General Chat) and users
-    chat_rooms = ChatRoom.query.filter_by(is_private=False).order_by(
-        ChatRoom.name == 'General Chat').all()
+    # Get all chat rooms (General Chat last) and users
+    chat_rooms = sorted((room for room in room_registry.all() if not room.is_private),
+                        key=lambda room: (room.name == GENERAL_ROOM_NAME, room.id))
     users = User.query.filter(User.id != session['user_id']).all()
     
-    return render_template('chat.html', chat_rooms=chat_rooms, users=users)
+    return render_template('chat.html', chat_rooms=chat_rooms, users=users, general_room_id=general_room.id)
+
+
+def parse_timestamp_arg(value):
+    """Parse an ISO timestamp query argument into a naive UTC datetime"""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
 
 
 @app.route('/api/messages')
 @login_required
 @limiter.limit("60 per minute")
 def get_messages():
-    """API endpoint to fetch latest messages for real-time updates"""
+    """Messages visible to the current user since a timestamp (capped; prefer /api/sync)"""
     since = request.args.get('since')
 
-    query = ChatMessage.query.order_by(ChatMessage.timestamp.asc())
+    query = ChatMessage.query.filter(
+        ChatMessage.visible_to(session['user_id'])
+    ).order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc())
 
     if since:
         try:
-            from datetime import datetime
-            since_date = datetime.fromisoformat(since.replace('Z', '+00:00'))
-            query = query.filter(ChatMessage.timestamp > since_date)
-        except:
-            pass
+            since_date = parse_timestamp_arg(since)
+        except ValueError:
+            return jsonify({'error': 'Invalid since timestamp'}), 400
+        query = query.filter(ChatMessage.timestamp > since_date)
 
-    messages = query.all()
+    messages = query.limit(SYNC_MAX_PAGE_SIZE).all()
 
-    return jsonify([{
-        'id': msg.id,
-        'content': msg.content,
-        'username': msg.author.username,
-        'role': msg.author.role,
-        'status': msg.author.status or 'offline',
-        'timestamp': msg.timestamp.isoformat(),
-        'profile_pic': msg.author.profile_pic,
-        'attachments': [{
-            'id': att.id,
-            'original_filename': att.original_filename,
-            'file_size': att.file_size
-        } for att in msg.attachments]
-    } for msg in messages])
+    return jsonify(serialize_messages(messages, viewer_id=session['user_id']))
+
+
+@app.route('/api/sync')
+@login_required
+@limiter.limit("60 per minute")
+def sync_messages():
+    """Incremental catch-up across every room and DM the current user can see.
+
+    `cursor` is the highest message id the client has already seen. The
+    response carries the next messages after it in id order, the cursor to
+    resume from and whether more remain. Without a cursor no messages are
+    returned, only the current position to start syncing from.
+    """
+    cursor = request.args.get('cursor', type=int)
+    if cursor is None:
+        latest_id = db.session.query(func.max(ChatMessage.id)).scalar() or 0
+        return jsonify({'messages': [], 'cursor': latest_id, 'has_more': False})
+
+    limit = request.args.get('limit', SYNC_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, SYNC_MAX_PAGE_SIZE))
+
+    messages = ChatMessage.query.filter(
+        ChatMessage.id > cursor,
+        ChatMessage.visible_to(session['user_id'])
+    ).order_by(ChatMessage.id.asc()).limit(limit + 1).all()
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+
+    return jsonify({
+        'messages': serialize_messages(messages, viewer_id=session['user_id']),
+        'cursor': messages[-1].id if messages else cursor,
+        'has_more': has_more
+    })
+
+
+@app.route('/api/search')
+@login_required
+@limiter.limit("30 per minute")
+def search():
+    """Ranked full-text search over room messages the current user can see.
+
+    Supports `room` (id or 'general'), `author` (username), `from`/`to`
+    (ISO timestamps) and `cursor`/`limit` paging. Each result is a
+    serialized message with a highlighted `snippet`.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'success': False, 'error': 'Search query is required'}), 400
+
+    filters = {}
+    if request.args.get('room'):
+        room = room_registry.resolve(request.args['room'])
+        if not room:
+            return jsonify({'success': False, 'error': 'Unknown room'}), 400
+        filters['room_id'] = room.id
+    if request.args.get('author'):
+        author = User.query.with_entities(User.id).filter_by(username=request.args['author']).first()
+        if not author:
+            return jsonify({'results': [], 'cursor': None, 'has_more': False})
+        filters['author_id'] = author.id
+    try:
+        if request.args.get('from'):
+            filters['start'] = parse_timestamp_arg(request.args['from'])
+        if request.args.get('to'):
+            filters['end'] = parse_timestamp_arg(request.args['to'])
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid date'}), 400
+
+    cursor = None
+    if request.args.get('cursor'):
+        cursor = parse_cursor(request.args['cursor'])
+        if cursor is None:
+            return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+
+    limit = request.args.get('limit', SEARCH_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, SEARCH_MAX_PAGE_SIZE))
+
+    results, next_cursor, has_more = search_messages(
+        session['user_id'], query, cursor=cursor, limit=limit, **filters)
+    serialized = serialize_messages([message for message, score, snippet in results],
+                                    viewer_id=session['user_id'])
+    for data, (message, score, snippet) in zip(serialized, results):
+        data['snippet'] = snippet
+        data['score'] = score
+
+    return jsonify({'results': serialized, 'cursor': next_cursor, 'has_more': has_more})
 
 
 @app.route('/api/room_messages/<room_id>')
 @login_required
 @limiter.limit("60 per minute")
 def get_room_messages(room_id):
-    """Get messages for a specific room"""
-    if room_id == 'general':
-        room = ChatRoom.query.filter_by(name='General Chat').first()
-        if not room:
-            return jsonify([])
-        room_id = room.id
-    else:
-        try:
-            room_id = int(room_id)
-        except ValueError:
-            return jsonify([])
-    
-    messages = ChatMessage.query.filter_by(
-        room_id=room_id, 
+    """Get one page of messages for a specific room.
+
+    Pages are keyset-paginated on (timestamp, id): with no cursor the latest
+    `limit` messages are returned, `before_id` walks back into older history
+    and `after_id` fetches anything newer than the given message.
+    """
+    empty_page = {'messages': [], 'has_more': False}
+    room = room_registry.resolve(room_id)
+    if not room:
+        return jsonify(empty_page)
+    room_id = room.id
+
+    limit = request.args.get('limit', ROOM_MESSAGES_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, ROOM_MESSAGES_MAX_PAGE_SIZE))
+    before_id = request.args.get('before_id', type=int)
+    after_id = request.args.get('after_id', type=int)
+
+    query = ChatMessage.query.filter_by(
+        room_id=room_id,
         is_direct_message=False
-    ).order_by(ChatMessage.timestamp.asc()).all()
-    
-    return jsonify([{
-        'id': msg.id,
-        'content': msg.content,
-        'username': msg.author.username,
-        'role': msg.author.role,
-        'status': msg.author.status or 'offline',
-        'timestamp': msg.timestamp.isoformat(),
-        'parent_id': msg.parent_id,
-        'parent_username': msg.parent.author.username if msg.parent else None,
-        'parent_content': msg.parent.content[:50] + ('...' if msg.parent and len(msg.parent.content) > 50 else '') if msg.parent else None,
-        'profile_pic': msg.author.profile_pic,
-        'attachments': [{
-            'id': att.id,
-            'original_filename': att.original_filename,
-            'file_size': att.file_size
-        } for att in msg.attachments]
-    } for msg in messages])
+    )
+
+    cursor_id = before_id if before_id is not None else after_id
+    if cursor_id is not None:
+        cursor_timestamp = db.session.query(ChatMessage.timestamp).filter_by(
+            id=cursor_id, room_id=room_id).scalar()
+        if cursor_timestamp is None:
+            return jsonify(empty_page)
+
+    if after_id is not None and before_id is None:
+        # Newer messages, oldest first
+        messages = query.filter(db.or_(
+            ChatMessage.timestamp > cursor_timestamp,
+            db.and_(ChatMessage.timestamp == cursor_timestamp, ChatMessage.id > after_id)
+        )).order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc()).limit(limit + 1).all()
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+    else:
+        # Latest page or older history, fetched newest first and flipped
+        if before_id is not None:
+            query = query.filter(db.or_(
+                ChatMessage.timestamp < cursor_timestamp,
+                db.and_(ChatMessage.timestamp == cursor_timestamp, ChatMessage.id < before_id)
+            ))
+        messages = query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(limit + 1).all()
+        has_more = len(messages) > limit
+        messages = messages[:limit][::-1]
+
+    return jsonify({'has_more': has_more, 'messages': serialize_messages(messages, viewer_id=session['user_id'])})
 
 
 @app.route('/api/online_count')
 @login_required
 def get_online_count():
     """Get count of online users"""
-    return jsonify({'count': len(online_users)})
+    return jsonify({'count': presence.online_count()})
 
 
 @app.route('/api/direct_messages/<int:user_id>')
@@ -247,28 +363,7 @@ def get_direct_messages(user_id):
             db.and_(ChatMessage.user_id == user_id, ChatMessage.recipient_id == session['user_id'])
         )
     ).order_by(ChatMessage.timestamp.asc()).all()
-    return jsonify([
-        {
-            'id': msg.id,
-            'content': msg.content,  # Encrypted if is_direct_message
-            'username': msg.author.username,
-            'role': msg.author.role,
-            'status': msg.author.status or 'offline',
-            'timestamp': msg.timestamp.isoformat(),
-            'parent_id': msg.parent_id,
-            'parent_username': msg.parent.author.username if msg.parent else None,
-            'parent_content': msg.parent.content[:50] + ('...' if msg.parent and len(msg.parent.content) > 50 else '') if msg.parent else None,
-            'profile_pic': msg.author.profile_pic,
-            'attachments': [
-                {
-                    'id': att.id,
-                    'original_filename': att.original_filename,
-                    'file_size': att.file_size
-                } for att in msg.attachments
-            ],
-            'is_direct_message': True
-        } for msg in messages
-    ])
+    return jsonify(serialize_messages(messages, viewer_id=session['user_id']))
 
 
 @app.route('/api/create_room', methods=['POST'])
@@ -298,6 +393,7 @@ def create_room():
     try:
         db.session.add(new_room)
         db.session.commit()
+        room_registry.invalidate()
         
         return jsonify({
             'success': True, 
@@ -321,15 +417,23 @@ def delete_room(room_id):
     room = ChatRoom.query.get_or_404(room_id)
     
     # Prevent deletion of General Chat room
-    if room.name == 'General Chat':
+    if room.name == GENERAL_ROOM_NAME:
         return jsonify({'success': False, 'error': 'Cannot delete the General Chat room'})
     
     # Delete all messages in the room first
+    message_writer.flush()
+    room_message_ids = db.select(ChatMessage.id).where(ChatMessage.room_id == room_id)
+    release_attachments(room_message_ids)
+    # Bulk deletes skip the ORM cascade, so remove the reactions explicitly
+    MessageReactionCount.query.filter(MessageReactionCount.message_id.in_(room_message_ids)).delete(
+        synchronize_session=False)
+    MessageReaction.query.filter(MessageReaction.message_id.in_(room_message_ids)).delete(synchronize_session=False)
     ChatMessage.query.filter_by(room_id=room_id).delete()
     
     # Delete the room
     db.session.delete(room)
     db.session.commit()
+    room_registry.invalidate()
     
     logging.info(f"Admin {session['username']} (id={session['user_id']}) deleted room: {room_id}")
     
@@ -342,15 +446,19 @@ def clear_all_chat_data():
     """Clear all chat messages and rooms except General Chat (admin only)"""
     try:
         # Delete all message attachments first
-        MessageAttachment.query.delete()
+        message_writer.flush()
+        release_attachments(db.select(ChatMessage.id))
         
-        # Delete all chat messages
+        # Delete all reactions and chat messages
+        MessageReactionCount.query.delete()
+        MessageReaction.query.delete()
         ChatMessage.query.delete()
         
         # Delete all chat rooms except General Chat
-        ChatRoom.query.filter(ChatRoom.name != 'General Chat').delete()
+        ChatRoom.query.filter(ChatRoom.name != GENERAL_ROOM_NAME).delete()
         
         db.session.commit()
+        room_registry.invalidate()
         
         return jsonify({'success': True, 'message': 'All chat data cleared successfully'})
     except Exception as e:
@@ -368,62 +476,151 @@ def upload_file():
     
     files = request.files.getlist('files')
     uploaded_files = []
-    
-    # Create uploads directory if it doesn't exist
-    import os
-    upload_dir = os.path.join(app.root_path, 'uploads')
-    os.makedirs(upload_dir, exist_ok=True)
-
-    # Allowed file extensions and MIME types
-    ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.pdf', '.txt', '.docx'}
-    ALLOWED_MIME_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'application/pdf', 'text/plain', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'}
 
     for file in files:
         if file.filename:
-            file_extension = os.path.splitext(file.filename)[1].lower()
-            if file_extension not in ALLOWED_EXTENSIONS or (file.content_type and file.content_type not in ALLOWED_MIME_TYPES):
+            if not is_allowed_upload(file.filename, file.content_type):
                 logging.warning(f"Blocked upload of disallowed file type: {file.filename} ({file.content_type}) by user {session['username']} (id={session['user_id']})")
                 continue  # Skip disallowed file types
-            # Generate unique filename
-            import uuid
-            unique_filename = str(uuid.uuid4()) + file_extension
-            file_path = os.path.join(upload_dir, unique_filename)
-            # Save file
-            file.save(file_path)
-            # Get file size
-            file_size = os.path.getsize(file_path)
+            # Hash while streaming into the content-addressed store; identical files share a blob
+            file_type = file.content_type or 'application/octet-stream'
+            blob = store_stream(file.stream)
+            metrics.upload_bytes.inc(blob.size, kind='attachment')
+            media_pipeline.enqueue(blob.sha256, file_type)
             uploaded_files.append({
-                'filename': unique_filename,
+                'token': issue_token(blob, file.filename, file_type, session['user_id']),
+                'sha256': blob.sha256,
                 'original_filename': file.filename,
-                'file_size': file_size,
-                'file_type': file.content_type or 'application/octet-stream'
+                'file_size': blob.size,
+                'file_type': file_type
             })
     logging.info(f"User {session['username']} (id={session['user_id']}) uploaded a file from {request.remote_addr}")
     return jsonify({'success': True, 'files': uploaded_files})
 
 
+# Resumable uploads: init, PUT numbered chunks (retrying as needed), finalize.
+# Chunk requests have their own generous limit so retries do not exhaust it.
+@app.route('/api/uploads', methods=['POST'])
+@login_required
+@limiter.limit("60 per hour")
+def start_resumable_upload():
+    """Start a resumable upload from {filename, size, file_type, sha256 (optional)}"""
+    data = request.get_json(silent=True) or {}
+    filename = (data.get('filename') or '').strip()
+    file_type = data.get('file_type') or 'application/octet-stream'
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'File size is required'}), 400
+    if not filename or not is_allowed_upload(filename, data.get('file_type')):
+        logging.warning(f"Blocked upload of disallowed file type: {filename} ({file_type}) by user {session['username']} (id={session['user_id']})")
+        return jsonify({'success': False, 'error': 'File type not allowed'}), 400
+    sha256 = data.get('sha256')
+    if sha256 and not re.fullmatch(r'[0-9a-fA-F]{64}', sha256):
+        return jsonify({'success': False, 'error': 'Invalid sha256'}), 400
+    upload = start_upload(session['user_id'], filename, file_type, size, sha256)
+    return jsonify({
+        'success': True,
+        'upload_id': upload.id,
+        'chunk_size': upload.chunk_size,
+        'total_chunks': chunk_count(upload)
+    })
+
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+@login_required
+@limiter.limit("600 per hour")
+def resumable_upload_status(upload_id):
+    """Chunks received so far, so an interrupted client can resume"""
+    upload = get_upload(upload_id, session['user_id'])
+    return jsonify({
+        'success': True,
+        'upload_id': upload.id,
+        'chunk_size': upload.chunk_size,
+        'total_chunks': chunk_count(upload),
+        'received': received_chunks(upload)
+    })
+
+
+@app.route('/api/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+@login_required
+@limiter.limit("3000 per hour")
+def put_upload_chunk(upload_id, index):
+    """Store one chunk (raw request body); repeating a PUT replaces the chunk"""
+    upload = get_upload(upload_id, session['user_id'])
+    metrics.upload_bytes.inc(write_chunk(upload, index, request.stream), kind='chunk')
+    return jsonify({'success': True, 'index': index})
+
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+@login_required
+@limiter.limit("60 per hour")
+def finalize_upload(upload_id):
+    """Assemble the chunks into the attachment store and return an upload token"""
+    upload = get_upload(upload_id, session['user_id'])
+    filename, file_type = upload.filename, upload.file_type
+    blob = finish_upload(upload)
+    media_pipeline.enqueue(blob.sha256, file_type)
+    logging.info(f"User {session['username']} (id={session['user_id']}) uploaded a file in chunks from {request.remote_addr}")
+    return jsonify({'success': True, 'file': {
+        'token': issue_token(blob, filename, file_type, session['user_id']),
+        'sha256': blob.sha256,
+        'original_filename': filename,
+        'file_size': blob.size,
+        'file_type': file_type
+    }})
+
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_upload(upload_id):
+    discard_upload(get_upload(upload_id, session['user_id']))
+    return jsonify({'success': True})
+
+
 @app.route('/download/<int:attachment_id>')
 @login_required
 def download_file(attachment_id):
-    """Download file attachment"""
-    attachment = MessageAttachment.query.get_or_404(attachment_id)
-    
-    import os
-    from flask import send_file
-    upload_dir = os.path.join(app.root_path, 'uploads')
-    file_path = os.path.join(upload_dir, attachment.filename)
+    """Download file attachment; in accel mode nginx sends the bytes"""
+    # Only attachments of messages the user can read
+    attachment = MessageAttachment.query.join(ChatMessage, MessageAttachment.message_id == ChatMessage.id).filter(
+        MessageAttachment.id == attachment_id, ChatMessage.visible_to(session['user_id'])
+    ).first_or_404()
     
-    if os.path.exists(file_path):
-        return send_file(file_path, as_attachment=True, download_name=attachment.original_filename)
-    else:
+    if not os.path.isfile(os.path.join(upload_dir(), attachment.filename)):
         flash('File not found', 'error')
         return redirect(url_for('chat'))
+    return serve_file('uploads', upload_dir(), attachment.filename,
+                      download_name=attachment.original_filename, mimetype=attachment.file_type,
+                      as_attachment=True, private=True, etag=attachment.blob_sha256 or True,
+                      max_age=ATTACHMENT_CACHE_MAX_AGE if attachment.blob_sha256 else None)
+
+
+@app.route('/thumbnail/<int:attachment_id>')
+@login_required
+def attachment_thumbnail(attachment_id):
+    """Thumbnail of an image or PDF attachment, WebP when the browser accepts it"""
+    row = db.session.query(MessageAttachment.blob_sha256).join(
+        ChatMessage, MessageAttachment.message_id == ChatMessage.id
+    ).join(AttachmentPreview, AttachmentPreview.blob_sha256 == MessageAttachment.blob_sha256).filter(
+        MessageAttachment.id == attachment_id, AttachmentPreview.status == 'ready',
+        ChatMessage.visible_to(session['user_id'])
+    ).first()
+    if row is None:
+        abort(404)
+    extension = 'webp' if request.accept_mimetypes['image/webp'] else 'jpg'
+    response = serve_file('uploads', upload_dir(), thumb_relpath(row.blob_sha256, extension),
+                          mimetype=THUMB_FORMATS[extension], max_age=THUMBNAIL_CACHE_MAX_AGE, private=True,
+                          etag=f'{row.blob_sha256}.{extension}')
+    response.vary.add('Accept')
+    return response
 
 
 @app.route('/api/edit_message/<int:message_id>', methods=['PUT'])
 @login_required
 def edit_message(message_id):
     """Edit a message (only by the author)"""
+    message_writer.flush()
     message = ChatMessage.query.get_or_404(message_id)
     
     # Check if user is the author
@@ -447,6 +644,7 @@ def edit_message(message_id):
 @login_required
 def delete_message(message_id):
     """Delete a message (only by the author or admin)"""
+    message_writer.flush()
     message = ChatMessage.query.get_or_404(message_id)
     
     # Check if user is the author or admin
@@ -454,7 +652,7 @@ def delete_message(message_id):
         return jsonify({'success': False, 'error': 'You can only delete your own messages'})
     
     # Delete message attachments first
-    MessageAttachment.query.filter_by(message_id=message_id).delete()
+    release_attachments([message_id])
     
     # Delete the message
     db.session.delete(message)
@@ -486,76 +684,77 @@ def kanban():
         if not project_id:
             flash('Project is required for each task.', 'error')
             return redirect(url_for('kanban'))
+        board_project_id = request.args.get('project', type=int)
 
         if title:
-            task = Task(title=title,
-                        description=description,
-                        priority=priority,
-                        assigned_to=assigned_to,
-                        due_date=due_date,
-                        user_id=session['user_id'],
-                        project_id=project_id)
-            db.session.add(task)
-            db.session.commit()
-            
-            # Log task creation
-            from models import TaskActivityLog
-            import json
-            activity = TaskActivityLog(
-                action='task_created',
-                details=json.dumps({'title': title}),
-                task_id=task.id,
-                user_id=session['user_id']
-            )
-            db.session.add(activity)
-            db.session.commit()
-            
+            create_task(title, description, priority, assigned_to, due_date, project_id)
             flash('Task created successfully', 'success')
-        return redirect(url_for('kanban'))
+        return redirect(url_for('kanban', project=board_project_id))
 
-    # Get all users for assignment dropdown
-    users = User.query.all()
+    # Only ids and names are needed for the dropdowns and project badges
+    users = User.query.with_entities(User.id, User.username).order_by(User.username).all()
+    projects = Project.query.with_entities(Project.id, Project.name).order_by(Project.created_at.desc()).all()
 
-    # Get all projects
-    projects = Project.query.order_by(Project.created_at.desc()).all()
-
-    # Query tasks with joined project for display
-    todo_tasks = Task.query.filter_by(status='todo').order_by(Task.due_date.asc().nullslast(), Task.created_at.desc()).all()
-    in_progress_tasks = Task.query.filter_by(status='in_progress').order_by(Task.due_date.asc().nullslast(), Task.created_at.desc()).all()
-    done_tasks = Task.query.filter_by(status='done').order_by(Task.updated_at.desc()).all()
+    # Render only the selected board, each column capped at one page
+    board_project_id = request.args.get('project', type=int)
+    board_assignee_id = request.args.get('assignee', type=int)
+    board = load_board(board_project_id, board_assignee_id)
 
     return render_template('kanban.html',
-                           todo_tasks=todo_tasks,
-                           in_progress_tasks=in_progress_tasks,
-                           done_tasks=done_tasks,
+                           board=board,
+                           board_project_id=board_project_id,
+                           board_assignee_id=board_assignee_id,
                            users=users,
                            projects=projects,
                            now=datetime.utcnow())
 
 
+@app.route('/api/board')
+@login_required
+def get_board():
+    """Kanban columns filtered by `project` and `assignee`.
+
+    Returns the first page of every column, or with `status` and `offset`
+    the next page of one column ("load more"). `html=1` adds the rendered
+    cards for each column.
+    """
+    project_id = request.args.get('project', type=int)
+    assignee_id = request.args.get('assignee', type=int)
+    limit = request.args.get('limit', BOARD_COLUMN_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, BOARD_COLUMN_MAX_PAGE_SIZE))
+
+    status = request.args.get('status')
+    if status:
+        if status not in BOARD_STATUSES:
+            return jsonify({'success': False, 'error': 'Invalid status'}), 400
+        offset = max(0, request.args.get('offset', 0, type=int))
+        tasks, has_more = load_column(status, project_id, assignee_id, offset=offset, limit=limit)
+        columns = {status: {'tasks': tasks, 'has_more': has_more, 'next_offset': offset + len(tasks)}}
+    else:
+        columns = load_board(project_id, assignee_id, limit=limit)
+        for column in columns.values():
+            column['next_offset'] = len(column['tasks'])
+
+    now = datetime.utcnow()
+    result = {}
+    for column_status, column in columns.items():
+        data = dict(column, tasks=[serialize_task(task) for task in column['tasks']])
+        if request.args.get('html'):
+            data['html'] = ''.join(render_template('_task_card.html', task=task, now=now,
+                                                   board_project_id=project_id)
+                                   for task in column['tasks'])
+        result[column_status] = data
+    return jsonify({'columns': result})
+
+
 @app.route('/update_task_status/<int:task_id>/<status>')
 @login_required
 def update_task_status(task_id, status):
     task = Task.query.get_or_404(task_id)
-    if status in ['todo', 'in_progress', 'done']:
-        old_status = task.status
-        task.status = status
-        task.updated_at = datetime.utcnow()
-        
-        # Log status change
-        from models import TaskActivityLog
-        import json
-        activity = TaskActivityLog(
-            action='status_changed',
-            details=json.dumps({'from': old_status, 'to': status}),
-            task_id=task_id,
-            user_id=session['user_id']
-        )
-        db.session.add(activity)
-        db.session.commit()
-        
+    if status in BOARD_STATUSES:
+        change_task_status(task, status)
         flash('Task status updated', 'success')
-    return redirect(url_for('kanban'))
+    return redirect(url_for('kanban', project=request.args.get('project', type=int)))
 
 
 @app.route('/delete_task/<int:task_id>')
@@ -564,12 +763,134 @@ def delete_task(task_id):
     task = Task.query.get_or_404(task_id)
     # Only allow task creator or admin to delete
     if task.user_id == session['user_id'] or session.get('role') == 'admin':
-        db.session.delete(task)
-        db.session.commit()
+        remove_task(task)
         flash('Task deleted', 'success')
     else:
         flash('You can only delete your own tasks', 'error')
-    return redirect(url_for('kanban'))
+    return redirect(url_for('kanban', project=request.args.get('project', type=int)))
+
+
+def task_state(task):
+    """The fields a board filters on, sent as `previous` in task deltas"""
+    return {'status': task.status, 'assignee_id': task.assigned_to}
+
+
+def broadcast_task_delta(action, task_data, task=None, previous=None):
+    """Send a task change to viewers of its project board and of the all-projects board.
+
+    `previous` is the task's state before the change so clients can adjust
+    column counts; created/updated deltas carry the rendered card.
+    """
+    project_id = task_data['project']['id'] if task_data['project'] else None
+    now = datetime.utcnow()
+    for room, board_project_id in ((f"board_{project_id}", project_id), ('board_all', None)):
+        delta = {'action': action, 'task': task_data, 'previous': previous}
+        if task is not None:
+            delta['html'] = render_template('_task_card.html', task=task, now=now,
+                                            board_project_id=board_project_id)
+        socketio.emit('task_delta', delta, to=room)
+
+
+def create_task(title, description, priority, assigned_to, due_date, project_id):
+    task = Task(title=title,
+                description=description,
+                priority=priority,
+                assigned_to=assigned_to,
+                due_date=due_date,
+                user_id=session['user_id'],
+                project_id=project_id)
+    db.session.add(task)
+    db.session.flush()
+
+    # Log task creation
+    activity = TaskActivityLog(
+        action='task_created',
+        details=json.dumps({'title': title}),
+        task_id=task.id,
+        user_id=session['user_id']
+    )
+    db.session.add(activity)
+    db.session.commit()
+    dashboard_stats.invalidate()
+    broadcast_task_delta('created', serialize_task(task), task=task)
+    return task
+
+
+def change_task_status(task, status):
+    previous = task_state(task)
+    old_status = task.status
+    task.status = status
+    task.updated_at = datetime.utcnow()
+
+    # Log status change
+    activity = TaskActivityLog(
+        action='status_changed',
+        details=json.dumps({'from': old_status, 'to': status}),
+        task_id=task.id,
+        user_id=session['user_id']
+    )
+    db.session.add(activity)
+    db.session.commit()
+    dashboard_stats.invalidate()
+    broadcast_task_delta('updated', serialize_task(task), task=task, previous=previous)
+
+
+def remove_task(task):
+    task_data = serialize_task(task)
+    previous = task_state(task)
+    db.session.delete(task)
+    db.session.commit()
+    dashboard_stats.invalidate()
+    broadcast_task_delta('deleted', task_data, previous=previous)
+
+
+@app.route('/api/tasks', methods=['POST'])
+@login_required
+@limiter.limit("20 per hour")
+def api_create_task():
+    """Create a task from JSON; viewers get it as a task_delta"""
+    data = request.get_json() or {}
+    title = (data.get('title') or '').strip()
+    project_id = data.get('project_id')
+    if not title:
+        return jsonify({'success': False, 'error': 'Task title is required'}), 400
+    if not project_id or not db.session.get(Project, project_id):
+        return jsonify({'success': False, 'error': 'Project is required for each task'}), 400
+
+    due_date = None
+    if data.get('due_date'):
+        try:
+            due_date = datetime.strptime(data['due_date'], '%Y-%m-%d')
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Invalid due date'}), 400
+
+    task = create_task(title, (data.get('description') or '').strip(), data.get('priority') or 'medium',
+                       data.get('assigned_to') or None, due_date, project_id)
+    return jsonify({'success': True, 'task': serialize_task(task)})
+
+
+@app.route('/api/task/<int:task_id>/status', methods=['POST'])
+@login_required
+def api_update_task_status(task_id):
+    """Move a task to another column"""
+    task = Task.query.get_or_404(task_id)
+    status = (request.get_json() or {}).get('status')
+    if status not in BOARD_STATUSES:
+        return jsonify({'success': False, 'error': 'Invalid status'}), 400
+    if status != task.status:
+        change_task_status(task, status)
+    return jsonify({'success': True, 'task': serialize_task(task)})
+
+
+@app.route('/api/task/<int:task_id>', methods=['DELETE'])
+@login_required
+def api_delete_task(task_id):
+    task = Task.query.get_or_404(task_id)
+    # Only allow task creator or admin to delete
+    if task.user_id != session['user_id'] and session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'You can only delete your own tasks'}), 403
+    remove_task(task)
+    return jsonify({'success': True})
 
 
 @app.route('/api/task/<int:task_id>', methods=['GET'])
@@ -671,6 +992,7 @@ def assign_task(task_id):
     data = request.get_json()
     user_id = data.get('user_id')
     
+    previous = task_state(task)
     old_assignee = task.assignee.username if task.assignee else 'Unassigned'
     task.assigned_to = user_id if user_id else None
     task.updated_at = datetime.utcnow()
@@ -687,6 +1009,8 @@ def assign_task(task_id):
     )
     db.session.add(activity)
     db.session.commit()
+    dashboard_stats.invalidate()
+    broadcast_task_delta('updated', serialize_task(task), task=task, previous=previous)
     
     return jsonify({'success': True})
 
@@ -754,10 +1078,23 @@ def delete_user(user_id):
         # If applicable, you can either delete these rooms or reassign them to another admin
         db.session.delete(room)  # or room.created_by = new_admin_id
     # Delete related data
+    message_writer.flush()
+    user_message_ids = db.select(ChatMessage.id).where(ChatMessage.user_id == user_id)
+    release_attachments(user_message_ids)
+    # Bulk deletes skip the ORM cascade, so remove the reactions explicitly
+    MessageReactionCount.query.filter(MessageReactionCount.message_id.in_(user_message_ids)).delete(synchronize_session=False)
+    MessageReaction.query.filter(MessageReaction.message_id.in_(user_message_ids)).delete(synchronize_session=False)
+    # and the user's reactions to other people's messages, with their counts
+    remove_user_reactions(user_id)
     ChatMessage.query.filter_by(user_id=user_id).delete()
     Task.query.filter_by(user_id=user_id).delete()
     db.session.delete(user)
     db.session.commit()
+    if user.profile_pic:
+        remove_avatar_files(user.profile_pic)
+    room_registry.invalidate()
+    identity_cache.invalidate(user_id)
+    dashboard_stats.invalidate()
     flash('User deleted successfully', 'success')
     logging.info(f"Admin {session['username']} (id={session['user_id']}) deleted user: {user.username} (id={user.id})")
     return redirect(url_for('admin'))
@@ -777,6 +1114,7 @@ def change_user_role(user_id):
         return redirect(url_for('admin'))
     user.role = new_role
     db.session.commit()
+    identity_cache.invalidate(user.id)
     flash('User role updated', 'success')
     return redirect(url_for('admin'))
 
@@ -784,10 +1122,7 @@ def change_user_role(user_id):
 # Context processor to make current user available in templates
 @app.context_processor
 def inject_user():
-    if 'user_id' in session:
-        user = User.query.get(session['user_id'])
-        return dict(current_user=user)
-    return dict(current_user=None)
+    return dict(current_user=current_identity(), avatar_url=avatar_url)
 
 
 # WebSocket Events for Real-time Chat
@@ -798,18 +1133,16 @@ def on_connect():
         print("No user_id in session during connect")
         return False
 
-    user = User.query.get(session['user_id'])
+    user = current_identity()
     if user:
-        online_users.add(user.id)
+        start_presence_broadcaster()
+        start_typing_broadcaster()
+        presence.connect(user.id, user.username, request.sid)
         # Join user's personal room for direct messages
         join_room(f"user_{user.id}")
         print(f"User {user.username} connected and joined room user_{user.id}")
-        emit('user_connected', {
-            'username': user.username,
-            'message': f'{user.username} joined the chat'
-        }, broadcast=True)
-        # Broadcast updated online count
-        emit('online_count_updated', {'count': len(online_users)}, broadcast=True)
+        # Others learn about this connection from the next batched presence update
+        emit('online_count_updated', {'count': presence.online_count()})
     else:
         print("User not found during connect")
         return False
@@ -818,17 +1151,74 @@ def on_connect():
 @socketio.on('disconnect')
 def on_disconnect():
     if 'user_id' in session:
-        user = User.query.get(session['user_id'])
+        user = current_identity()
         if user:
-            online_users.discard(user.id)
+            presence.disconnect(user.id, user.username, request.sid)
+            typing_manager.forget_connection(request.sid)
             # Leave user's personal room
             leave_room(f"user_{user.id}")
-            emit('user_disconnected', {
-                'username': user.username,
-                'message': f'{user.username} left the chat'
-            }, broadcast=True)
-            # Broadcast updated online count
-            emit('online_count_updated', {'count': len(online_users)}, broadcast=True)
+
+
+@socketio.on('presence_heartbeat')
+def on_presence_heartbeat():
+    if 'user_id' in session:
+        presence.heartbeat(session['user_id'], request.sid)
+
+
+_presence_broadcaster_started = False
+
+
+def start_presence_broadcaster():
+    global _presence_broadcaster_started
+    if not _presence_broadcaster_started:
+        _presence_broadcaster_started = True
+        socketio.start_background_task(presence_broadcast_loop)
+
+
+def presence_broadcast_loop():
+    """Send one batched presence diff per interval instead of one broadcast per connect"""
+    def lookup_username(user_id):
+        user = identity_cache.get(user_id)
+        return user.username if user else None
+
+    while True:
+        socketio.sleep(PRESENCE_FLUSH_INTERVAL)
+        try:
+            with app.app_context():
+                online, offline = presence.take_changes(lookup_username)
+                if online or offline:
+                    socketio.emit('presence_update', {
+                        'online': online,
+                        'offline': offline,
+                        'count': presence.online_count()
+                    })
+        except Exception:
+            logging.exception("Presence broadcast failed")
+
+
+_typing_broadcaster_started = False
+
+
+def start_typing_broadcaster():
+    global _typing_broadcaster_started
+    if not _typing_broadcaster_started:
+        _typing_broadcaster_started = True
+        socketio.start_background_task(typing_broadcast_loop)
+
+
+def typing_broadcast_loop():
+    """Send one aggregated typist list per changed room per interval"""
+    while True:
+        socketio.sleep(TYPING_FLUSH_INTERVAL)
+        try:
+            for room_id, usernames in typing_manager.take_updates().items():
+                socketio.emit('typing_update', {
+                    'room_id': room_id,
+                    'node': typing_manager.node_id,
+                    'typing': usernames
+                }, room=f"room_{room_id}")
+        except Exception:
+            logging.exception("Typing broadcast failed")
 
 
 @socketio.on('join_room')
@@ -836,36 +1226,31 @@ def on_join_room(data):
     if 'user_id' not in session:
         return
     
-    room_name = data.get('room')
-    if room_name == 'general':
-        # Find general room ID
-        general_room = ChatRoom.query.filter_by(name='General Chat').first()
-        if general_room:
-            room_name = f"room_{general_room.id}"
-        else:
-            # Create general room if it doesn't exist
-            user = User.query.get(session['user_id'])
-            general_room = ChatRoom(
-                name='General Chat',
-                description='Default chat room for all team members',
-                created_by=user.id
-            )
-            db.session.add(general_room)
-            db.session.commit()
-            room_name = f"room_{general_room.id}"
-    elif room_name and room_name.isdigit():
-        room_name = f"room_{room_name}"
-    else:
+    room = room_registry.resolve(data.get('room'), created_by=session['user_id'])
+    if not room:
         return
     
+    room_name = f"room_{room.id}"
     join_room(room_name)
-    user = User.query.get(session['user_id'])
+    user = current_identity()
     emit('user_connected', {
         'username': user.username,
         'message': f'{user.username} joined the room'
     }, room=room_name)
 
 
+@socketio.on('join_board')
+def on_join_board(data):
+    """Subscribe to task deltas for one project board, or all projects"""
+    if 'user_id' not in session:
+        return
+    try:
+        project_id = int(data.get('project') or 0)
+    except (TypeError, ValueError):
+        return
+    join_room(f"board_{project_id}" if project_id else 'board_all')
+
+
 @socketio.on('leave_room')
 def on_leave_room(data):
     if 'user_id' not in session:
@@ -877,17 +1262,12 @@ def on_leave_room(data):
     if room_name is None:
         return
     
-    if room_name == 'general':
-        general_room = ChatRoom.query.filter_by(name='General Chat').first()
-        if general_room:
-            room_name = f"room_{general_room.id}"
-        else:
-            return
-    elif str(room_name).isdigit():
-        room_name = f"room_{room_name}"
-    else:
+    room = room_registry.resolve(room_name)
+    if not room:
         return
+    room_name = f"room_{room.id}"
     
+    typing_manager.stop(room.id, session['user_id'])
     leave_room(room_name)
 
 
@@ -900,14 +1280,19 @@ def handle_message(data):
     content = data.get('message', '').strip()
     room_id = data.get('room')
     recipient_id = data.get('recipient_id')
+    # Upload tokens returned by /upload_file
+    attachment_tokens = data.get('attachments') or []
     
     print(f"Received message: content='{content}', room_id='{room_id}', recipient_id='{recipient_id}'")
     
-    if not content:
+    if not content and not attachment_tokens:
         print("Empty content")
         return
+    if not isinstance(attachment_tokens, list) or len(attachment_tokens) > MAX_ATTACHMENTS_PER_MESSAGE:
+        emit('message_error', {'error': f'At most {MAX_ATTACHMENTS_PER_MESSAGE} attachments per message'})
+        return
 
-    user = User.query.get(session['user_id'])
+    user = current_identity()
     if not user:
         print("User not found")
         return
@@ -930,20 +1315,25 @@ def handle_message(data):
             recipient_id=recipient_id,
             is_direct_message=True
         )
-        db.session.add(message)
-        db.session.commit()
+        if attachment_tokens:
+            try:
+                # Write queued messages before this request's own changes (see MessageWriter.save)
+                message_writer.flush()
+                attach(message, attachment_tokens, user.id)
+            except (ValueError, WriteBehindUnavailable) as e:
+                emit('message_error', {'error': str(e)})
+                return
+        # Attachment rows need the message id, so commit right away
+        try:
+            message = message_writer.save(message, sync=bool(attachment_tokens))
+        except WriteBehindUnavailable as e:
+            db.session.rollback()
+            emit('message_error', {'error': str(e)})
+            return
         
         # Send to both users
-        message_data = {
-            'id': message.id,
-            'content': message.content,
-            'username': user.username,
-            'role': user.role,
-            'status': user.status or 'offline',
-            'timestamp': message.timestamp.isoformat(),
-            'profile_pic': user.profile_pic,
-            'attachments': []
-        }
+        message_data = serialize_message(message, users={user.id: user}, with_attachments=bool(attachment_tokens),
+                                         with_reactions=False)
         
         print(f"Emitting direct message to users {user.id} and {recipient_id}")
         emit('receive_message', message_data, room=f"user_{user.id}")
@@ -958,27 +1348,11 @@ def handle_message(data):
         return
 
     # Handle room messages
-    if room_id == 'general':
-        general_room = ChatRoom.query.filter_by(name='General Chat').first()
-        if general_room:
-            room_id = general_room.id
-        else:
-            # Create general room if it doesn't exist
-            general_room = ChatRoom(
-                name='General Chat',
-                description='Default chat room for all team members',
-                created_by=user.id
-            )
-            db.session.add(general_room)
-            db.session.commit()
-            room_id = general_room.id
-    
-    # Convert room_id to int if it's a string
-    try:
-        room_id = int(room_id)
-    except (ValueError, TypeError):
+    room = room_registry.resolve(room_id, created_by=user.id)
+    if not room:
         print(f"Invalid room_id: {room_id}")
         return
+    room_id = room.id
     
     message = ChatMessage(
         content=content, 
@@ -986,21 +1360,26 @@ def handle_message(data):
         room_id=room_id,
         is_direct_message=False
     )
-    db.session.add(message)
-    db.session.commit()
+    if attachment_tokens:
+        try:
+            # Write queued messages before this request's own changes (see MessageWriter.save)
+            message_writer.flush()
+            attach(message, attachment_tokens, user.id)
+        except (ValueError, WriteBehindUnavailable) as e:
+            emit('message_error', {'error': str(e)})
+            return
+    try:
+        message = message_writer.save(message, sync=bool(attachment_tokens))
+    except WriteBehindUnavailable as e:
+        db.session.rollback()
+        emit('message_error', {'error': str(e)})
+        return
+    typing_manager.stop(room_id, user.id)
 
     # Broadcast message to room
     room_name = f"room_{room_id}"
-    message_data = {
-        'id': message.id,
-        'content': message.content,
-        'username': user.username,
-        'role': user.role,
-        'status': user.status or 'offline',
-        'timestamp': message.timestamp.isoformat(),
-        'profile_pic': user.profile_pic,
-        'attachments': []
-    }
+    message_data = serialize_message(message, users={user.id: user}, with_attachments=bool(attachment_tokens),
+                                     with_reactions=False)
     
     print(f"Emitting room message to room {room_name}")
     emit('receive_message', message_data, room=room_name)
@@ -1019,27 +1398,19 @@ def handle_start_typing(data):
     if 'user_id' not in session:
         return
     
-    user = User.query.get(session['user_id'])
+    user = current_identity()
     room_name = data.get('room')
     
     # Skip typing indicators for direct messages (room_name is None)
-    if room_name is None:
+    if user is None or room_name is None:
         return
     
-    if room_name == 'general':
-        general_room = ChatRoom.query.filter_by(name='General Chat').first()
-        if general_room:
-            room_name = f"room_{general_room.id}"
-        else:
-            return
-    elif str(room_name).isdigit():
-        room_name = f"room_{room_name}"
-    else:
+    room = room_registry.resolve(room_name)
+    if not room:
         return
     
-    emit('user_typing', {
-        'username': user.username
-    }, room=room_name, include_self=False)
+    # Broadcast by typing_broadcast_loop, coalesced per room
+    typing_manager.start(room.id, user.id, user.username, request.sid)
 
 
 @socketio.on('stop_typing')
@@ -1053,18 +1424,11 @@ def handle_stop_typing(data):
     if room_name is None:
         return
     
-    if room_name == 'general':
-        general_room = ChatRoom.query.filter_by(name='General Chat').first()
-        if general_room:
-            room_name = f"room_{general_room.id}"
-        else:
-            return
-    elif str(room_name).isdigit():
-        room_name = f"room_{room_name}"
-    else:
+    room = room_registry.resolve(room_name)
+    if not room:
         return
     
-    emit('user_stopped_typing', {}, room=room_name, include_self=False)
+    typing_manager.stop(room.id, session['user_id'])
 
 
 @app.route('/healthz')
@@ -1072,6 +1436,19 @@ def health_check():
     return 'OK', 200
 
 
+@app.route('/metrics')
+@limiter.exempt
+def prometheus_metrics():
+    """Prometheus scrape endpoint for direct connections from this host, or admins"""
+    # Requests through nginx also come from 127.0.0.1 but carry X-Forwarded-For
+    direct_local = request.remote_addr in ('127.0.0.1', '::1') and 'X-Forwarded-For' not in request.headers
+    if not direct_local:
+        user = current_identity() if 'user_id' in session else None
+        if not user or user.role != 'admin':
+            abort(403)
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @limiter.request_filter
 def ip_whitelist():
     # Allow health checks from localhost without rate limiting
@@ -1083,6 +1460,16 @@ def ratelimit_handler(e):
     return Response('Rate limit exceeded. Please try again later.', status=429)
 
 
+@app.errorhandler(UploadError)
+def upload_error(error):
+    return jsonify({'success': False, 'error': str(error)}), error.status
+
+
+@app.errorhandler(WriteBehindUnavailable)
+def write_behind_unavailable(error):
+    return jsonify({'success': False, 'error': str(error)}), error.status
+
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('404.html'), 404
@@ -1102,7 +1489,8 @@ def get_users():
             'id': u.id,
             'username': u.username,
             'status': u.status or 'offline',
-            'profile_pic': u.profile_pic
+            'profile_pic': u.profile_pic,
+            'avatar_url': avatar_url(u.profile_pic)
         } for u in users
     ])
 
@@ -1116,11 +1504,10 @@ def handle_add_reaction(data):
     user_id = session['user_id']
     message_id = data.get('message_id')
     emoji = data.get('emoji')
-    ALLOWED_EMOJIS = {'👍', '😂', '😢', '❤️', '🎉'}
     if not message_id or emoji not in ALLOWED_EMOJIS:
         print(f"Invalid data: message_id={message_id}, emoji={emoji}")
         return
-    message = ChatMessage.query.get(message_id)
+    message = message_writer.get(message_id)
     if not message:
         print(f"Message not found: {message_id}")
         return
@@ -1129,17 +1516,18 @@ def handle_add_reaction(data):
     if not room_id:
         print("Message has no room_id")
         return
-    # Add or update reaction
-    existing = MessageReaction.query.filter_by(message_id=message_id, user_id=user_id, emoji=emoji).first()
-    if not existing:
-        reaction = MessageReaction(message_id=message_id, user_id=user_id, emoji=emoji)
-        db.session.add(reaction)
-        db.session.commit()
-        print(f"Added reaction: user={user_id}, message={message_id}, emoji={emoji}")
-    else:
+    # The reaction row references the message, so it must be stored first
+    try:
+        message_writer.flush()
+    except WriteBehindUnavailable as e:
+        emit('message_error', {'error': str(e)})
+        return
+    count = add_reaction(message.id, user_id, emoji)
+    if count is None:
         print(f"Reaction already exists: user={user_id}, message={message_id}, emoji={emoji}")
-    # Broadcast updated reactions
-    broadcast_reactions_update(message_id, room_id)
+        return
+    print(f"Added reaction: user={user_id}, message={message_id}, emoji={emoji}")
+    broadcast_reaction_delta(message.id, room_id, user_id, emoji, 1, count)
 
 
 @socketio.on('remove_reaction')
@@ -1151,35 +1539,29 @@ def handle_remove_reaction(data):
     user_id = session['user_id']
     message_id = data.get('message_id')
     emoji = data.get('emoji')
-    ALLOWED_EMOJIS = {'👍', '😂', '😢', '❤️', '🎉'}
     if not message_id or emoji not in ALLOWED_EMOJIS:
         print(f"Invalid data: message_id={message_id}, emoji={emoji}")
         return
-    from models import MessageReaction
-    reaction = MessageReaction.query.filter_by(message_id=message_id, user_id=user_id, emoji=emoji).first()
-    if reaction:
-        db.session.delete(reaction)
-        db.session.commit()
-        print(f"Removed reaction: user={user_id}, message={message_id}, emoji={emoji}")
-    else:
+    message = message_writer.get(message_id)
+    if not message or not message.room_id:
+        print(f"Message not found: {message_id}")
+        return
+    count = remove_reaction(message.id, user_id, emoji)
+    if count is None:
         print(f"Reaction not found: user={user_id}, message={message_id}, emoji={emoji}")
-    # Find the message to get the room
-    message = ChatMessage.query.get(message_id)
-    if message and message.room_id:
-        broadcast_reactions_update(message_id, message.room_id)
-
-
-def broadcast_reactions_update(message_id, room_id):
-    from models import MessageReaction
-    # Get all reactions for this message
-    reactions = MessageReaction.query.filter_by(message_id=message_id).all()
-    # Format: {emoji: [user_id, ...]}
-    reaction_counts = {}
-    for r in reactions:
-        reaction_counts.setdefault(r.emoji, []).append(r.user_id)
-    emit('reactions_update', {
+        return
+    print(f"Removed reaction: user={user_id}, message={message_id}, emoji={emoji}")
+    broadcast_reaction_delta(message.id, message.room_id, user_id, emoji, -1, count)
+
+
+def broadcast_reaction_delta(message_id, room_id, user_id, emoji, delta, count):
+    """Send one +1/-1 change; `count` is the new total so clients stay in sync"""
+    emit('reaction_delta', {
         'message_id': message_id,
-        'reactions': {emoji: {'count': len(users), 'user_ids': users} for emoji, users in reaction_counts.items()}
+        'emoji': emoji,
+        'user_id': user_id,
+        'delta': delta,
+        'count': count
     }, room=f"room_{room_id}")
 
 
@@ -1200,13 +1582,13 @@ def handle_reply_message(data):
         print("Empty content or missing parent_id")
         return
 
-    user = User.query.get(session['user_id'])
+    user = current_identity()
     if not user:
         print("User not found")
         return
 
     # Verify parent message exists
-    parent_message = ChatMessage.query.get(parent_id)
+    parent_message = message_writer.get(parent_id)
     if not parent_message:
         print(f"Parent message not found: {parent_id}")
         return
@@ -1220,23 +1602,12 @@ def handle_reply_message(data):
             is_direct_message=True,
             parent_id=parent_id
         )
-        db.session.add(message)
-        db.session.commit()
+        message = message_writer.save(message)
         
         # Send to both users
-        message_data = {
-            'id': message.id,
-            'content': message.content,
-            'username': user.username,
-            'role': user.role,
-            'status': user.status or 'offline',
-            'timestamp': message.timestamp.isoformat(),
-            'profile_pic': user.profile_pic,
-            'attachments': [],
-            'parent_id': parent_id,
-            'parent_username': parent_message.author.username,
-            'parent_content': parent_message.content[:50] + ('...' if len(parent_message.content) > 50 else '')
-        }
+        message_data = serialize_message(message, users={user.id: user},
+                                         parents={parent_message.id: parent_message}, with_attachments=False,
+                                         with_reactions=False)
         
         print(f"Emitting direct reply to users {user.id} and {recipient_id}")
         emit('receive_message', message_data, room=f"user_{user.id}")
@@ -1244,27 +1615,11 @@ def handle_reply_message(data):
         return
 
     # Handle room message replies
-    if room_id == 'general':
-        general_room = ChatRoom.query.filter_by(name='General Chat').first()
-        if general_room:
-            room_id = general_room.id
-        else:
-            # Create general room if it doesn't exist
-            general_room = ChatRoom(
-                name='General Chat',
-                description='Default chat room for all team members',
-                created_by=user.id
-            )
-            db.session.add(general_room)
-            db.session.commit()
-            room_id = general_room.id
-    
-    # Convert room_id to int if it's a string
-    try:
-        room_id = int(room_id)
-    except (ValueError, TypeError):
+    room = room_registry.resolve(room_id, created_by=user.id)
+    if not room:
         print(f"Invalid room_id: {room_id}")
         return
+    room_id = room.id
     
     message = ChatMessage(
         content=content, 
@@ -1273,24 +1628,13 @@ def handle_reply_message(data):
         is_direct_message=False,
         parent_id=parent_id
     )
-    db.session.add(message)
-    db.session.commit()
+    message = message_writer.save(message)
 
     # Broadcast reply to room
     room_name = f"room_{room_id}"
-    message_data = {
-        'id': message.id,
-        'content': message.content,
-        'username': user.username,
-        'role': user.role,
-        'status': user.status or 'offline',
-        'timestamp': message.timestamp.isoformat(),
-        'profile_pic': user.profile_pic,
-        'attachments': [],
-        'parent_id': parent_id,
-        'parent_username': parent_message.author.username,
-        'parent_content': parent_message.content[:50] + ('...' if len(parent_message.content) > 50 else '')
-    }
+    message_data = serialize_message(message, users={user.id: user},
+                                     parents={parent_message.id: parent_message}, with_attachments=False,
+                                     with_reactions=False)
     
     print(f"Emitting room reply to room {room_name}")
     emit('receive_message', message_data, room=room_name)
@@ -1320,26 +1664,13 @@ def profile():
         if 'profile_pic' in request.files:
             file = request.files['profile_pic']
             if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                ext = filename.rsplit('.', 1)[1].lower()
-                if ext not in ALLOWED_EXTENSIONS:
-                    flash('Invalid file type. Only PNG and JPG allowed.', 'danger')
-                elif file.content_length and file.content_length > MAX_PROFILE_PIC_SIZE:
-                    flash('File too large (max 1MB).', 'danger')
-                else:
-                    # Save as user_<id>.ext
-                    filename = f'user_{user.id}.{ext}'
-                    filepath = os.path.join(PROFILE_PIC_FOLDER, filename)
-                    # Ensure folder exists
-                    os.makedirs(PROFILE_PIC_FOLDER, exist_ok=True)
-                    # Resize/crop to 256x256
-                    img = Image.open(file)
-                    img = img.convert('RGB')
-                    img = crop_center_resize(img, PROFILE_PIC_DIM, PROFILE_PIC_DIM)
-                    img.save(filepath, quality=90)
-                    user.profile_pic = filename
-                    db.session.commit()
-                    flash('Profile picture updated!', 'success')
+                # Resizing happens in the media workers; the new picture
+                # replaces the old one once its variants are rendered
+                try:
+                    save_avatar_upload(user.id, file.stream)
+                    flash('Profile picture uploaded! It will appear in a moment.', 'success')
+                except ValueError as e:
+                    flash(str(e), 'danger')
             elif file:
                 flash('Invalid file selected.', 'danger')
     return render_template('profile.html', user=user)
@@ -1347,19 +1678,25 @@ def profile():
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def crop_center_resize(img, width, height):
-    # Crop to square, then resize
-    min_dim = min(img.size)
-    left = (img.width - min_dim) // 2
-    top = (img.height - min_dim) // 2
-    right = left + min_dim
-    bottom = top + min_dim
-    img = img.crop((left, top, right, bottom))
-    return img.resize((width, height), Image.LANCZOS)
-
 @app.route('/static/profile_pics/<filename>')
 def profile_pic(filename):
-    return send_from_directory(PROFILE_PIC_FOLDER, filename)
+    return serve_file('profile_pics', os.path.join(app.root_path, AVATAR_FOLDER), filename)
+
+@app.route('/avatars/<name>')
+def avatar(name):
+    """Avatar variant ``user_<id>_<version>_<size>``, WebP when the browser accepts it"""
+    variant = parse_variant(name)
+    if variant is None:
+        abort(404)
+    extension = 'webp' if request.accept_mimetypes['image/webp'] else 'jpg'
+    filename = variant_filename(*variant, extension)
+    # The version in the name changes with the picture, so clients never need to revalidate
+    response = serve_file('profile_pics', os.path.join(app.root_path, AVATAR_FOLDER), filename,
+                          mimetype=AVATAR_FORMATS[extension], max_age=AVATAR_CACHE_MAX_AGE, etag=filename)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.vary.add('Accept')
+    return response
 
 @app.route('/api/set_status', methods=['POST'])
 @login_required
@@ -1367,15 +1704,16 @@ def set_status():
     status = request.json.get('status')
     if status not in ['online', 'away', 'dnd', 'offline']:
         return jsonify({'success': False, 'error': 'Invalid status'}), 400
-    user = User.query.get(session['user_id'])
-    user.status = status
+    user = current_identity()
+    User.query.filter_by(id=user.id).update({'status': status})
     db.session.commit()
+    identity_cache.invalidate(user.id)
     # Broadcast to all users
     socketio.emit('user_status_update', {
         'user_id': user.id,
         'username': user.username,
         'status': status
-    }, broadcast=True)
+    })
     return jsonify({'success': True, 'status': status})
 
 @socketio.on('set_status')
@@ -1385,9 +1723,12 @@ def handle_set_status(data):
     status = data.get('status')
     if status not in ['online', 'away', 'dnd', 'offline']:
         return
-    user = User.query.get(session['user_id'])
-    user.status = status
+    user = current_identity()
+    if not user:
+        return
+    User.query.filter_by(id=user.id).update({'status': status})
     db.session.commit()
+    identity_cache.invalidate(user.id)
     # Broadcast to all users
     emit('user_status_update', {
         'user_id': user.id,
@@ -1398,7 +1739,7 @@ def handle_set_status(data):
 @app.route('/api/online_users')
 @login_required
 def get_online_users():
-    users = User.query.filter(User.id.in_(online_users)).all()
+    users = User.query.filter(User.id.in_(presence.online_user_ids())).all()
     usernames = [u.username for u in users]
     return jsonify({'usernames': usernames})
 
@@ -1450,6 +1791,7 @@ def delete_project(project_id):
     project = Project.query.get_or_404(project_id)
     db.session.delete(project)
     db.session.commit()
+    dashboard_stats.invalidate()
     return jsonify({'success': True})
 
 @app.route('/api/projects/<int:project_id>', methods=['GET'])
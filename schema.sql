@@ -39,6 +39,9 @@ CREATE TABLE task (
     FOREIGN KEY(assigned_to) REFERENCES user(id),
     FOREIGN KEY(project_id) REFERENCES project(id)
 );
+CREATE INDEX ix_task_project_status ON task (project_id, status);
+CREATE INDEX ix_task_assigned_to_status ON task (assigned_to, status);
+CREATE INDEX ix_task_status ON task (status);
 
 -- ChatRoom table
 CREATE TABLE chat_room (
@@ -66,6 +69,8 @@ CREATE TABLE chat_message (
     FOREIGN KEY(recipient_id) REFERENCES user(id),
     FOREIGN KEY(parent_id) REFERENCES chat_message(id)
 );
+CREATE INDEX ix_chat_message_room_timestamp_id ON chat_message (room_id, timestamp, id);
+CREATE INDEX ix_chat_message_dm ON chat_message (user_id, recipient_id, timestamp);
 
 -- MessageAttachment table
 CREATE TABLE message_attachment (
@@ -76,7 +81,47 @@ CREATE TABLE message_attachment (
     file_size INTEGER NOT NULL,
     file_type TEXT NOT NULL,
     uploaded_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY(message_id) REFERENCES chat_message(id)
+    blob_sha256 TEXT,
+    FOREIGN KEY(message_id) REFERENCES chat_message(id),
+    FOREIGN KEY(blob_sha256) REFERENCES attachment_blob(sha256)
+);
+CREATE INDEX ix_message_attachment_blob_sha256 ON message_attachment (blob_sha256);
+CREATE INDEX ix_message_attachment_message_id ON message_attachment (message_id);
+
+-- AttachmentPreview table (thumbnails of image and PDF blobs)
+CREATE TABLE attachment_preview (
+    blob_sha256 TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'pending',
+    width INTEGER,
+    height INTEGER,
+    thumb_width INTEGER,
+    thumb_height INTEGER,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(blob_sha256) REFERENCES attachment_blob(sha256)
+);
+
+-- UploadSession table (resumable uploads in progress)
+CREATE TABLE upload_session (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    total_size INTEGER NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    sha256 TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    expires_at DATETIME NOT NULL,
+    FOREIGN KEY(user_id) REFERENCES user(id)
+);
+CREATE INDEX ix_upload_session_expires_at ON upload_session (expires_at);
+
+-- AttachmentBlob table (content-addressed upload storage)
+CREATE TABLE attachment_blob (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    ref_count INTEGER NOT NULL DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    touched_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
 -- TaskComment table
@@ -89,6 +134,7 @@ CREATE TABLE task_comment (
     FOREIGN KEY(task_id) REFERENCES task(id),
     FOREIGN KEY(user_id) REFERENCES user(id)
 );
+CREATE INDEX ix_task_comment_task_id ON task_comment (task_id, created_at);
 
 -- TaskActivityLog table
 CREATE TABLE task_activity_log (
@@ -101,6 +147,7 @@ CREATE TABLE task_activity_log (
     FOREIGN KEY(task_id) REFERENCES task(id),
     FOREIGN KEY(user_id) REFERENCES user(id)
 );
+CREATE INDEX ix_task_activity_log_task_id ON task_activity_log (task_id, created_at);
 
 -- MessageReaction table
 CREATE TABLE message_reaction (
@@ -114,5 +161,13 @@ CREATE TABLE message_reaction (
     UNIQUE(message_id, user_id, emoji)
 );
 
+CREATE TABLE message_reaction_count (
+    message_id INTEGER NOT NULL,
+    emoji TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (message_id, emoji),
+    FOREIGN KEY(message_id) REFERENCES chat_message(id)
+);
+
 -- Insert a default admin user (password must be set manually)
 INSERT INTO user (username, email, password_hash, is_admin) VALUES ('admin', 'admin@example.com', 'scrypt:32768:8:1$VOfpb9n6NzTO9zTg$65091b0a1558a65f18a25e332a783b7a4e52eef7e1ed861203e95346e4ab16e0e09744c5fd4d271e3345a35969fcb0044fd08b559e1a83d3f3855090965f9c15', 1);
\ No newline at end of file
@@ -0,0 +1,190 @@
+"""Full-text search over room messages.
+
+SQLite uses an FTS5 external-content table kept up to date by triggers on
+chat_message, so sends (including write-behind batches), edits and deletes
+update the index incrementally. PostgreSQL uses a GIN index on the message
+tsvector. Other databases, or SQLite builds without FTS5, fall back to a
+LIKE scan.
+
+Direct messages are encrypted client-side and are never indexed.
+"""
+from html import escape
+import logging
+import re
+
+from sqlalchemy import Float, cast, func, literal, literal_column, table, column, text
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from models import ChatMessage
+
+# Markers around matched terms in snippets, replaced by <mark> after escaping
+MATCH_START = '\ue000'
+MATCH_END = '\ue001'
+SNIPPET_TOKENS = 16
+SNIPPET_CHARS = 120
+TS_CONFIG = 'english'
+
+FTS_TABLE = 'chat_message_fts'
+FTS_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        content, content='chat_message', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2')""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_message_fts_ai AFTER INSERT ON chat_message
+        WHEN new.is_direct_message = 0 BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_message_fts_ad AFTER DELETE ON chat_message
+        WHEN old.is_direct_message = 0 BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_message_fts_au AFTER UPDATE OF content ON chat_message
+        WHEN old.is_direct_message = 0 BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END""",
+    # Index the existing history once, when the table is created
+    f"""INSERT INTO {FTS_TABLE}(rowid, content)
+        SELECT id, content FROM chat_message WHERE is_direct_message = 0""",
+]
+PG_SCHEMA = [
+    f"""CREATE INDEX IF NOT EXISTS ix_chat_message_content_fts ON chat_message
+        USING gin (to_tsvector('{TS_CONFIG}', content)) WHERE is_direct_message = false""",
+]
+
+fts = table(FTS_TABLE, column('rowid'), column('content'))
+
+# 'fts5', 'postgresql' or 'like', set by ensure_search_index()
+search_backend = 'like'
+
+
+def ensure_search_index():
+    """Create the full-text index if missing and pick the search backend"""
+    global search_backend
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        with db.engine.begin() as conn:
+            for statement in PG_SCHEMA:
+                conn.execute(text(statement))
+        search_backend = 'postgresql'
+    elif dialect == 'sqlite':
+        conn = db.engine.raw_connection()
+        try:
+            # IMMEDIATE so concurrently starting workers create and backfill the index once
+            conn.execute("BEGIN IMMEDIATE")
+            exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_TABLE,)).fetchone()
+            if not exists:
+                for statement in FTS_SCHEMA:
+                    conn.execute(statement)
+                logging.info("Created full-text search index for chat messages")
+            conn.commit()
+            search_backend = 'fts5'
+        except Exception as e:
+            conn.rollback()
+            logging.warning(f"SQLite FTS5 unavailable, message search falls back to LIKE: {e}")
+        finally:
+            conn.close()
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query)
+
+
+def _fts5_query(terms):
+    # Quote every term so user input cannot inject FTS5 syntax; prefix-match the last one
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def highlight(snippet):
+    """HTML-escape a snippet and turn the match markers into <mark> tags"""
+    return escape(snippet).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+
+def _like_snippet(content, terms):
+    lowered = content.lower()
+    positions = [lowered.find(term.lower()) for term in terms]
+    first = min((pos for pos in positions if pos >= 0), default=0)
+    start = max(0, first - SNIPPET_CHARS // 3)
+    snippet = content[start:start + SNIPPET_CHARS]
+    for term in terms:
+        snippet = re.sub(f'({re.escape(term)})', f'{MATCH_START}\\1{MATCH_END}', snippet, flags=re.IGNORECASE)
+    return ('…' if start else '') + snippet + ('…' if start + SNIPPET_CHARS < len(content) else '')
+
+
+def parse_cursor(cursor):
+    """Split a "score:id" cursor; None if it is malformed"""
+    try:
+        score, message_id = cursor.rsplit(':', 1)
+        return float(score), int(message_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def search_messages(viewer_id, query, room_id=None, author_id=None, start=None, end=None,
+                    cursor=None, limit=20):
+    """Ranked search over room messages visible to viewer_id.
+
+    Results are ordered by descending score, then id, and paged with a
+    "score:id" keyset cursor. Returns ``(results, next_cursor, has_more)``
+    where results are ``(message, score, snippet_html)`` tuples. Scores are
+    relative to the current index, so a cursor may shift slightly if many
+    messages arrive between pages.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return [], None, False
+
+    if search_backend == 'fts5':
+        score = -func.bm25(literal_column(FTS_TABLE))
+        snippet = func.snippet(literal_column(FTS_TABLE), 0, MATCH_START, MATCH_END, '…', SNIPPET_TOKENS)
+        q = db.session.query(ChatMessage, score.label('score'), snippet.label('snippet')).join(
+            fts, fts.c.rowid == ChatMessage.id
+        ).filter(literal_column(FTS_TABLE).op('MATCH')(_fts5_query(terms)))
+    elif search_backend == 'postgresql':
+        vector = func.to_tsvector(TS_CONFIG, ChatMessage.content)
+        ts_query = func.plainto_tsquery(TS_CONFIG, ' '.join(terms))
+        score = cast(func.ts_rank(vector, ts_query), Float)
+        snippet = func.ts_headline(
+            TS_CONFIG, ChatMessage.content, ts_query,
+            f'StartSel={MATCH_START}, StopSel={MATCH_END}, MaxWords={SNIPPET_TOKENS}, MinWords=5')
+        q = db.session.query(ChatMessage, score.label('score'), snippet.label('snippet')).filter(
+            vector.op('@@')(ts_query))
+    else:
+        score = literal(0.0, Float)
+        q = db.session.query(ChatMessage, score.label('score'), ChatMessage.content.label('snippet'))
+        for term in terms:
+            q = q.filter(ChatMessage.content.ilike(f"%{term.replace('_', '!_')}%", escape='!'))
+
+    q = q.filter(ChatMessage.is_direct_message == False, ChatMessage.visible_to(viewer_id))
+    if room_id is not None:
+        q = q.filter(ChatMessage.room_id == room_id)
+    if author_id is not None:
+        q = q.filter(ChatMessage.user_id == author_id)
+    if start is not None:
+        q = q.filter(ChatMessage.timestamp >= start)
+    if end is not None:
+        q = q.filter(ChatMessage.timestamp < end)
+    if cursor is not None:
+        cursor_score, cursor_id = cursor
+        q = q.filter(db.or_(score < cursor_score,
+                            db.and_(score == cursor_score, ChatMessage.id < cursor_id)))
+
+    try:
+        rows = q.order_by(score.desc(), ChatMessage.id.desc()).limit(limit + 1).all()
+    except OperationalError:
+        # Malformed queries can still trip the FTS parser on unusual input
+        db.session.rollback()
+        logging.exception("Message search failed")
+        return [], None, False
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    results = []
+    for message, row_score, row_snippet in rows:
+        if search_backend == 'like':
+            row_snippet = _like_snippet(row_snippet, terms)
+        results.append((message, row_score, highlight(row_snippet)))
+    next_cursor = f'{rows[-1].score!r}:{rows[-1][0].id}' if rows and has_more else None
+    return results, next_cursor, has_more
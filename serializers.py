@@ -0,0 +1,103 @@
+"""JSON serialization of chat messages shared by the HTTP API and socket events."""
+from app import db
+from models import User, ChatMessage, MessageAttachment, AttachmentPreview
+from media import serialize_preview
+from avatars import avatar_url
+from reactions import reaction_summaries
+
+PARENT_PREVIEW_LENGTH = 50
+
+
+def parent_preview(content):
+    """Shorten a parent message for the reply preview"""
+    if len(content) > PARENT_PREVIEW_LENGTH:
+        return content[:PARENT_PREVIEW_LENGTH] + '...'
+    return content
+
+
+def serialize_messages(messages, users=None, parents=None, with_attachments=True,
+                       with_reactions=True, viewer_id=None):
+    """Serialize a page of messages in a fixed number of queries.
+
+    Authors, reply parents, attachments and reactions are each fetched with IN
+    queries for the whole page instead of per-message relationship loads.
+    Callers that already hold some of these rows (the sender in a socket
+    handler, the parent of a reply) can pass them in as ``users`` /
+    ``parents`` dicts keyed by id, and ``with_attachments=False`` /
+    ``with_reactions=False`` skip the lookups for freshly sent messages that
+    cannot have any. ``viewer_id`` marks the reactions that user made (``me``).
+    """
+    if not messages:
+        return []
+    users = dict(users or {})
+    parents = dict(parents or {})
+
+    parent_ids = {msg.parent_id for msg in messages if msg.parent_id} - parents.keys()
+    if parent_ids:
+        rows = db.session.query(ChatMessage.id, ChatMessage.user_id, ChatMessage.content).filter(
+            ChatMessage.id.in_(parent_ids))
+        for row in rows:
+            parents[row.id] = row
+
+    user_ids = {msg.user_id for msg in messages}
+    user_ids.update(parents[msg.parent_id].user_id for msg in messages if msg.parent_id in parents)
+    missing_user_ids = user_ids - users.keys()
+    if missing_user_ids:
+        rows = db.session.query(User.id, User.username, User.role, User.status, User.profile_pic).filter(
+            User.id.in_(missing_user_ids))
+        for row in rows:
+            users[row.id] = row
+
+    attachments = {}
+    if with_attachments:
+        rows = db.session.query(
+            MessageAttachment.id, MessageAttachment.message_id,
+            MessageAttachment.original_filename, MessageAttachment.file_size,
+            AttachmentPreview.status, AttachmentPreview.width, AttachmentPreview.height,
+            AttachmentPreview.thumb_width, AttachmentPreview.thumb_height
+        ).outerjoin(AttachmentPreview, AttachmentPreview.blob_sha256 == MessageAttachment.blob_sha256).filter(
+            MessageAttachment.message_id.in_([msg.id for msg in messages])).order_by(MessageAttachment.id)
+        for att in rows:
+            attachments.setdefault(att.message_id, []).append({
+                'id': att.id,
+                'original_filename': att.original_filename,
+                'file_size': att.file_size,
+                'preview': serialize_preview(att)
+            })
+
+    reactions = {}
+    if with_reactions:
+        reactions = reaction_summaries([msg.id for msg in messages], viewer_id)
+
+    result = []
+    for msg in messages:
+        author = users.get(msg.user_id)
+        parent = parents.get(msg.parent_id) if msg.parent_id else None
+        parent_author = users.get(parent.user_id) if parent else None
+        data = {
+            'id': msg.id,
+            'content': msg.content,
+            'username': author.username if author else None,
+            'role': author.role if author else None,
+            'status': (author.status if author else None) or 'offline',
+            'timestamp': msg.timestamp.isoformat(),
+            'parent_id': msg.parent_id,
+            'parent_username': parent_author.username if parent_author else None,
+            'parent_content': parent_preview(parent.content) if parent else None,
+            'profile_pic': author.profile_pic if author else None,
+            'avatar_url': avatar_url(author.profile_pic if author else None),
+            'attachments': attachments.get(msg.id, []),
+            'reactions': reactions.get(msg.id, {}),
+            'room_id': msg.room_id
+        }
+        if msg.is_direct_message:
+            data['is_direct_message'] = True  # Content is encrypted client-side
+            data['user_id'] = msg.user_id
+            data['recipient_id'] = msg.recipient_id
+        result.append(data)
+    return result
+
+
+def serialize_message(message, **kwargs):
+    """Serialize a single message (see serialize_messages)"""
+    return serialize_messages([message], **kwargs)[0]
@@ -0,0 +1,134 @@
+"""Per-request SQL profiling: statement counts, N+1 detection and a slow-query log.
+
+Every statement run while handling an HTTP request or a Socket.IO event is
+counted, timed and grouped by shape (the SQL with literals and IN lists
+collapsed). When one shape runs N_PLUS_ONE_THRESHOLD or more times in the
+same request, the route and statement are written to the slow-query log
+(once per route and shape per process). In strict mode
+(SQL_PROFILER_STRICT=1, for tests and staging) an N+1 raises NPlusOneError
+instead, so the regression fails loudly.
+
+Statements slower than SLOW_QUERY_MS are logged with the route or event that
+ran them, including those from background tasks and CLI commands. Outside
+production every response carries a ``Server-Timing: db`` header with the
+query count and time, which browser dev tools show next to the request.
+
+Statements are timed by the listener in metrics.py; this module only adds
+shapes and the slow-query check on top of its per-request count and time.
+"""
+from collections import Counter
+from functools import lru_cache
+import logging
+from logging.handlers import RotatingFileHandler
+import os
+import re
+
+from flask import has_request_context, request
+
+from app import app
+from metrics import request_query_stats, statement_listeners
+
+# Statements slower than this are written to the slow-query log
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', 'slow_queries.log')
+# Runs of one statement shape within a request that count as an N+1
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5))
+# Raise NPlusOneError instead of logging (tests and staging)
+SQL_PROFILER_STRICT = os.environ.get('SQL_PROFILER_STRICT', '0') == '1'
+# Add Server-Timing headers (on by default outside production)
+SQL_PROFILER_SERVER_TIMING = os.environ.get(
+    'SQL_PROFILER_SERVER_TIMING', '0' if os.environ.get('FLASK_ENV') == 'production' else '1') == '1'
+# Longest statement text written to the log
+MAX_LOGGED_STATEMENT = 2000
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PARAMETER_LISTS = re.compile(r'\(\s*(?:\?|%\(\w+\)s|%s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|%s|:\w+))+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+slow_query_log = logging.getLogger('wispr.slow_queries')
+slow_query_log.propagate = False
+_handler = RotatingFileHandler(SLOW_QUERY_LOG, maxBytes=5 * 1024 * 1024, backupCount=5, delay=True)
+_handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s %(message)s'))
+slow_query_log.addHandler(_handler)
+slow_query_log.setLevel(logging.INFO)
+
+# (route, shape) pairs already reported, so a hot route logs its N+1 once
+_reported = set()
+
+
+class NPlusOneError(RuntimeError):
+    """A request ran one statement shape N_PLUS_ONE_THRESHOLD or more times (strict mode)"""
+
+
+@lru_cache(maxsize=2048)
+def statement_shape(statement):
+    """The statement with literals and parameter lists collapsed"""
+    shape = _LITERALS.sub('?', statement)
+    shape = _PARAMETER_LISTS.sub('(?)', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+def _route():
+    """Endpoint or Socket.IO event name of the current request"""
+    socket_event = getattr(request, 'event', None)
+    if socket_event:
+        return f"socketio {socket_event['message']}"
+    return request.url_rule.endpoint if request.url_rule else 'unmatched'
+
+
+def _origin():
+    """Where the current statement comes from, for the log"""
+    if not has_request_context():
+        return 'background'
+    if getattr(request, 'event', None):
+        return _route()
+    return f"{request.method} {request.path} ({_route()})"
+
+
+def _trim(statement):
+    """One-line statement text for the log"""
+    statement = _WHITESPACE.sub(' ', statement).strip()
+    return statement if len(statement) <= MAX_LOGGED_STATEMENT else statement[:MAX_LOGGED_STATEMENT] + '...'
+
+
+def record_statement(statement, elapsed):
+    """Count a statement's shape for the current request and log it if slow"""
+    if has_request_context():
+        request_query_stats().setdefault('shapes', Counter())[statement_shape(statement)] += 1
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_query_log.warning(f"slow query {elapsed * 1000:.1f} ms in {_origin()}: {_trim(statement)}")
+
+
+statement_listeners.append(record_statement)
+
+
+def repeated_statements(profile):
+    """[(shape, runs)] of the statements in a request's stats that look like an N+1"""
+    return [(shape, runs) for shape, runs in profile.get('shapes', Counter()).most_common()
+            if runs >= N_PLUS_ONE_THRESHOLD]
+
+
+@app.after_request
+def add_server_timing(response):
+    profile = request_query_stats()
+    if SQL_PROFILER_SERVER_TIMING and profile['count']:
+        response.headers.add('Server-Timing', f'db;dur={profile["time"] * 1000:.1f};desc="{profile["count"]} queries"')
+    return response
+
+
+@app.teardown_request
+def check_repeated_statements(exc):
+    # Also runs when Flask-SocketIO pops the request context of an event
+    profile = request_query_stats()
+    repeated = repeated_statements(profile)
+    if not repeated:
+        return
+    origin = _origin()
+    if SQL_PROFILER_STRICT:
+        raise NPlusOneError(f"{origin} ran {profile['count']} queries; repeated: " +
+                            '; '.join(f"{runs}x {_trim(shape)}" for shape, runs in repeated))
+    for shape, runs in repeated:
+        if (_route(), shape) in _reported:
+            continue
+        _reported.add((_route(), shape))
+        slow_query_log.warning(f"possible N+1 in {origin}: {runs} of {profile['count']} queries were {_trim(shape)}")
@@ -9,6 +9,22 @@ let currentRoom = 'general';
 let currentDMUser = null;
 let typingTimer;
 let isTyping = false;
+let lastTypingSent = 0;
+// Re-send start_typing this often while typing, within the server's TYPING_TTL
+const TYPING_REFRESH_MS = 3000;
+// room_id -> {node: [usernames]}; each server worker reports its own typists
+let typingByRoom = {};
+
+// Files chosen with the paperclip button, uploaded when the message is sent
+let pendingFiles = [];
+let uploadingFiles = false;
+// Attempts per upload request before giving up on a flaky connection
+const UPLOAD_MAX_RETRIES = 5;
+
+function csrfToken() {
+    const meta = document.querySelector('meta[name="csrf-token"]');
+    return meta ? meta.content : '';
+}
 
 // --- Mention Autocomplete ---
 let allUsernames = [];
@@ -144,9 +160,71 @@ function showToast(message) {
 // Connect to socket
 socket.on('connect', function() {
     console.log('Connected to server');
-    socket.emit('join_room', {room: 'general'});
+    if (currentRoom) {
+        socket.emit('join_room', {room: currentRoom});
+    }
+    // Typing lists from before the disconnect may never be cleared
+    typingByRoom = {};
+    renderTypingIndicator();
+    if (syncCursor === null) {
+        establishSyncCursor();
+    } else {
+        // Reconnected: fetch whatever was sent while we were away
+        catchUpMissedMessages();
+    }
 });
 
+// --- Reconnect catch-up ---
+// syncCursor is the highest message id this client has seen; /api/sync returns
+// everything newer that the user can see across all rooms and DMs.
+let syncCursor = null;
+
+function establishSyncCursor() {
+    fetch('/api/sync')
+        .then(response => response.json())
+        .then(data => {
+            if (syncCursor === null) syncCursor = data.cursor;
+        });
+}
+
+function advanceSyncCursor(messageId) {
+    if (syncCursor !== null && messageId > syncCursor) syncCursor = messageId;
+}
+
+function isInCurrentView(message) {
+    if (message.is_direct_message) {
+        return currentDMUser !== null &&
+            (String(message.user_id) === String(currentDMUser) || String(message.recipient_id) === String(currentDMUser));
+    }
+    if (!currentRoom) return false;
+    return String(message.room_id) === String(currentRoomId());
+}
+
+function currentRoomId() {
+    if (!currentRoom) return null;
+    const container = document.getElementById('messages-container');
+    return currentRoom === 'general' ? container.getAttribute('data-general-room-id') : currentRoom;
+}
+
+function catchUpMissedMessages() {
+    fetch(`/api/sync?cursor=${syncCursor}`)
+        .then(response => response.json())
+        .then(async page => {
+            for (const message of page.messages || []) {
+                if (!isValidUserMessage(message) || !isInCurrentView(message)) continue;
+                if (document.querySelector(`[data-message-id="${message.id}"]`)) continue;
+                if (message.is_direct_message) {
+                    message.content = await decryptDM(message.content, currentDMUser);
+                }
+                const noMsg = document.getElementById('no-messages');
+                if (noMsg) noMsg.style.display = 'none';
+                addMessageToChat(message);
+            }
+            syncCursor = Math.max(syncCursor, page.cursor);
+            if (page.has_more) catchUpMissedMessages();
+        });
+}
+
 // --- Wispr Chat Main Logic (CSP-safe, robust) ---
 
 // Defensive: Only call addMessageToChat for valid user messages
@@ -162,6 +240,7 @@ function isSystemMessage(data) {
 // Socket event: receive_message
 socket.on('receive_message', function(data) {
     if (isValidUserMessage(data)) {
+        advanceSyncCursor(data.id);
         addMessageToChat(data);
         const noMsg = document.getElementById('no-messages');
         if (noMsg) noMsg.style.display = 'none';
@@ -181,15 +260,15 @@ socket.on('user_disconnected', function(data) {
     addSystemMessage(data.message);
 });
 
-// Handle typing indicators
-socket.on('user_typing', function(data) {
-    if (data.username !== window.CHAT_CONTEXT.username) {
-        showTypingIndicator(data.username);
+// Handle typing indicators: the full typist list for one room from one server node
+socket.on('typing_update', function(data) {
+    const nodes = typingByRoom[data.room_id] || (typingByRoom[data.room_id] = {});
+    if (data.typing.length) {
+        nodes[data.node] = data.typing;
+    } else {
+        delete nodes[data.node];
     }
-});
-
-socket.on('user_stopped_typing', function(data) {
-    hideTypingIndicator();
+    renderTypingIndicator();
 });
 
 // Handle online count updates
@@ -197,6 +276,25 @@ socket.on('online_count_updated', function(data) {
     document.getElementById('online-users').textContent = data.count + ' online';
 });
 
+// Batched presence changes: users whose first tab opened / last tab closed
+socket.on('presence_update', function(data) {
+    document.getElementById('online-users').textContent = data.count + ' online';
+    (data.online || []).forEach(user => {
+        if (user.username && user.username !== window.CHAT_CONTEXT.username) {
+            addSystemMessage(`${escapeHtml(user.username)} joined the chat`);
+        }
+    });
+    (data.offline || []).forEach(user => {
+        if (user.username) addSystemMessage(`${escapeHtml(user.username)} left the chat`);
+    });
+});
+
+// Keep this connection counted as online (server expires silent connections)
+const PRESENCE_HEARTBEAT_INTERVAL = 25000;
+setInterval(function() {
+    if (socket.connected) socket.emit('presence_heartbeat');
+}, PRESENCE_HEARTBEAT_INTERVAL);
+
 // Listen for mention notifications
 socket.on('mention_notification', function(data) {
     const from = escapeHtml(data.from || '');
@@ -302,9 +400,9 @@ if (document.getElementById('message-form')) {
         e.preventDefault();
         const messageInput = document.getElementById('message-input');
         let message = messageInput.value.trim();
-        if (message) {
+        if (message || pendingFiles.length) {
             let encrypted = message;
-            if (currentDMUser) {
+            if (currentDMUser && message) {
                 encrypted = await encryptDM(message, currentDMUser);
             }
             const data = {
@@ -312,6 +410,18 @@ if (document.getElementById('message-form')) {
                 room: currentDMUser ? null : currentRoom,
                 recipient_id: currentDMUser
             };
+            if (pendingFiles.length) {
+                if (uploadingFiles) return;
+                uploadingFiles = true;
+                try {
+                    data.attachments = await uploadPendingFiles();
+                } catch (error) {
+                    showToast(error.message);
+                    return;
+                } finally {
+                    uploadingFiles = false;
+                }
+            }
             // Add parent_id if replying
             if (replyingTo) {
                 data.parent_id = replyingTo.id;
@@ -323,6 +433,7 @@ if (document.getElementById('message-form')) {
                 socket.emit('send_message', data);
             }
             messageInput.value = '';
+            clearPendingFiles();
             cancelReply();
             if (isTyping) {
                 socket.emit('stop_typing', {room: currentRoom});
@@ -332,19 +443,66 @@ if (document.getElementById('message-form')) {
     });
 }
 
+// --- Room history paging ---
+// History is fetched a page at a time; older pages load as the user scrolls up.
+const ROOM_PAGE_SIZE = 50;
+let roomHistory = {room: null, oldestId: null, hasMore: false, loading: false};
+
 // Defensive: Patch loadRoomMessages and loadDirectMessages
 function loadRoomMessages(roomId) {
-    fetch(`/api/room_messages/${roomId}`)
+    roomHistory = {room: roomId, oldestId: null, hasMore: false, loading: true};
+    fetch(`/api/room_messages/${roomId}?limit=${ROOM_PAGE_SIZE}`)
         .then(response => response.json())
-        .then(messages => {
-            if (Array.isArray(messages) && messages.length > 0) {
+        .then(page => {
+            if (roomHistory.room !== roomId) return;  // Switched rooms while loading
+            const messages = Array.isArray(page.messages) ? page.messages : [];
+            roomHistory.hasMore = !!page.has_more;
+            roomHistory.loading = false;
+            if (messages.length > 0) {
+                roomHistory.oldestId = messages[0].id;
                 const noMsg = document.getElementById('no-messages');
                 if (noMsg) noMsg.style.display = 'none';
                 messages.filter(isValidUserMessage).forEach(addMessageToChat);
                 const malformed = messages.filter(m => !isValidUserMessage(m));
                 if (malformed.length > 0) console.warn('[loadRoomMessages] Malformed:', malformed);
             }
-        });
+        })
+        .catch(() => { roomHistory.loading = false; });
+}
+
+function loadOlderRoomMessages() {
+    const roomId = roomHistory.room;
+    if (!roomId || currentRoom !== roomId || roomHistory.loading || !roomHistory.hasMore) return;
+    roomHistory.loading = true;
+    fetch(`/api/room_messages/${roomId}?limit=${ROOM_PAGE_SIZE}&before_id=${roomHistory.oldestId}`)
+        .then(response => response.json())
+        .then(page => {
+            if (roomHistory.room !== roomId) return;
+            const messages = (Array.isArray(page.messages) ? page.messages : []).filter(isValidUserMessage);
+            roomHistory.hasMore = !!page.has_more;
+            roomHistory.loading = false;
+            if (messages.length === 0) return;
+            roomHistory.oldestId = messages[0].id;
+            const container = document.getElementById('messages-container');
+            const previousHeight = container.scrollHeight;
+            const firstMessage = container.querySelector('.message-item');
+            messages.forEach(message => container.insertBefore(buildMessageElement(message), firstMessage));
+            // Keep the viewport anchored on what the user was reading
+            container.scrollTop += container.scrollHeight - previousHeight;
+        })
+        .catch(() => { roomHistory.loading = false; });
+}
+
+if (document.getElementById('messages-container')) {
+    const historyContainer = document.getElementById('messages-container');
+    historyContainer.addEventListener('scroll', function() {
+        if (historyContainer.scrollTop < 80) {
+            loadOlderRoomMessages();
+        }
+    });
+    document.addEventListener('DOMContentLoaded', function() {
+        loadRoomMessages(currentRoom);
+    });
 }
 function loadDirectMessages(userId) {
     fetch(`/api/direct_messages/${userId}`)
@@ -368,8 +526,9 @@ function loadDirectMessages(userId) {
 // Typing detection
 if (document.getElementById('message-input')) {
     document.getElementById('message-input').addEventListener('input', function() {
-        if (!isTyping) {
+        if (!isTyping || Date.now() - lastTypingSent > TYPING_REFRESH_MS) {
             isTyping = true;
+            lastTypingSent = Date.now();
             socket.emit('start_typing', {room: currentRoom});
         }
 
@@ -388,11 +547,116 @@ if (document.getElementById('file-input')) {
     document.getElementById('file-input').addEventListener('change', function(e) {
         const files = e.target.files;
         if (files.length > 0) {
-            showFilePreview(files);
+            pendingFiles = pendingFiles.concat(Array.from(files));
+            showFilePreview(pendingFiles);
         }
+        // Allow picking the same file again
+        this.value = '';
     });
 }
 
+// Upload the selected files and return their attachment tokens
+async function uploadPendingFiles() {
+    const tokens = [];
+    for (const [index, file] of pendingFiles.entries()) {
+        const uploaded = await uploadFileResumable(file, fraction => showUploadProgress(index, fraction));
+        tokens.push(uploaded.token);
+    }
+    return tokens;
+}
+
+function uploadRequest(url, options) {
+    options.headers = Object.assign({'X-CSRFToken': csrfToken()}, options.headers || {});
+    return fetch(url, options).then(response => response.json()
+        .catch(() => ({success: false, error: response.statusText}))
+        .then(data => {
+            if (!data.success) {
+                const error = new Error(data.error || 'Upload failed');
+                error.status = response.status;
+                throw error;
+            }
+            return data;
+        }));
+}
+
+// Retry network errors, server errors and rate limiting with exponential backoff
+async function withRetries(request) {
+    for (let attempt = 1; ; attempt++) {
+        try {
+            return await request();
+        } catch (error) {
+            const transient = !error.status || error.status >= 500 || error.status === 429;
+            if (!transient || attempt >= UPLOAD_MAX_RETRIES) throw error;
+            await new Promise(resolve => setTimeout(resolve, 500 * 2 ** attempt));
+        }
+    }
+}
+
+// Resumable upload: init, PUT the chunks the server is missing, finalize.
+// The upload id is kept in localStorage so a retry after a failure or a
+// page reload continues where it stopped.
+async function uploadFileResumable(file, onProgress) {
+    const key = `wispr-upload:${file.name}:${file.size}:${file.lastModified}`;
+    let upload = null;
+    const savedId = localStorage.getItem(key);
+    if (savedId) {
+        upload = await withRetries(() => uploadRequest(`/api/uploads/${savedId}`, {method: 'GET'}))
+            .catch(() => null);
+    }
+    try {
+        if (!upload) {
+            upload = await withRetries(() => uploadRequest('/api/uploads', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({filename: file.name, size: file.size, file_type: file.type})
+            }));
+            upload.received = [];
+            localStorage.setItem(key, upload.upload_id);
+        }
+        const received = new Set(upload.received);
+        onProgress(received.size / upload.total_chunks);
+        for (let index = 0; index < upload.total_chunks; index++) {
+            if (received.has(index)) continue;
+            const chunk = file.slice(index * upload.chunk_size, (index + 1) * upload.chunk_size);
+            await withRetries(() => uploadRequest(`/api/uploads/${upload.upload_id}/chunks/${index}`, {
+                method: 'PUT',
+                headers: {'Content-Type': 'application/octet-stream'},
+                body: chunk
+            }));
+            received.add(index);
+            onProgress(received.size / upload.total_chunks);
+        }
+        const result = await withRetries(() => uploadRequest(`/api/uploads/${upload.upload_id}/finalize`, {method: 'POST'}));
+        localStorage.removeItem(key);
+        return result.file;
+    } catch (error) {
+        // Rejected outright (bad type, expired, corrupted): start over next time
+        if (error.status && error.status < 500 && error.status !== 429) localStorage.removeItem(key);
+        throw error;
+    }
+}
+
+function showUploadProgress(index, fraction) {
+    const progress = document.querySelector(`#file-preview .upload-progress[data-index="${index}"]`);
+    if (progress) progress.textContent = `${Math.round(fraction * 100)}%`;
+}
+
+function clearPendingFiles() {
+    pendingFiles = [];
+    showFilePreview(pendingFiles);
+}
+
+socket.on('message_error', function(data) {
+    showToast(data.error);
+});
+
+// A message that was shown but could not be stored (e.g. its room was deleted meanwhile)
+socket.on('message_deleted', function(data) {
+    const messageDiv = document.querySelector(`.message-item[data-message-id="${data.message_id}"]`);
+    if (messageDiv) messageDiv.remove();
+    delete messageReactions[data.message_id];
+});
+
 function escapeHtml(text) {
     const map = {
         '&': '&amp;',
@@ -408,14 +672,13 @@ function escapeHtml(text) {
 const ALLOWED_EMOJIS = ['👍', '😂', '😢', '❤️', '🎉'];
 
 function renderReactionBar(messageId, reactions) {
-    const userId = window.CHAT_CONTEXT.user_id;
     let html = '<div class="reaction-bar mt-2 d-flex align-items-center">';
     
     // Show existing reactions with counts
     if (reactions) {
         Object.entries(reactions).forEach(([emoji, data]) => {
             if (data.count > 0) {
-                const active = data.user_ids && data.user_ids.includes(userId);
+                const active = data.me;
                 html += `<button class="reaction-btn btn btn-sm ${active ? 'btn-primary' : 'btn-outline-secondary'} me-1" data-emoji="${emoji}" data-message-id="${messageId}">${emoji} <span class="reaction-count">${data.count}</span></button>`;
             }
         });
@@ -445,14 +708,20 @@ function renderReactionBar(messageId, reactions) {
     return html;
 }
 
-// Store reactions in memory for quick update
+// Store reactions in memory for quick update: {messageId: {emoji: {count, me}}}
 const messageReactions = {};
 
-// Listen for reactions_update events
-socket.on('reactions_update', function(data) {
-    const {message_id, reactions} = data;
-    messageReactions[message_id] = reactions;
-    updateReactionBar(message_id);
+// Apply +1/-1 reaction deltas; `count` is the server's new total
+socket.on('reaction_delta', function(data) {
+    const reactions = messageReactions[data.message_id] = messageReactions[data.message_id] || {};
+    const previous = reactions[data.emoji] || {count: 0, me: false};
+    const me = data.user_id === window.CHAT_CONTEXT.user_id ? data.delta > 0 : previous.me;
+    if (data.count > 0) {
+        reactions[data.emoji] = {count: data.count, me: me};
+    } else {
+        delete reactions[data.emoji];
+    }
+    updateReactionBar(data.message_id);
 });
 
 function updateReactionBar(messageId) {
@@ -463,12 +732,12 @@ function updateReactionBar(messageId) {
     const existingBar = messageDiv.querySelector('.reaction-bar');
     if (existingBar) {
         existingBar.outerHTML = renderReactionBar(messageId, messageReactions[messageId] || {});
-        attachReactionHandlers(messageId);
+        attachReactionHandlers(messageId, messageDiv);
     }
 }
 
-function attachReactionHandlers(messageId) {
-    const messageDiv = document.querySelector(`[data-message-id="${messageId}"]`);
+function attachReactionHandlers(messageId, messageDiv) {
+    messageDiv = messageDiv || document.querySelector(`[data-message-id="${messageId}"]`);
     if (!messageDiv) return;
     
     // Handle existing reaction buttons
@@ -478,7 +747,7 @@ function attachReactionHandlers(messageId) {
             const emoji = this.getAttribute('data-emoji');
             const reactions = messageReactions[messageId] || {};
             const userId = window.CHAT_CONTEXT.user_id;
-            const userReacted = reactions[emoji] && reactions[emoji].user_ids && reactions[emoji].user_ids.includes(userId);
+            const userReacted = Boolean(reactions[emoji] && reactions[emoji].me);
             
             console.log('Reaction click:', {
                 emoji,
@@ -518,7 +787,7 @@ function attachReactionHandlers(messageId) {
                 const emoji = this.getAttribute('data-emoji');
                 const reactions = messageReactions[messageId] || {};
                 const userId = window.CHAT_CONTEXT.user_id;
-                const userReacted = reactions[emoji] && reactions[emoji].user_ids && reactions[emoji].user_ids.includes(userId);
+                const userReacted = Boolean(reactions[emoji] && reactions[emoji].me);
                 
                 console.log('Emoji option click:', {
                     emoji,
@@ -592,6 +861,14 @@ socket.on('user_status_update', function(data) {
     });
 });
 
+// A new profile picture has new (versioned) URLs; swap it into messages on screen
+socket.on('user_avatar_updated', function(data) {
+    if (!data.username) return;
+    document.querySelectorAll('img[data-avatar-user]').forEach(img => {
+        if (img.getAttribute('data-avatar-user') === data.username) img.src = data.avatar_url;
+    });
+});
+
 // Defensive addMessageToChat
 window.origAddMessageToChat_status = window.addMessageToChat;
 window.addMessageToChat = function(data) {
@@ -599,10 +876,16 @@ window.addMessageToChat = function(data) {
         console.warn('[addMessageToChat] Malformed or system message:', data);
         return;
     }
+    const messagesContainer = document.getElementById('messages-container');
+    messagesContainer.appendChild(buildMessageElement(data));
+    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+};
+
+// Build the DOM node for a chat message (shared by live and history rendering)
+function buildMessageElement(data) {
     // Store the original username for status lookup
     data.raw_username = data.raw_username || data.username;
     const uname = (data.raw_username || data.username).toLowerCase();
-    const messagesContainer = document.getElementById('messages-container');
     const messageDiv = document.createElement('div');
     messageDiv.className = 'message-item border-bottom pb-3 mb-3';
     messageDiv.setAttribute('data-message-id', data.id);
@@ -624,11 +907,16 @@ window.addMessageToChat = function(data) {
     if (isReply && data.parent_username && data.parent_content) {
         parentPreview = `\n            <div class=\"reply-preview mb-2 p-2 bg-light rounded\" style=\"font-size: 0.9em; border-left: 3px solid #007bff;\">\n                <small class=\"text-muted\">Replying to <strong>${escapeHtml(data.parent_username)}</strong></small>\n                <div class=\"text-truncate\">${escapeHtml(data.parent_content)}</div>\n            </div>\n        `;
     }
-    let avatarUrl = data.profile_pic ? `/uploads/${data.profile_pic}` : '/static/default_avatar.png';
-    messageDiv.innerHTML = `\n        ${parentPreview}\n        <div class=\"d-flex align-items-center mb-1\">\n            <img src=\"${avatarUrl}\" class=\"rounded-circle me-2\" width=\"32\" height=\"32\" alt=\"avatar\">\n            <strong class=\"me-2\">${escapeHtml(data.username)}</strong>\n            <span class=\"text-muted small\">${timestamp}</span>\n            <div class=\"ms-auto message-actions\">\n                ${isOwnMessage ? `\n                <button class=\"btn btn-sm btn-outline-primary me-1\" onclick=\"editMessage(${data.id}, '${escapeHtml(data.content).replace(/'/g, "\\'")}')\">\n                    <i class=\"bi bi-pencil\"></i>\n                </button>\n                <button class=\"btn btn-sm btn-outline-danger\" onclick=\"deleteMessage(${data.id})\">\n                    <i class=\"bi bi-trash\"></i>\n                </button>\n                ` : ''}\n            </div>\n        </div>\n        <div class=\"message-content mt-2\">\n            <p class=\"mb-0\" id=\"message-content-${data.id}\">${escapeHtml(data.content).replace(/\n/g, '<br>')}</p>\n            ${data.attachments ? renderAttachments(data.attachments) : ''}\n        </div>\n    `;
-    messagesContainer.appendChild(messageDiv);
-    messagesContainer.scrollTop = messagesContainer.scrollHeight;
-};
+    let avatarUrl = data.avatar_url || '/static/default_avatar.png';
+    messageDiv.innerHTML = `\n        ${parentPreview}\n        <div class=\"d-flex align-items-center mb-1\">\n            <img src=\"${avatarUrl}\" class=\"rounded-circle me-2\" width=\"32\" height=\"32\" alt=\"avatar\" data-avatar-user=\"${escapeHtml(data.username || '')}\">\n            <strong class=\"me-2\">${escapeHtml(data.username)}</strong>\n            <span class=\"text-muted small\">${timestamp}</span>\n            <div class=\"ms-auto message-actions\">\n                ${isOwnMessage ? `\n                <button class=\"btn btn-sm btn-outline-primary me-1\" onclick=\"editMessage(${data.id}, '${escapeHtml(data.content).replace(/'/g, "\\'")}')\">\n                    <i class=\"bi bi-pencil\"></i>\n                </button>\n                <button class=\"btn btn-sm btn-outline-danger\" onclick=\"deleteMessage(${data.id})\">\n                    <i class=\"bi bi-trash\"></i>\n                </button>\n                ` : ''}\n            </div>\n        </div>\n        <div class=\"message-content mt-2\">\n            <p class=\"mb-0\" id=\"message-content-${data.id}\">${escapeHtml(data.content).replace(/\n/g, '<br>')}</p>\n            ${data.attachments ? renderAttachments(data.attachments) : ''}\n        </div>\n    `;
+    // Reactions are only supported on room messages
+    if (!data.is_direct_message && data.id) {
+        messageReactions[data.id] = data.reactions || {};
+        messageDiv.insertAdjacentHTML('beforeend', renderReactionBar(data.id, messageReactions[data.id]));
+        attachReactionHandlers(data.id, messageDiv);
+    }
+    return messageDiv;
+}
 
 function addSystemMessage(message) {
     const messagesContainer = document.getElementById('messages-container');
@@ -651,6 +939,8 @@ function switchToDM(userId, username) {
     if (dmItem) dmItem.classList.add('active');
     currentDMUser = userId;
     currentRoom = null;
+    roomHistory.room = null;
+    renderTypingIndicator();
     document.getElementById('chat-title').innerHTML = `<i class="bi bi-person-circle"></i> ${username}`;
     clearMessages();
     loadDirectMessages(userId);
@@ -664,10 +954,13 @@ function switchRoom(roomId, roomName) {
     });
     const roomItem = document.querySelector(`[data-room="${roomId}"]`);
     if (roomItem) roomItem.classList.add('active');
+    // Updates for the room being left stop arriving, so drop its typists
+    delete typingByRoom[currentRoomId()];
     socket.emit('leave_room', {room: currentRoom});
     socket.emit('join_room', {room: roomId});
     currentRoom = roomId;
     currentDMUser = null;
+    renderTypingIndicator();
     document.getElementById('chat-title').innerHTML = `<i class="bi bi-hash"></i> ${roomName}`;
     clearMessages();
     loadRoomMessages(roomId);
@@ -678,49 +971,73 @@ function clearMessages() {
     container.innerHTML = '<div class="text-center text-muted py-5" id="no-messages"><i class="bi bi-chat-dots fs-1"></i><h4>No messages yet</h4><p>Be the first to start the conversation!</p></div>';
 }
 
-function showTypingIndicator(username) {
+function renderTypingIndicator() {
     const indicator = document.getElementById('typing-indicator');
-    indicator.textContent = `${username} is typing...`;
+    if (!indicator) return;
+    const nodes = currentDMUser ? {} : (typingByRoom[currentRoomId()] || {});
+    const names = [...new Set(Object.values(nodes).flat())]
+        .filter(name => name !== window.CHAT_CONTEXT.username);
+    if (!names.length) {
+        indicator.style.display = 'none';
+        return;
+    }
+    if (names.length === 1) {
+        indicator.textContent = `${names[0]} is typing...`;
+    } else if (names.length <= 3) {
+        indicator.textContent = `${names.slice(0, -1).join(', ')} and ${names[names.length - 1]} are typing...`;
+    } else {
+        indicator.textContent = 'Several people are typing...';
+    }
     indicator.style.display = 'inline';
 }
 
-function hideTypingIndicator() {
-    document.getElementById('typing-indicator').style.display = 'none';
-}
-
 function showFilePreview(files) {
     const preview = document.getElementById('file-preview');
     preview.innerHTML = '';
 
-    Array.from(files).forEach(file => {
+    files.forEach((file, index) => {
         const fileDiv = document.createElement('div');
         fileDiv.className = 'badge bg-secondary me-2 mb-2';
-        fileDiv.innerHTML = `<i class="bi bi-file-earmark"></i> ${file.name} <span onclick="removeFile(this)" style="cursor: pointer;">×</span>`;
+        fileDiv.innerHTML = `<i class="bi bi-file-earmark"></i> ${escapeHtml(file.name)} <span class="upload-progress" data-index="${index}"></span> <span onclick="removeFile(${index})" style="cursor: pointer;">×</span>`;
         preview.appendChild(fileDiv);
     });
 
-    preview.style.display = 'block';
+    preview.style.display = files.length ? 'block' : 'none';
 }
 
-function removeFile(element) {
-    element.parentElement.remove();
-    const preview = document.getElementById('file-preview');
-    if (preview.children.length === 0) {
-        preview.style.display = 'none';
-        document.getElementById('file-input').value = '';
-    }
+function removeFile(index) {
+    if (uploadingFiles) return;
+    pendingFiles.splice(index, 1);
+    showFilePreview(pendingFiles);
 }
 
 function renderAttachments(attachments) {
     if (!attachments || attachments.length === 0) return '';
 
-    return '<div class="mt-2">' + attachments.map(att => 
-        `<a href="/download/${att.id}" class="badge bg-light text-dark me-2">
-            <i class="bi bi-download"></i> ${att.original_filename}
-        </a>`
-    ).join('') + '</div>';
+    return '<div class="mt-2">' + attachments.map(renderAttachment).join('') + '</div>';
 }
 
+// Thumbnail when the server has one (sized up front so the layout does not jump), else a download badge
+function renderAttachment(att) {
+    if (att.preview) {
+        return `<a href="/download/${att.id}" class="d-inline-block me-2 mb-2 attachment-thumb" data-attachment-id="${att.id}" title="${escapeHtml(att.original_filename)}">
+            <img src="/thumbnail/${att.id}" width="${att.preview.thumb_width}" height="${att.preview.thumb_height}"
+                 loading="lazy" class="rounded border" style="max-width: 100%; height: auto;" alt="${escapeHtml(att.original_filename)}">
+        </a>`;
+    }
+    return `<a href="/download/${att.id}" class="badge bg-light text-dark me-2" data-attachment-id="${att.id}">
+            <i class="bi bi-download"></i> ${escapeHtml(att.original_filename)}
+        </a>`;
+}
+
+// A thumbnail finished rendering after the message was shown
+socket.on('attachment_preview', function(data) {
+    document.querySelectorAll(`[data-attachment-id="${data.attachment_id}"]`).forEach(element => {
+        const name = element.getAttribute('title') || element.textContent.trim();
+        element.outerHTML = renderAttachment({id: data.attachment_id, original_filename: name, preview: data.preview});
+    });
+});
+
 // Create room form
 if (document.getElementById('create-room-form')) {
     document.getElementById('create-room-form').addEventListener('submit', function(e) {
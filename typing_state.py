@@ -0,0 +1,79 @@
+"""Per-room typing indicators, coalesced on the server.
+
+Start/stop events only update an in-memory map of who is typing in which
+room. Repeated start events from someone already typing just extend their
+entry, entries that are not refreshed within TYPING_TTL seconds expire, and
+a background task sends one ``typing_update`` per changed room every
+TYPING_FLUSH_INTERVAL seconds with the full list of typists.
+
+State is per worker. Each update carries this worker's ``node`` id and
+lists only the typists it knows about; clients merge the lists by node.
+"""
+import os
+import threading
+import time
+import uuid
+
+# Seconds a typist stays listed without another start_typing event
+TYPING_TTL = float(os.environ.get('TYPING_TTL', 6))
+# Seconds between aggregated typing broadcasts
+TYPING_FLUSH_INTERVAL = float(os.environ.get('TYPING_FLUSH_INTERVAL', 0.5))
+
+
+class TypingManager:
+    """room_id -> {user_id: (username, expires_at, sid)} with dirty-room tracking"""
+
+    def __init__(self, ttl=TYPING_TTL):
+        self.ttl = ttl
+        self.node_id = uuid.uuid4().hex[:12]
+        self._rooms = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def start(self, room_id, user_id, username, sid):
+        """Mark a user as typing from connection sid; only a new typist changes the room's list"""
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            typists = self._rooms.setdefault(room_id, {})
+            if user_id not in typists:
+                self._dirty.add(room_id)
+            typists[user_id] = (username, expires_at, sid)
+
+    def stop(self, room_id, user_id):
+        with self._lock:
+            typists = self._rooms.get(room_id)
+            if typists and typists.pop(user_id, None) is not None:
+                self._dirty.add(room_id)
+                if not typists:
+                    del self._rooms[room_id]
+
+    def forget_connection(self, sid):
+        """Drop whoever was typing from a closed connection, leaving their other tabs listed"""
+        with self._lock:
+            for room_id, typists in list(self._rooms.items()):
+                for user_id, (_, _, typing_sid) in list(typists.items()):
+                    if typing_sid == sid:
+                        del typists[user_id]
+                        self._dirty.add(room_id)
+                if not typists:
+                    del self._rooms[room_id]
+
+    def take_updates(self):
+        """Expire stale typists and return {room_id: [usernames]} for changed rooms"""
+        now = time.monotonic()
+        with self._lock:
+            for room_id, typists in list(self._rooms.items()):
+                for user_id, (_, expires_at, _) in list(typists.items()):
+                    if expires_at <= now:
+                        del typists[user_id]
+                        self._dirty.add(room_id)
+                if not typists:
+                    del self._rooms[room_id]
+            dirty, self._dirty = self._dirty, set()
+            return {
+                room_id: sorted(username for username, _, _ in self._rooms.get(room_id, {}).values())
+                for room_id in dirty
+            }
+
+
+typing_manager = TypingManager()